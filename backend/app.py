@@ -15,15 +15,23 @@ from logger import setup_logger
 logger = setup_logger("app")
 
 async def run_server(host: str, port: int):
-    async with websockets.serve(
-        server_mod.handler,
-        host,
-        port,
-        origins=None,
-        max_size=8 * 1024 * 1024,
-    ):
-        logger.info("Server listening on ws://%s:%d/ws", host, port)
-        await asyncio.Future()  # run forever
+    await server_mod.open_http_session()
+    server_mod.metadata.start()
+    idle_task = asyncio.create_task(server_mod.manager.close_idle_writers())
+    try:
+        async with websockets.serve(
+            server_mod.handler,
+            host,
+            port,
+            origins=None,
+            max_size=8 * 1024 * 1024,
+        ):
+            logger.info("Server listening on ws://%s:%d/ws", host, port)
+            await asyncio.Future()  # run forever
+    finally:
+        idle_task.cancel()
+        await server_mod.close_http_session()
+        await server_mod.metadata.stop()
 
 
 async def run_client(ws_url: str, file_paths: list, file_id: str | None, chunk: int, interactive: bool):
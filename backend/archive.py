@@ -0,0 +1,97 @@
+import os
+import time
+import zipfile
+from pathlib import Path
+from typing import Iterable, Iterator, List, Tuple
+
+from logger import setup_logger
+
+logger = setup_logger("archive")
+
+# Tải nhiều file/folder dưới dạng ZIP được stream trực tiếp, không tạo file tạm
+ARCHIVE_READ_SIZE = int(os.environ.get("ARCHIVE_READ_SIZE", str(1024 * 1024)))  # byte mỗi lần đọc file nguồn
+
+# Định dạng đã nén sẵn: lưu nguyên (store), deflate chỉ tốn CPU mà không nhỏ đi
+STORED_EXTENSIONS = {
+    '.zip', '.rar', '.7z', '.gz', '.tgz', '.bz2', '.xz', '.zst',
+    '.jpg', '.jpeg', '.png', '.gif', '.webp', '.heic',
+    '.mp4', '.mkv', '.mov', '.avi', '.webm', '.mp3', '.aac', '.ogg', '.flac', '.m4a',
+    '.pdf', '.docx', '.xlsx', '.pptx', '.odt', '.apk', '.jar',
+}
+
+# Entry lớn hơn ngưỡng này cần ZIP64 (zipfile phải biết trước khi ghi vào stream không seek được)
+ZIP64_THRESHOLD = zipfile.ZIP64_LIMIT
+
+
+class _StreamBuffer:
+    """Đích ghi của ZipFile: gom byte đã ghi để generator lấy ra và yield ngay
+
+    Không có seek/tell nên zipfile ghi ở chế độ stream (data descriptor sau mỗi entry).
+    """
+
+    def __init__(self) -> None:
+        self.chunks: List[bytes] = []
+
+    def write(self, data) -> int:
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self) -> None:
+        pass
+
+    def drain(self) -> bytes:
+        data = b"".join(self.chunks)
+        self.chunks.clear()
+        return data
+
+
+def unique_arcname(name: str, used: set) -> str:
+    """Tên entry không trùng trong archive: thêm " (1)", " (2)"... trước phần mở rộng"""
+    candidate = name
+    stem, ext = os.path.splitext(name)
+    counter = 1
+    while candidate.lower() in used:
+        candidate = f"{stem} ({counter}){ext}"
+        counter += 1
+    used.add(candidate.lower())
+    return candidate
+
+
+def stream_zip(entries: Iterable[Tuple[str, Path]]) -> Iterator[bytes]:
+    """Sinh các khối byte của file ZIP chứa entries (arcname, đường dẫn trên đĩa)
+
+    Bộ nhớ dùng không phụ thuộc số file/kích thước: mỗi lần chỉ giữ một khối đọc từ file nguồn
+    (và phần nén tương ứng). File biến mất giữa chừng được bỏ qua.
+    """
+    buffer = _StreamBuffer()
+    count = 0
+    started = time.monotonic()
+    with zipfile.ZipFile(buffer, mode="w", allowZip64=True) as zf:
+        for arcname, path in entries:
+            try:
+                source = open(path, "rb")
+            except OSError as e:
+                logger.warning("Skipping %s in archive: %s", path, e)
+                continue
+            with source:
+                stat = os.fstat(source.fileno())
+                info = zipfile.ZipInfo(arcname, date_time=time.localtime(max(stat.st_mtime, 315532800))[:6])
+                info.external_attr = 0o644 << 16
+                if Path(arcname).suffix.lower() in STORED_EXTENSIONS:
+                    info.compress_type = zipfile.ZIP_STORED
+                else:
+                    info.compress_type = zipfile.ZIP_DEFLATED
+                with zf.open(info, mode="w", force_zip64=stat.st_size >= ZIP64_THRESHOLD) as dest:
+                    while True:
+                        data = source.read(ARCHIVE_READ_SIZE)
+                        if not data:
+                            break
+                        dest.write(data)
+                        if buffer.chunks:
+                            yield buffer.drain()
+            count += 1
+            if buffer.chunks:
+                yield buffer.drain()
+    # Central directory được ghi khi đóng ZipFile
+    yield buffer.drain()
+    logger.info("Streamed ZIP with %d files in %.2fs", count, time.monotonic() - started)
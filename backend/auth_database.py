@@ -5,73 +5,77 @@ import os
 from datetime import datetime
 import logging
 
+from db_pool import get_pool
+from token_cache import TokenCache
+
 class AuthDatabase:
     def __init__(self, db_path="auth.db"):
         self.db_path = db_path
+        self.pool = get_pool(db_path)
+        self.token_cache = TokenCache()
         self.init_database()
     
     def init_database(self):
         """Khởi tạo database với các bảng cần thiết"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        # Tạo bảng users
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS users (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                username TEXT UNIQUE NOT NULL,
-                password_hash TEXT NOT NULL,
-                role TEXT DEFAULT 'user',
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                last_login TIMESTAMP
-            )
-        ''')
-        
-        # Tạo bảng files (cập nhật từ JSON sang SQL)
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS files (
-                id TEXT PRIMARY KEY,
-                filename TEXT NOT NULL,
-                original_filename TEXT NOT NULL,
-                path TEXT NOT NULL,
-                size INTEGER,
-                mimetype TEXT,
-                user_id INTEGER NOT NULL,
-                folder_id TEXT,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (user_id) REFERENCES users (id),
-                FOREIGN KEY (folder_id) REFERENCES folders (id)
-            )
-        ''')
+        with self.pool.connect() as conn:
+            cursor = conn.cursor()
         
-        # Tạo bảng folders (cập nhật từ JSON sang SQL)
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS folders (
-                id TEXT PRIMARY KEY,
-                name TEXT NOT NULL,
-                path TEXT NOT NULL,
-                parent_id TEXT,
-                user_id INTEGER NOT NULL,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (user_id) REFERENCES users (id),
-                FOREIGN KEY (parent_id) REFERENCES folders (id)
-            )
-        ''')
-        
-        # Tạo bảng sessions để quản lý đăng nhập
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS sessions (
-                id TEXT PRIMARY KEY,
-                user_id INTEGER NOT NULL,
-                token TEXT UNIQUE NOT NULL,
-                expires_at TIMESTAMP NOT NULL,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (user_id) REFERENCES users (id)
-            )
-        ''')
+            # Tạo bảng users
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS users (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    username TEXT UNIQUE NOT NULL,
+                    password_hash TEXT NOT NULL,
+                    role TEXT DEFAULT 'user',
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    last_login TIMESTAMP
+                )
+            ''')
+        
+            # Tạo bảng files (cập nhật từ JSON sang SQL)
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS files (
+                    id TEXT PRIMARY KEY,
+                    filename TEXT NOT NULL,
+                    original_filename TEXT NOT NULL,
+                    path TEXT NOT NULL,
+                    size INTEGER,
+                    mimetype TEXT,
+                    user_id INTEGER NOT NULL,
+                    folder_id TEXT,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    FOREIGN KEY (user_id) REFERENCES users (id),
+                    FOREIGN KEY (folder_id) REFERENCES folders (id)
+                )
+            ''')
+        
+            # Tạo bảng folders (cập nhật từ JSON sang SQL)
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS folders (
+                    id TEXT PRIMARY KEY,
+                    name TEXT NOT NULL,
+                    path TEXT NOT NULL,
+                    parent_id TEXT,
+                    user_id INTEGER NOT NULL,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    FOREIGN KEY (user_id) REFERENCES users (id),
+                    FOREIGN KEY (parent_id) REFERENCES folders (id)
+                )
+            ''')
+        
+            # Tạo bảng sessions để quản lý đăng nhập
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS sessions (
+                    id TEXT PRIMARY KEY,
+                    user_id INTEGER NOT NULL,
+                    token TEXT UNIQUE NOT NULL,
+                    expires_at TIMESTAMP NOT NULL,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    FOREIGN KEY (user_id) REFERENCES users (id)
+                )
+            ''')
+            cursor.execute('CREATE INDEX IF NOT EXISTS idx_sessions_expires ON sessions(expires_at)')
         
-        conn.commit()
-        conn.close()
         logging.info("Database initialized successfully")
     
     def hash_password(self, password):
@@ -116,41 +120,33 @@ class AuthDatabase:
     
     def create_user(self, username, password, role='user'):
         """Tạo user mới"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
         try:
             password_hash = self.hash_password(password)
-            cursor.execute('''
-                INSERT INTO users (username, password_hash, role)
-                VALUES (?, ?, ?)
-            ''', (username, password_hash, role))
-            
-            user_id = cursor.lastrowid
-            conn.commit()
+            with self.pool.connect() as conn:
+                cursor = conn.execute('''
+                    INSERT INTO users (username, password_hash, role)
+                    VALUES (?, ?, ?)
+                ''', (username, password_hash, role))
+                user_id = cursor.lastrowid
             logging.info(f"User created: {username} (ID: {user_id})")
             return user_id
         except sqlite3.IntegrityError:
             logging.warning(f"Username already exists: {username}")
             return None
-        finally:
-            conn.close()
     
     def authenticate_user(self, username, password):
         """Xác thực user login"""
         # SECURITY FIX: Do not log sensitive data
         logging.info(f"🔍 AUTH: Authentication attempt for username: {username}")
         
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            SELECT id, username, password_hash, role
-            FROM users 
-            WHERE username = ?
-        ''', (username,))
+        with self.pool.connect() as conn:
+            cursor = conn.execute('''
+                SELECT id, username, password_hash, role
+                FROM users 
+                WHERE username = ?
+            ''', (username,))
+            user = cursor.fetchone()
         
-        user = cursor.fetchone()
         logging.debug(f"🔍 AUTH: User found in DB: {user is not None}")
         
         if user:
@@ -161,7 +157,6 @@ class AuthDatabase:
             logging.debug(f"🔍 AUTH: Password verification: {password_valid}")
             
             if password_valid:
-                conn.close()
                 # Update last login
                 self.update_last_login(user[0])
                 return {
@@ -170,23 +165,17 @@ class AuthDatabase:
                     'role': user[3]
                 }
         
-        conn.close()
         print(f"🔍 AUTH: Authentication failed for username='{username}'")
         return None
     
     def update_last_login(self, user_id):
         """Cập nhật thời gian login cuối"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            UPDATE users 
-            SET last_login = CURRENT_TIMESTAMP 
-            WHERE id = ?
-        ''', (user_id,))
-        
-        conn.commit()
-        conn.close()
+        with self.pool.connect() as conn:
+            conn.execute('''
+                UPDATE users 
+                SET last_login = CURRENT_TIMESTAMP 
+                WHERE id = ?
+            ''', (user_id,))
     
     def create_session(self, user_id):
         """Tạo session token cho user"""
@@ -197,76 +186,70 @@ class AuthDatabase:
         from datetime import datetime, timedelta
         expires_at = datetime.now() + timedelta(hours=24)
         
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            INSERT INTO sessions (id, user_id, token, expires_at)
-            VALUES (?, ?, ?, ?)
-        ''', (session_id, user_id, token, expires_at))
-        
-        conn.commit()
-        conn.close()
+        with self.pool.connect() as conn:
+            conn.execute('''
+                INSERT INTO sessions (id, user_id, token, expires_at)
+                VALUES (?, ?, ?, ?)
+            ''', (session_id, user_id, token, expires_at))
         
         return token
     
     def get_user_by_token(self, token):
         """Lấy thông tin user từ session token"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            SELECT u.id, u.username, u.role, s.expires_at
-            FROM users u
-            JOIN sessions s ON u.id = s.user_id
-            WHERE s.token = ? AND s.expires_at > CURRENT_TIMESTAMP
-        ''', (token,))
-        
-        result = cursor.fetchone()
-        conn.close()
+        cached = self.token_cache.get(token)
+        if cached:
+            return cached
+        
+        with self.pool.connect() as conn:
+            cursor = conn.execute('''
+                SELECT u.id, u.username, u.role, s.expires_at
+                FROM users u
+                JOIN sessions s ON u.id = s.user_id
+                WHERE s.token = ? AND s.expires_at > CURRENT_TIMESTAMP
+            ''', (token,))
+            result = cursor.fetchone()
         
         if result:
-            return {
+            user = {
                 'id': result[0],
                 'username': result[1],
                 'role': result[2],
                 'expires_at': result[3]
             }
+            self.token_cache.put(token, user)
+            return user
         return None
     
     def invalidate_session(self, token):
         """Xóa session (logout)"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        cursor.execute('DELETE FROM sessions WHERE token = ?', (token,))
-        
-        conn.commit()
-        conn.close()
+        with self.pool.connect() as conn:
+            conn.execute('DELETE FROM sessions WHERE token = ?', (token,))
+        self.token_cache.invalidate_token(token)
     
-    def cleanup_expired_sessions(self):
-        """Dọn dẹp các session hết hạn"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        cursor.execute('DELETE FROM sessions WHERE expires_at <= CURRENT_TIMESTAMP')
-        
-        conn.commit()
-        conn.close()
+    def cleanup_expired_sessions(self, batch_size=1000):
+        """Dọn dẹp các session hết hạn theo lô (mỗi lô một transaction ngắn); trả về số session đã xóa"""
+        deleted = 0
+        while True:
+            with self.pool.connect() as conn:
+                cursor = conn.execute('''
+                    DELETE FROM sessions WHERE rowid IN (
+                        SELECT rowid FROM sessions WHERE expires_at <= CURRENT_TIMESTAMP LIMIT ?
+                    )
+                ''', (batch_size,))
+                count = cursor.rowcount
+            deleted += count
+            if count < batch_size:
+                return deleted
     
     def get_all_users(self):
         """Lấy danh sách tất cả users (cho admin)"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            SELECT id, username, role, created_at, last_login
-            FROM users
-            ORDER BY id ASC
-        ''')
-        
-        results = cursor.fetchall()
-        conn.close()
+        with self.pool.connect() as conn:
+            cursor = conn.execute('''
+                SELECT id, username, role, created_at, last_login
+                FROM users
+                ORDER BY id ASC
+            ''')
+            results = cursor.fetchall()
         
         users = []
         for row in results:
@@ -282,42 +265,39 @@ class AuthDatabase:
     
     def delete_user(self, user_id):
         """Xóa user (cho admin)"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        # Xóa sessions của user trước
-        cursor.execute('DELETE FROM sessions WHERE user_id = ?', (user_id,))
-        
-        # Xóa user
-        cursor.execute('DELETE FROM users WHERE id = ?', (user_id,))
-        
-        success = cursor.rowcount > 0
-        conn.commit()
-        conn.close()
+        with self.pool.connect() as conn:
+            cursor = conn.cursor()
+            
+            # Xóa sessions của user trước
+            cursor.execute('DELETE FROM sessions WHERE user_id = ?', (user_id,))
+            
+            # Xóa user
+            cursor.execute('DELETE FROM users WHERE id = ?', (user_id,))
+            
+            success = cursor.rowcount > 0
         
+        self.token_cache.invalidate_user(user_id)
         return success
     
     def reset_password(self, user_id, new_password):
         """Reset password của user (cho admin)"""
         password_hash = self.hash_password(new_password)
         
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            UPDATE users 
-            SET password_hash = ?
-            WHERE id = ?
-        ''', (password_hash, user_id))
-        
-        success = cursor.rowcount > 0
-        
-        # Xóa tất cả sessions của user để force re-login
-        cursor.execute('DELETE FROM sessions WHERE user_id = ?', (user_id,))
-        
-        conn.commit()
-        conn.close()
+        with self.pool.connect() as conn:
+            cursor = conn.cursor()
+            
+            cursor.execute('''
+                UPDATE users 
+                SET password_hash = ?
+                WHERE id = ?
+            ''', (password_hash, user_id))
+            
+            success = cursor.rowcount > 0
+            
+            # Xóa tất cả sessions của user để force re-login
+            cursor.execute('DELETE FROM sessions WHERE user_id = ?', (user_id,))
         
+        self.token_cache.invalidate_user(user_id)
         return success
 
 # Test function để tạo admin user
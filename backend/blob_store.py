@@ -0,0 +1,164 @@
+import hashlib
+import os
+import time
+import uuid
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Iterable, Optional
+
+from hashing import HASH_SHA256
+from logger import setup_logger
+
+logger = setup_logger("blob_store")
+
+# Kho blob theo nội dung trong remote_uploads: .blobs/sha256/<2 hex>/<2 hex>/<sha256>
+# Tên bắt đầu bằng "." nên không trùng thư mục của user nào (username chỉ gồm chữ, số, _ và -)
+BLOB_DIR_NAME = ".blobs"
+BLOB_HASH_ALGORITHM = HASH_SHA256
+
+
+def is_blob_path(file_path: Optional[str]) -> bool:
+    """file_path (tương đối trong remote_uploads) có trỏ tới blob không"""
+    return bool(file_path) and file_path.replace("\\", "/").startswith(BLOB_DIR_NAME + "/")
+
+
+def blob_relative_path(digest: str) -> str:
+    return f"{BLOB_DIR_NAME}/{BLOB_HASH_ALGORITHM}/{digest[:2]}/{digest[2:4]}/{digest}"
+
+
+class BlobWriter:
+    """Ghi nội dung upload vào file tạm trong kho, tính sha256 trong lúc ghi
+
+    hasher/size cho phép ghi tiếp một file tạm đã có size byte (upload resumable).
+    """
+
+    def __init__(self, temp_path: Path, hasher=None, size: int = 0) -> None:
+        self.temp_path = temp_path
+        self.file = open(temp_path, "ab" if size else "wb")
+        self.hasher = hasher if hasher is not None else hashlib.sha256()
+        self.size = size
+
+    def write(self, data: bytes) -> None:
+        self.file.write(data)
+        self.hasher.update(data)
+        self.size += len(data)
+
+    def close(self) -> None:
+        if not self.file.closed:
+            self.file.close()
+
+    def discard(self) -> None:
+        self.close()
+        self.temp_path.unlink(missing_ok=True)
+
+    def hexdigest(self) -> str:
+        return self.hasher.hexdigest()
+
+
+class BlobStore:
+    """Kho file theo nội dung, đếm tham chiếu trong bảng blobs của files.db
+
+    refcount do trigger trên files/recycle_bin cập nhật trong cùng transaction với metadata;
+    blob có refcount 0 được collect() xóa. store() và collect() chạy trong transaction ghi
+    (SQLite chỉ cho một writer) nên blob không bị xóa trong lúc một upload trùng nội dung
+    đang tham chiếu lại nó, kể cả giữa nhiều process.
+    """
+
+    def __init__(self, upload_folder: Path, db) -> None:
+        self.upload_folder = upload_folder
+        self.db = db
+        self.temp_dir = upload_folder / BLOB_DIR_NAME / "tmp"
+        self.temp_dir.mkdir(parents=True, exist_ok=True)
+
+    def open_writer(self) -> BlobWriter:
+        return BlobWriter(self.temp_dir / f"{uuid.uuid4().hex}.tmp")
+
+    @contextmanager
+    def store(self, writer: BlobWriter):
+        """Đưa nội dung của writer vào kho, yield file_path của blob
+
+        Caller ghi metadata tham chiếu blob ngay trong khối with: cùng một transaction với việc
+        đặt blob. Nội dung đã có sẵn thì file tạm bị bỏ (không tốn thêm dung lượng đĩa).
+        """
+        writer.close()
+        digest = writer.hexdigest()
+        relative_path = blob_relative_path(digest)
+        blob_path = self.upload_folder / relative_path
+        created = False
+        try:
+            with self.db.pool.connect() as conn:
+                # Lệnh ghi đầu tiên giữ khóa ghi của DB tới khi commit
+                conn.execute("""
+                    INSERT INTO blobs (path, size) VALUES (?, ?)
+                    ON CONFLICT (path) DO UPDATE SET size = excluded.size
+                """, (relative_path, writer.size))
+                if not blob_path.exists():
+                    blob_path.parent.mkdir(parents=True, exist_ok=True)
+                    os.replace(writer.temp_path, blob_path)
+                    created = True
+                yield relative_path
+        except BaseException:
+            # Rollback: trả nội dung về file tạm, caller quyết định bỏ (discard) hay thử lại
+            if created:
+                os.replace(blob_path, writer.temp_path)
+            raise
+        if not created:
+            writer.discard()
+            logger.info("Blob deduplicated: %s (%d bytes)", digest, writer.size)
+
+    def collect(self, batch_size: int = 500) -> int:
+        """Xóa các blob không còn được tham chiếu (refcount <= 0); trả về số blob đã xóa"""
+        removed = 0
+        while True:
+            with self.db.pool.connect() as conn:
+                paths = [row[0] for row in conn.execute("""
+                    DELETE FROM blobs WHERE path IN (
+                        SELECT path FROM blobs WHERE refcount <= 0 LIMIT ?
+                    ) RETURNING path
+                """, (batch_size,)).fetchall()]
+                # Xóa file trước khi commit: store() không thể tham chiếu lại blob giữa chừng
+                for path in paths:
+                    try:
+                        (self.upload_folder / path).unlink(missing_ok=True)
+                    except OSError as e:
+                        logger.warning("Failed to delete blob %s: %s", path, e)
+            removed += len(paths)
+            if len(paths) < batch_size:
+                break
+        if removed:
+            logger.info("Collected %d unreferenced blobs", removed)
+        return removed
+
+    def remove_files(self, file_paths: Iterable[Optional[str]]) -> None:
+        """Dọn file vật lý sau khi metadata trỏ tới chúng đã bị xóa/đánh dấu và commit
+
+        File cũ nằm ngoài kho được xóa ngay; blob chỉ bị xóa khi không còn tham chiếu nào.
+        """
+        has_blob = False
+        for file_path in file_paths:
+            if not file_path:
+                continue
+            if is_blob_path(file_path):
+                has_blob = True
+                continue
+            physical_path = self.upload_folder / file_path
+            try:
+                physical_path.unlink(missing_ok=True)
+                logger.info("Physical file deleted: %s", physical_path)
+            except OSError as e:
+                logger.warning("Failed to delete physical file %s: %s", physical_path, e)
+        if has_blob:
+            self.collect()
+
+    def sweep_temp(self, max_age: float) -> int:
+        """Xóa file tạm trong kho cũ hơn max_age giây (upload bị ngắt khi process dừng đột ngột)"""
+        cutoff_ts = time.time() - max_age
+        removed = 0
+        for entry in os.scandir(self.temp_dir):
+            try:
+                if entry.is_file() and entry.stat().st_mtime < cutoff_ts:
+                    os.remove(entry.path)
+                    removed += 1
+            except OSError as e:
+                logger.warning("Failed to remove blob temp file %s: %s", entry.path, e)
+        return removed
@@ -1,20 +1,32 @@
 import asyncio
 import base64
+import json
 import os
 import sys
 import uuid
-from dataclasses import dataclass
+from collections import deque
+from dataclasses import dataclass, field
 from pathlib import Path
-from typing import Optional, Iterable
+from typing import Optional, Iterable, List
 
 import websockets
 from logger import setup_logger
+from protocol import CHUNK_MODE_BASE64, CHUNK_MODE_BINARY, encode_chunk_frame
 
 # Thiết lập logger cho client
 logger = setup_logger("client")
 
 DEFAULT_WS_URL = os.environ.get("WS_URL", "ws://localhost:8765/ws")
+DEFAULT_WS_TOKEN = os.environ.get("WS_TOKEN")  # token đăng nhập (file manager) để xác thực WebSocket
 CHUNK_SIZE = 64 * 1024  # 64KB
+START_ACK_TIMEOUT = 10  # giây chờ start-ack trước khi upload
+DEFAULT_WINDOW = 8  # số chunk đề nghị được gửi mà chưa cần ack
+DEFAULT_EVENT_TICK = 100  # ms: đề nghị server gộp chunk-ack theo tick (0 = từng ack)
+ACK_TIMEOUT = 30  # giây không có ack nào -> gửi lại từ offset đã ack
+AUTH_TIMEOUT = 10  # giây chờ auth-success
+COMPLETE_ACK_TIMEOUT = 120  # giây chờ server ghép file và gửi lên file manager
+DEFAULT_CONNECTIONS = 4  # số connection song song cho một file (chế độ ranges)
+UPLOAD_MODE_RANGES = "ranges"
 
 
 @dataclass
@@ -22,25 +34,76 @@ class UploadState:
     file_id: str
     file_path: Path
     file_size: int
-    offset: int = 0
+    offset: int = 0  # offset chunk tiếp theo sẽ gửi
+    acked_offset: int = 0  # offset liên tục cao nhất server đã ack
     is_paused: bool = False
     is_stopped: bool = False
+    chunk_mode: str = CHUNK_MODE_BASE64
+    window_chunks: int = 1
+    window_bytes: int = CHUNK_SIZE
+    in_flight: deque = field(default_factory=deque)  # offset cuối của các chunk chưa được ack
+    missing_ranges: List[List[int]] = field(default_factory=list)  # chế độ ranges: các khoảng server còn thiếu
+
+    def window_full(self) -> bool:
+        return (len(self.in_flight) >= self.window_chunks
+                or self.offset - self.acked_offset >= self.window_bytes)
+
+    def rewind(self, offset: int) -> None:
+        """Đặt lại offset gửi về offset server mong đợi, bỏ các chunk đang bay"""
+        self.offset = offset
+        self.acked_offset = offset
+        self.in_flight.clear()
+
+    def advance_ack(self, offset: int) -> None:
+        """Ack lũy tiến: mọi chunk kết thúc <= offset đều đã được nhận"""
+        if offset > self.acked_offset:
+            self.acked_offset = offset
+        while self.in_flight and self.in_flight[0] <= self.acked_offset:
+            self.in_flight.popleft()
+
+
+async def authenticate(websocket, token: Optional[str]) -> None:
+    """Gửi token và chờ auth-success (server yêu cầu xác thực trước khi start)"""
+    if not token:
+        return
+    await websocket.send(json.dumps({"type": "auth", "token": token, "user": {}}))
+    while True:
+        message = await asyncio.wait_for(websocket.recv(), timeout=AUTH_TIMEOUT)
+        if isinstance(message, bytes):
+            continue
+        data = json.loads(message)
+        if data.get("event") == "auth-success":
+            return
+        if data.get("event") == "auth-error":
+            raise PermissionError(data.get("message", "Authentication failed"))
 
 
 class AsyncUploader:
-    def __init__(self, ws_url: str = DEFAULT_WS_URL, chunk_size: int = CHUNK_SIZE) -> None:
+    def __init__(self, ws_url: str = DEFAULT_WS_URL, chunk_size: int = CHUNK_SIZE, binary: bool = True,
+                 window: int = DEFAULT_WINDOW, token: Optional[str] = DEFAULT_WS_TOKEN,
+                 mode: Optional[str] = None, event_tick: int = DEFAULT_EVENT_TICK) -> None:
         self.ws_url = ws_url
         self.chunk_size = chunk_size
+        self.binary = binary  # đề nghị server dùng binary frame cho chunk
+        self.window = window  # số chunk đang bay đề nghị, server có thể giảm
+        self.token = token
+        self.mode = mode  # UPLOAD_MODE_RANGES: session cho nhiều connection (xem upload_parallel)
+        self.event_tick = event_tick
         self.websocket: Optional[websockets.WebSocketClientProtocol] = None
         self.state: Optional[UploadState] = None
         self._recv_task: Optional[asyncio.Task] = None
         self._pause_event = asyncio.Event()
         self._pause_event.set()  # start in running state
+        self._start_ack_event = asyncio.Event()
+        self._ack_event = asyncio.Event()
+        self._complete_event = asyncio.Event()
+        self.completed = False
         logger.debug("AsyncUploader initialized with ws_url=%s, chunk_size=%d", ws_url, chunk_size)
 
     async def __aenter__(self):
         logger.debug("Connecting to WebSocket: %s", self.ws_url)
         self.websocket = await websockets.connect(self.ws_url, max_size=8 * 1024 * 1024)
+        await authenticate(self.websocket, self.token)
         self._recv_task = asyncio.create_task(self._receiver())
         logger.info("Connected to WebSocket server")
         return self
@@ -66,25 +129,41 @@ class AsyncUploader:
             logger.error("Receiver error: %s", exc, exc_info=True)
 
     async def _handle_message(self, message: str):
-        import json
         try:
             data = json.loads(message)
         except Exception:
             logger.warning("Received non-JSON message: %s", message)
             return
 
+        # Server gộp các chunk-ack trong một tick thành một message "batch"
+        if data.get("event") == "batch":
+            for event_data in data.get("events", []):
+                await self._handle_event(event_data)
+        else:
+            await self._handle_event(data)
+
+    async def _handle_event(self, data: dict):
         event = data.get("event")
         if not self.state:
             logger.debug("Received message without state: %s", data)
             return
 
         if event == "start-ack":
-            self.state.offset = int(data.get("offset", 0))
-            logger.info("Start acknowledged: resume at offset=%d for %s", 
-                       self.state.offset, self.state.file_path.name)
-        elif event == "progress":
+            self.state.rewind(int(data.get("offset", 0)))
+            # Server cũ không trả chunkMode/window -> base64, stop-and-wait
+            self.state.chunk_mode = data.get("chunkMode", CHUNK_MODE_BASE64)
+            window = data.get("window") or {}
+            self.state.window_chunks = max(1, int(window.get("chunks", 1)))
+            self.state.window_bytes = max(self.chunk_size, int(window.get("bytes", self.chunk_size)))
+            self.state.missing_ranges = data.get("missingRanges") or []
+            self._start_ack_event.set()
+            logger.info("Start acknowledged: resume at offset=%d, chunkMode=%s, window=%d chunks for %s", 
+                       self.state.offset, self.state.chunk_mode, self.state.window_chunks,
+                       self.state.file_path.name)
+        elif event in ("progress", "chunk-ack"):
             off = int(data.get("offset", 0))
-            self.state.offset = off
+            self.state.advance_ack(off)
+            self._ack_event.set()
             percent = data.get("percent")
             logger.debug("Progress: offset=%d (%s%%) for %s", 
                         off, percent, self.state.file_path.name)
@@ -93,20 +172,25 @@ class AsyncUploader:
                        data.get('offset'), self.state.file_path.name)
         elif event == "resume-ack":
             off = int(data.get("offset", 0))
-            self.state.offset = off
+            self.state.rewind(off)
+            self._ack_event.set()
             logger.info("Resume acknowledged: offset=%d for %s", 
                        off, self.state.file_path.name)
         elif event == "stop-ack":
             logger.info("Stop acknowledged for %s", self.state.file_path.name)
         elif event == "complete-ack":
+            self.completed = True
+            self._complete_event.set()
             logger.info("Upload completed: path=%s for %s", 
                        data.get('filePath'), self.state.file_path.name)
         elif event == "offset-mismatch":
             expected = int(data.get("expected", 0))
             logger.warning("Offset mismatch, expected=%d for %s", 
                           expected, self.state.file_path.name)
-            self.state.offset = expected
+            self.state.rewind(expected)
+            self._ack_event.set()
         elif event == "error":
+            self._complete_event.set()
             logger.error("Server error: %s for %s", 
                         data.get('error'), self.state.file_path.name)
         else:
@@ -132,12 +216,26 @@ class AsyncUploader:
         logger.info("Starting upload: file=%s, size=%d bytes, id=%s", 
                    path.name, self.state.file_size, file_id)
 
-        await self._send_json({
+        self._start_ack_event.clear()
+        start = {
             "action": "start",
             "fileId": self.state.file_id,
             "fileName": path.name,
             "fileSize": self.state.file_size,
-        })
+            "chunkMode": CHUNK_MODE_BINARY if self.binary else CHUNK_MODE_BASE64,
+            "window": self.window,
+            "eventTick": self.event_tick,
+        }
+        if self.mode:
+            start["mode"] = self.mode
+        await self._send_json(start)
+
+    async def wait_start_ack(self) -> bool:
+        try:
+            await asyncio.wait_for(self._start_ack_event.wait(), timeout=START_ACK_TIMEOUT)
+            return True
+        except asyncio.TimeoutError:
+            return False
 
     async def upload(self):
         if not self.state:
@@ -147,48 +245,65 @@ class AsyncUploader:
         assert self.websocket is not None
 
         logger.info("Starting upload process for %s", self.state.file_path.name)
-        
-        with open(self.state.file_path, "rb") as f:
-            # Seek to resume offset if any
-            if self.state.offset:
-                logger.debug("Seeking to offset: %d", self.state.offset)
-                f.seek(self.state.offset)
 
-            while not self.state.is_stopped and self.state.offset < self.state.file_size:
+        # Chờ start-ack để biết offset resume và chunkMode đã thương lượng
+        if not await self.wait_start_ack():
+            logger.warning("No start-ack after %ds, uploading with base64 chunks", START_ACK_TIMEOUT)
+        
+        state = self.state
+        with open(state.file_path, "rb") as f:
+            while not state.is_stopped and state.acked_offset < state.file_size:
                 # Respect pause
                 await self._pause_event.wait()
-                if self.state.is_stopped:
+                if state.is_stopped:
                     break
+
+                # Window đầy hoặc đã gửi hết: chờ ack lũy tiến từ server
+                if state.offset >= state.file_size or state.window_full():
+                    self._ack_event.clear()
+                    try:
+                        await asyncio.wait_for(self._ack_event.wait(), timeout=ACK_TIMEOUT)
+                    except asyncio.TimeoutError:
+                        logger.warning("No ack for %ds, resending from offset=%d for %s",
+                                       ACK_TIMEOUT, state.acked_offset, state.file_path.name)
+                        state.rewind(state.acked_offset)
+                    continue
+
                 # đảm bảo con trỏ file trùng với offset hiện tại
                 cur = f.tell()
-                if self.state.offset != cur:
-                    logger.debug("Resync file pointer: tell=%d -> offset=%d", cur, self.state.offset)
-                    f.seek(self.state.offset)
+                if state.offset != cur:
+                    logger.debug("Resync file pointer: tell=%d -> offset=%d", cur, state.offset)
+                    f.seek(state.offset)
                 
                 chunk = f.read(self.chunk_size)
                 if not chunk:
                     break
 
-                # base64 encode
-                data_b64 = base64.b64encode(chunk).decode("ascii")
-                offset_before = self.state.offset
+                offset_before = state.offset
 
-                await self._send_json({
-                    "action": "chunk",
-                    "fileId": self.state.file_id,
-                    "offset": offset_before,
-                    "data": data_b64,
-                })
-
-                # Optimistically advance; server will correct via offset-mismatch
-                self.state.offset += len(chunk)
+                if state.chunk_mode == CHUNK_MODE_BINARY:
+                    await self.websocket.send(encode_chunk_frame(state.file_id, offset_before, chunk))
+                else:
+                    # base64 encode
+                    data_b64 = base64.b64encode(chunk).decode("ascii")
+                    await self._send_json({
+                        "action": "chunk",
+                        "fileId": state.file_id,
+                        "offset": offset_before,
+                        "data": data_b64,
+                    })
+
+                # Chunk đang bay cho tới khi server ack; offset-mismatch sẽ rewind
+                state.offset += len(chunk)
+                state.in_flight.append(state.offset)
 
                 # Gentle yield to event loop
                 await asyncio.sleep(0)
 
-        if not self.state.is_stopped and self.state.offset >= self.state.file_size:
-            logger.info("Upload completed, finalizing file: %s", self.state.file_path.name)
+        if not state.is_stopped and state.acked_offset >= state.file_size:
+            logger.info("Upload completed, finalizing file: %s", state.file_path.name)
             await self.complete()
+            await self.wait_complete_ack()
 
     async def pause(self):
         if not self.state or self.state.is_paused:
@@ -217,6 +332,7 @@ class AsyncUploader:
             return
         self.state.is_stopped = True
         self._pause_event.set()
+        self._ack_event.set()
         logger.info("Stopping upload for %s (delete=%s)", self.state.file_path.name, delete)
         await self._send_json({
             "action": "stop",
@@ -233,13 +349,138 @@ class AsyncUploader:
             "fileId": self.state.file_id,
         })
 
+    async def wait_complete_ack(self) -> bool:
+        """Giữ connection tới khi server ghép file và gửi lên file manager xong"""
+        try:
+            await asyncio.wait_for(self._complete_event.wait(), timeout=COMPLETE_ACK_TIMEOUT)
+        except asyncio.TimeoutError:
+            logger.warning("No complete-ack after %ds for %s", COMPLETE_ACK_TIMEOUT, self.state.file_path.name)
+        return self.completed
+
     async def _send_json(self, obj):
-        import json
         assert self.websocket is not None
         await self.websocket.send(json.dumps(obj))
 
 
-async def upload_many(ws_url: str, files: Iterable[str], concurrency: int = 2, chunk: int = CHUNK_SIZE):
+class RangeLane:
+    """Một connection phụ của upload_parallel: lấy các đoạn từ hàng đợi chung và gửi
+    theo vị trí. Ack mang "range" nên mỗi lane tự biết đoạn nào đã được nhận."""
+
+    def __init__(self, ws_url: str, state: UploadState, pieces: asyncio.Queue, chunk_size: int,
+                 binary: bool, window: int, token: Optional[str]) -> None:
+        self.ws_url = ws_url
+        self.state = state
+        self.pieces = pieces
+        self.chunk_size = chunk_size
+        self.binary = binary
+        self.window = window
+        self.token = token
+        self.pending = {}  # offset bắt đầu -> (start, end) của các đoạn chưa được ack
+        self.sent_bytes = 0
+
+    async def run(self, lane_id: int) -> None:
+        try:
+            async with websockets.connect(self.ws_url, max_size=8 * 1024 * 1024) as websocket:
+                await authenticate(websocket, self.token)
+                await websocket.send(json.dumps({
+                    "action": "start",
+                    "fileId": self.state.file_id,
+                    "fileName": self.state.file_path.name,
+                    "fileSize": self.state.file_size,
+                    "chunkMode": CHUNK_MODE_BINARY if self.binary else CHUNK_MODE_BASE64,
+                    "window": self.window,
+                    "mode": UPLOAD_MODE_RANGES,
+                }))
+                chunk_mode, window_chunks = await self._wait_start_ack(websocket)
+                await self._send_loop(websocket, chunk_mode, window_chunks)
+            logger.debug("Lane %d finished: %d bytes for %s", lane_id, self.sent_bytes, self.state.file_path.name)
+        finally:
+            # Lane lỗi/đóng: trả các đoạn chưa được ack về hàng đợi cho lane khác
+            for piece in self.pending.values():
+                self.pieces.put_nowait(piece)
+            self.pending.clear()
+
+    async def _wait_start_ack(self, websocket):
+        while True:
+            data = json.loads(await asyncio.wait_for(websocket.recv(), timeout=START_ACK_TIMEOUT))
+            if data.get("event") == "start-ack":
+                window = data.get("window") or {}
+                return data.get("chunkMode", CHUNK_MODE_BASE64), max(1, int(window.get("chunks", 1)))
+            if data.get("event") == "error":
+                raise RuntimeError(data.get("error"))
+
+    async def _send_loop(self, websocket, chunk_mode: str, window_chunks: int) -> None:
+        with open(self.state.file_path, "rb") as f:
+            while True:
+                # Gửi tới khi đầy window hoặc hết đoạn trong hàng đợi
+                while len(self.pending) < window_chunks and not self.pieces.empty():
+                    start, end = self.pieces.get_nowait()
+                    f.seek(start)
+                    chunk = f.read(end - start)
+                    if chunk_mode == CHUNK_MODE_BINARY:
+                        await websocket.send(encode_chunk_frame(self.state.file_id, start, chunk))
+                    else:
+                        await websocket.send(json.dumps({
+                            "action": "chunk",
+                            "fileId": self.state.file_id,
+                            "offset": start,
+                            "data": base64.b64encode(chunk).decode("ascii"),
+                        }))
+                    self.pending[start] = (start, end)
+                if not self.pending:
+                    return
+
+                data = json.loads(await asyncio.wait_for(websocket.recv(), timeout=ACK_TIMEOUT))
+                event = data.get("event")
+                if event == "chunk-ack" and data.get("range"):
+                    piece = self.pending.pop(int(data["range"][0]), None)
+                    if piece:
+                        self.sent_bytes += piece[1] - piece[0]
+                elif event == "paused":
+                    raise RuntimeError("Upload paused by server")
+                elif event == "error":
+                    raise RuntimeError(data.get("error"))
+
+
+async def upload_parallel(ws_url: str, file_path: str, connections: int = DEFAULT_CONNECTIONS,
+                          chunk: int = CHUNK_SIZE, binary: bool = True, window: int = DEFAULT_WINDOW,
+                          token: Optional[str] = DEFAULT_WS_TOKEN, file_id: Optional[str] = None) -> bool:
+    """
+    Upload một file qua nhiều WebSocket connection song song (chế độ ranges)
+
+    Connection chính mở session với mode "ranges" và nhận missingRanges; các đoạn còn
+    thiếu được chia thành chunk và phân phối cho `connections` lane. Khi mọi lane xong,
+    connection chính gửi complete. Gọi lại với cùng file_id để resume.
+    """
+    async with AsyncUploader(ws_url, chunk, binary, window, token=token, mode=UPLOAD_MODE_RANGES) as main:
+        await main.start(file_path, file_id)
+        if not await main.wait_start_ack():
+            raise RuntimeError("No start-ack from server")
+        state = main.state
+
+        pieces: asyncio.Queue = asyncio.Queue()
+        for start, end in state.missing_ranges:
+            for piece_start in range(start, end, chunk):
+                pieces.put_nowait((piece_start, min(piece_start + chunk, end)))
+        logger.info("Parallel upload: %s, %d chunks missing, %d connections",
+                    state.file_path.name, pieces.qsize(), connections)
+
+        # Lane lỗi thì các lane còn lại nhận lại phần của nó; chỉ dừng khi không còn lane nào chạy
+        lanes = [RangeLane(ws_url, state, pieces, chunk, binary, window, token) for _ in range(max(1, connections))]
+        results = await asyncio.gather(*(lane.run(i) for i, lane in enumerate(lanes)), return_exceptions=True)
+        for result in results:
+            if isinstance(result, Exception):
+                logger.warning("Lane failed: %s", result)
+        if not pieces.empty():
+            logger.error("Parallel upload incomplete: %d chunks left for %s", pieces.qsize(), state.file_path.name)
+            return False
+
+        await main.complete()
+        return await main.wait_complete_ack()
+
+
+async def upload_many(ws_url: str, files: Iterable[str], concurrency: int = 2, chunk: int = CHUNK_SIZE, binary: bool = True,
+                      window: int = DEFAULT_WINDOW, connections: int = 1, token: Optional[str] = DEFAULT_WS_TOKEN):
     """
     Upload nhiều files với concurrency control và progress tracking
     
@@ -248,6 +489,10 @@ async def upload_many(ws_url: str, files: Iterable[str], concurrency: int = 2, c
         files: Danh sách file paths
         concurrency: Số lượng upload đồng thời
         chunk: Kích thước chunk
+        binary: Gửi chunk bằng binary frame (False = base64 trong JSON)
+        window: Số chunk được gửi trước khi phải chờ ack
+        connections: > 1 thì mỗi file được upload song song qua nhiều connection (chế độ ranges)
+        token: Token đăng nhập dùng để xác thực WebSocket
     """
     file_list = list(files)
     total_files = len(file_list)
@@ -264,9 +509,13 @@ async def upload_many(ws_url: str, files: Iterable[str], concurrency: int = 2, c
         async with semaphore:
             try:
                 logger.debug("Processing file: %s", file_path)
-                async with AsyncUploader(ws_url, chunk) as up:
-                    await up.start(file_path)
-                    await up.upload()
+                if connections > 1:
+                    if not await upload_parallel(ws_url, file_path, connections, chunk, binary, window, token):
+                        return False
+                else:
+                    async with AsyncUploader(ws_url, chunk, binary, window, token=token) as up:
+                        await up.start(file_path)
+                        await up.upload()
                 logger.info("File uploaded successfully: %s", file_path)
                 return True
             except Exception as e:
@@ -312,9 +561,10 @@ async def upload_many(ws_url: str, files: Iterable[str], concurrency: int = 2, c
     }
 
 
-async def interactive_upload(ws_url: str, file_path: str, file_id: Optional[str] = None):
+async def interactive_upload(ws_url: str, file_path: str, file_id: Optional[str] = None,
+                             token: Optional[str] = DEFAULT_WS_TOKEN):
     logger.info("Starting interactive upload for %s", file_path)
-    async with AsyncUploader(ws_url) as up:
+    async with AsyncUploader(ws_url, token=token) as up:
         await up.start(file_path, file_id)
         uploader_task = asyncio.create_task(up.upload())
 
@@ -361,6 +611,10 @@ def main():
     parser.add_argument("--recursive", action="store_true", help="Recursively scan subdirectories when using --dir")
     parser.add_argument("--id", dest="file_id", default=None, help="Optional file id (only for single-file mode)")
     parser.add_argument("--chunk", dest="chunk", type=int, default=CHUNK_SIZE, help="Chunk size in bytes (default 65536)")
+    parser.add_argument("--base64", dest="binary", action="store_false", help="Send chunks as base64 JSON instead of binary frames")
+    parser.add_argument("--window", dest="window", type=int, default=DEFAULT_WINDOW, help="Chunks in flight before waiting for ack (default 8)")
+    parser.add_argument("--connections", dest="connections", type=int, default=1, help="Parallel connections per file (ranges mode, default 1)")
+    parser.add_argument("--token", dest="token", default=DEFAULT_WS_TOKEN, help="Login token for WebSocket auth (default $WS_TOKEN)")
     parser.add_argument("--concurrency", dest="concurrency", type=int, default=2, help="Number of concurrent uploads for multi-file mode")
     parser.add_argument("--interactive", dest="interactive", action="store_true", help="Interactive mode (only for single-file mode)")
     parser.add_argument("--log-level", default="INFO", choices=["DEBUG", "INFO", "WARNING", "ERROR"], help="Log level")
@@ -406,11 +660,16 @@ def main():
     try:
         if len(unique_files) == 1:
             if args.interactive:
-                asyncio.run(interactive_upload(args.ws_url, unique_files[0], args.file_id))
+                asyncio.run(interactive_upload(args.ws_url, unique_files[0], args.file_id, args.token))
+            elif args.connections > 1:
+                asyncio.run(upload_parallel(args.ws_url, unique_files[0], args.connections, args.chunk, args.binary,
+                                            args.window, args.token, args.file_id))
             else:
-                asyncio.run(upload_many(args.ws_url, unique_files, concurrency=1, chunk=args.chunk))
+                asyncio.run(upload_many(args.ws_url, unique_files, concurrency=1, chunk=args.chunk, binary=args.binary,
+                                        window=args.window, token=args.token))
         else:
-            asyncio.run(upload_many(args.ws_url, unique_files, concurrency=args.concurrency, chunk=args.chunk))
+            asyncio.run(upload_many(args.ws_url, unique_files, concurrency=args.concurrency, chunk=args.chunk, binary=args.binary,
+                                    window=args.window, connections=args.connections, token=args.token))
     except KeyboardInterrupt:
         logger.info("Upload interrupted by user")
     except Exception as e:
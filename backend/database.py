@@ -1,9 +1,15 @@
 import sqlite3
 import os
+import json
+import base64
+import re
+import time
 from datetime import datetime, timezone, timedelta
 from pathlib import Path
 import logging
 
+from db_pool import get_pool
+
 # Timezone Việt Nam (UTC+7)
 VIETNAM_TZ = timezone(timedelta(hours=7))
 
@@ -15,17 +21,111 @@ def vietnam_now_isoformat():
     """Trả về thời gian Việt Nam dưới dạng ISO format"""
     return get_vietnam_time().isoformat()
 
+# Cột sắp xếp cho phân trang keyset của danh sách file (tên sort -> cột)
+FILE_SORT_COLUMNS = {
+    'date': 'created_at',
+    'name': 'original_filename',
+    'size': 'size',
+}
+
+def encode_cursor(values):
+    """Mã hóa khóa của dòng cuối trang thành cursor mờ (base64url JSON)"""
+    raw = json.dumps(values, separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+def decode_cursor(cursor):
+    """Giải mã cursor; ValueError nếu không hợp lệ"""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+    except Exception:
+        raise ValueError("Invalid cursor")
+    if not isinstance(values, list):
+        raise ValueError("Invalid cursor")
+    return values
+
+def _sql_file_ext(column):
+    """Biểu thức SQL cho phần mở rộng viết thường (giống Path.suffix.lower()) của một cột tên file"""
+    # Vị trí (1-based) của dấu chấm cuối cùng: rtrim bỏ mọi ký tự không phải '.' ở cuối
+    dot = f"length(rtrim({column}, replace({column}, '.', '')))"
+    return f"(CASE WHEN {dot} > 1 AND {dot} < length({column}) THEN lower(substr({column}, {dot})) ELSE '' END)"
+
+def _stats_delta_sql(row, sign):
+    """Các câu lệnh trigger cộng (sign='+') hoặc trừ (sign='-') một dòng files (NEW/OLD) vào user_stats"""
+    user = f"IFNULL({row}.user_id, 0)"  # file không có user (client cũ) gom vào user_id 0
+    statements = [
+        f"INSERT OR IGNORE INTO user_stats (user_id) VALUES ({user});",
+        f"""UPDATE user_stats SET
+                total_files = total_files {sign} ({row}.status IS NOT 'deleted'),
+                completed_files = completed_files {sign} ({row}.status IS 'completed'),
+                uploading_files = uploading_files {sign} ({row}.status IS 'uploading'),
+                paused_files = paused_files {sign} ({row}.status IS 'paused'),
+                total_size = total_size {sign} (CASE WHEN {row}.status IS 'completed' THEN IFNULL({row}.size, 0) ELSE 0 END)
+            WHERE user_id = {user};""",
+        f"""INSERT INTO user_file_types (user_id, ext, count)
+            SELECT {user}, ext, {sign}1 FROM (SELECT {_sql_file_ext(f'{row}.original_filename')} AS ext)
+            WHERE {row}.status IS 'completed' AND ext != ''
+            ON CONFLICT (user_id, ext) DO UPDATE SET count = count {sign} 1;""",
+    ]
+    if sign == '-':
+        statements.append(f"DELETE FROM user_file_types WHERE user_id = {user} AND count <= 0;")
+    return "\n".join(statements)
+
+# Tìm kiếm tên file: FTS5 bỏ dấu (remove_diacritics), riêng đ/Đ không tách dấu được nên thay tay
+SEARCH_TOKENIZER = "unicode61 remove_diacritics 2"
+SEARCH_MAX_TERMS = 16
+
+def _sql_search_fold(expr):
+    """Biểu thức SQL chuẩn hóa text trước khi đưa vào index tìm kiếm (đ -> d)"""
+    return f"replace(replace(IFNULL({expr}, ''), 'đ', 'd'), 'Đ', 'D')"
+
+def _sql_search_owner(expr):
+    """Token chủ sở hữu trong cột owner của files_fts (user 12 -> 'u12')"""
+    return f"'u' || {expr}"
+
+def build_search_query(text, user_id):
+    """Chuỗi người dùng nhập -> biểu thức MATCH của FTS5 giới hạn trong file của user_id; None nếu không có từ nào
+
+    Mỗi từ thành một prefix query ("bao"* "cao"*) trên name/folder_path, các từ kết hợp AND.
+    Cú pháp FTS5 trong input (dấu ngoặc kép, AND/OR, NEAR...) không được diễn giải.
+    """
+    text = (text or '').replace('đ', 'd').replace('Đ', 'D')
+    terms = re.findall(r'[^\W_]+', text)[:SEARCH_MAX_TERMS]
+    if not terms:
+        return None
+    words = ' '.join(f'"{term}"*' for term in terms)
+    return f'owner : "u{int(user_id)}" AND {{name folder_path}} : ({words})'
+
+def _search_fts_sql(row):
+    """Câu lệnh trigger thêm một dòng files (NEW) vào files_fts, kèm path của folder chứa nó"""
+    return f"""INSERT INTO files_fts (rowid, name, folder_path, owner)
+            VALUES ({row}.id, {_sql_search_fold(f'{row}.original_filename')},
+                    {_sql_search_fold(f'(SELECT path FROM folders WHERE id = {row}.folder_id)')},
+                    {_sql_search_owner(f'{row}.user_id')});"""
+
+def _blob_ref_sql(path, delta):
+    """Lệnh trong trigger: cộng delta vào refcount của blob mà path trỏ tới (path không phải blob thì không khớp dòng nào)"""
+    return f"UPDATE blobs SET refcount = refcount + ({delta}) WHERE path = {path};"
+
+
+def _folder_dict(row):
+    """Dòng folders -> dict cùng định dạng folder trong files_db.json cũ"""
+    folder = dict(row)
+    folder["type"] = "folder"
+    return folder
+
 logger = logging.getLogger(__name__)
 
 class FileDatabase:
     def __init__(self, db_path="files.db"):
         self.db_path = db_path
+        self.pool = get_pool(db_path)
         self.init_database()
     
     def init_database(self):
         """Khởi tạo database và tạo bảng files với user support"""
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self.pool.connect() as conn:
                 # Cập nhật bảng files để support user_id
                 conn.execute("""
                     CREATE TABLE IF NOT EXISTS files (
@@ -39,11 +139,17 @@ class FileDatabase:
                         file_path TEXT,
                         temp_path TEXT,
                         folder_id TEXT,
+                        content_hash TEXT,
                         created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
                         updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
                     )
                 """)
                 
+                # Database cũ chưa có cột content_hash ("<thuật toán>:<hex>")
+                columns = {row[1] for row in conn.execute("PRAGMA table_info(files)")}
+                if 'content_hash' not in columns:
+                    conn.execute("ALTER TABLE files ADD COLUMN content_hash TEXT")
+                
                 # Tạo bảng recycle_bin để quản lý file đã xóa
                 conn.execute("""
                     CREATE TABLE IF NOT EXISTS recycle_bin (
@@ -67,26 +173,261 @@ class FileDatabase:
                 conn.execute("CREATE INDEX IF NOT EXISTS idx_status ON files(status)")
                 conn.execute("CREATE INDEX IF NOT EXISTS idx_filename ON files(filename)")
                 conn.execute("CREATE INDEX IF NOT EXISTS idx_user_id ON files(user_id)")
+                # Index cho phân trang keyset theo từng kiểu sort (id để thứ tự ổn định)
+                conn.execute("CREATE INDEX IF NOT EXISTS idx_files_user_status_created ON files(user_id, status, created_at, id)")
+                conn.execute("CREATE INDEX IF NOT EXISTS idx_files_user_created ON files(user_id, created_at, id)")
+                conn.execute("CREATE INDEX IF NOT EXISTS idx_files_user_name ON files(user_id, original_filename, id)")
+                conn.execute("CREATE INDEX IF NOT EXISTS idx_files_user_name_nocase ON files(user_id, original_filename COLLATE NOCASE)")
+                conn.execute("CREATE INDEX IF NOT EXISTS idx_files_user_size ON files(user_id, size, id)")
+                conn.execute("CREATE INDEX IF NOT EXISTS idx_files_created ON files(created_at)")
+                # Liệt kê/tải file theo folder
+                conn.execute("CREATE INDEX IF NOT EXISTS idx_files_folder ON files(folder_id)")
+                # Job dọn upload bị treo quét theo (status, created_at)
+                conn.execute("CREATE INDEX IF NOT EXISTS idx_files_status_created ON files(status, created_at)")
+                
+                # Folder của từng user (trước đây nằm trong remote_uploads/files_db.json)
+                conn.execute("""
+                    CREATE TABLE IF NOT EXISTS folders (
+                        id TEXT PRIMARY KEY,
+                        name TEXT NOT NULL,
+                        path TEXT NOT NULL,
+                        parent_id TEXT,
+                        user_id INTEGER,
+                        username TEXT,
+                        created_time TEXT
+                    )
+                """)
+                conn.execute("CREATE INDEX IF NOT EXISTS idx_folders_user_parent ON folders(user_id, parent_id)")
+                
+                # Thống kê theo user, được trigger trên bảng files cập nhật trong cùng transaction
+                stats_exists = conn.execute(
+                    "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'user_stats'"
+                ).fetchone()
+                conn.execute("""
+                    CREATE TABLE IF NOT EXISTS user_stats (
+                        user_id INTEGER PRIMARY KEY,
+                        total_files INTEGER NOT NULL DEFAULT 0,
+                        completed_files INTEGER NOT NULL DEFAULT 0,
+                        uploading_files INTEGER NOT NULL DEFAULT 0,
+                        paused_files INTEGER NOT NULL DEFAULT 0,
+                        total_size INTEGER NOT NULL DEFAULT 0,
+                        total_folders INTEGER NOT NULL DEFAULT 0
+                    )
+                """)
+                conn.execute("""
+                    CREATE TABLE IF NOT EXISTS user_file_types (
+                        user_id INTEGER NOT NULL,
+                        ext TEXT NOT NULL,
+                        count INTEGER NOT NULL DEFAULT 0,
+                        PRIMARY KEY (user_id, ext)
+                    )
+                """)
+                conn.execute(f"""
+                    CREATE TRIGGER IF NOT EXISTS trg_files_stats_insert AFTER INSERT ON files
+                    BEGIN
+                        {_stats_delta_sql('NEW', '+')}
+                    END
+                """)
+                conn.execute(f"""
+                    CREATE TRIGGER IF NOT EXISTS trg_files_stats_delete AFTER DELETE ON files
+                    BEGIN
+                        {_stats_delta_sql('OLD', '-')}
+                    END
+                """)
+                conn.execute(f"""
+                    CREATE TRIGGER IF NOT EXISTS trg_files_stats_update
+                    AFTER UPDATE OF status, size, original_filename, user_id ON files
+                    BEGIN
+                        {_stats_delta_sql('OLD', '-')}
+                        {_stats_delta_sql('NEW', '+')}
+                    END
+                """)
+                conn.execute("""
+                    CREATE TRIGGER IF NOT EXISTS trg_folders_stats_insert AFTER INSERT ON folders
+                    BEGIN
+                        INSERT OR IGNORE INTO user_stats (user_id) VALUES (IFNULL(NEW.user_id, 0));
+                        UPDATE user_stats SET total_folders = total_folders + 1 WHERE user_id = IFNULL(NEW.user_id, 0);
+                    END
+                """)
+                conn.execute("""
+                    CREATE TRIGGER IF NOT EXISTS trg_folders_stats_delete AFTER DELETE ON folders
+                    BEGIN
+                        UPDATE user_stats SET total_folders = total_folders - 1 WHERE user_id = IFNULL(OLD.user_id, 0);
+                    END
+                """)
+                if not stats_exists:
+                    # Database cũ đã có files: tính lại một lần
+                    self.rebuild_user_stats()
+                
+                # Index tìm kiếm full-text tên file + path folder (rowid = files.id), trigger giữ đồng bộ.
+                # Cột owner ('u<user_id>') để MATCH chỉ đi qua posting list của đúng user
+                search_columns = [row[1] for row in conn.execute("PRAGMA table_info(files_fts)")]
+                if search_columns and 'owner' not in search_columns:
+                    # Index cũ chưa có owner: bỏ đi (cùng trigger) để tạo lại bên dưới
+                    conn.execute("DROP TABLE files_fts")
+                    for trigger in ('trg_files_fts_insert', 'trg_files_fts_delete', 'trg_files_fts_update'):
+                        conn.execute(f"DROP TRIGGER IF EXISTS {trigger}")
+                    search_columns = []
+                conn.execute(f"""
+                    CREATE VIRTUAL TABLE IF NOT EXISTS files_fts USING fts5(
+                        name, folder_path, owner, tokenize = '{SEARCH_TOKENIZER}'
+                    )
+                """)
+                conn.execute(f"""
+                    CREATE TRIGGER IF NOT EXISTS trg_files_fts_insert AFTER INSERT ON files
+                    BEGIN
+                        {_search_fts_sql('NEW')}
+                    END
+                """)
+                conn.execute("""
+                    CREATE TRIGGER IF NOT EXISTS trg_files_fts_delete AFTER DELETE ON files
+                    BEGIN
+                        DELETE FROM files_fts WHERE rowid = OLD.id;
+                    END
+                """)
+                conn.execute(f"""
+                    CREATE TRIGGER IF NOT EXISTS trg_files_fts_update
+                    AFTER UPDATE OF original_filename, folder_id, user_id ON files
+                    BEGIN
+                        DELETE FROM files_fts WHERE rowid = OLD.id;
+                        {_search_fts_sql('NEW')}
+                    END
+                """)
+                # Folder tạo sau file (import), đổi path hoặc bị xóa: cập nhật folder_path của các file trong đó
+                conn.execute(f"""
+                    CREATE TRIGGER IF NOT EXISTS trg_folders_fts_insert AFTER INSERT ON folders
+                    BEGIN
+                        UPDATE files_fts SET folder_path = {_sql_search_fold('NEW.path')}
+                        WHERE rowid IN (SELECT id FROM files WHERE folder_id = NEW.id);
+                    END
+                """)
+                conn.execute(f"""
+                    CREATE TRIGGER IF NOT EXISTS trg_folders_fts_update AFTER UPDATE OF path ON folders
+                    BEGIN
+                        UPDATE files_fts SET folder_path = {_sql_search_fold('NEW.path')}
+                        WHERE rowid IN (SELECT id FROM files WHERE folder_id = NEW.id);
+                    END
+                """)
+                conn.execute("""
+                    CREATE TRIGGER IF NOT EXISTS trg_folders_fts_delete AFTER DELETE ON folders
+                    BEGIN
+                        UPDATE files_fts SET folder_path = ''
+                        WHERE rowid IN (SELECT id FROM files WHERE folder_id = OLD.id);
+                    END
+                """)
+                if not search_columns:
+                    self.rebuild_search_index()
+
+                # Kho blob theo nội dung (blob_store.py): refcount = số dòng files + số dòng thùng rác
+                # 'in_recycle' trỏ tới blob, do trigger cập nhật trong cùng transaction với metadata
+                blobs_exist = conn.execute(
+                    "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'blobs'"
+                ).fetchone()
+                conn.execute("""
+                    CREATE TABLE IF NOT EXISTS blobs (
+                        path TEXT PRIMARY KEY,
+                        size INTEGER NOT NULL,
+                        refcount INTEGER NOT NULL DEFAULT 0,
+                        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                    )
+                """)
+                # GC chỉ quét các blob không còn tham chiếu
+                conn.execute("CREATE INDEX IF NOT EXISTS idx_blobs_unreferenced ON blobs(refcount) WHERE refcount <= 0")
+                conn.execute(f"""
+                    CREATE TRIGGER IF NOT EXISTS trg_files_blob_insert AFTER INSERT ON files
+                    BEGIN
+                        {_blob_ref_sql('NEW.file_path', 1)}
+                    END
+                """)
+                conn.execute(f"""
+                    CREATE TRIGGER IF NOT EXISTS trg_files_blob_delete AFTER DELETE ON files
+                    BEGIN
+                        {_blob_ref_sql('OLD.file_path', -1)}
+                    END
+                """)
+                conn.execute(f"""
+                    CREATE TRIGGER IF NOT EXISTS trg_files_blob_update AFTER UPDATE OF file_path ON files
+                    WHEN OLD.file_path IS NOT NEW.file_path
+                    BEGIN
+                        {_blob_ref_sql('OLD.file_path', -1)}
+                        {_blob_ref_sql('NEW.file_path', 1)}
+                    END
+                """)
+                conn.execute(f"""
+                    CREATE TRIGGER IF NOT EXISTS trg_recycle_blob_insert AFTER INSERT ON recycle_bin
+                    WHEN NEW.status IS 'in_recycle'
+                    BEGIN
+                        {_blob_ref_sql('NEW.file_path', 1)}
+                    END
+                """)
+                conn.execute(f"""
+                    CREATE TRIGGER IF NOT EXISTS trg_recycle_blob_delete AFTER DELETE ON recycle_bin
+                    WHEN OLD.status IS 'in_recycle'
+                    BEGIN
+                        {_blob_ref_sql('OLD.file_path', -1)}
+                    END
+                """)
+                # Ra khỏi thùng rác (restored, permanently_deleted, expired) thì bỏ tham chiếu
+                conn.execute(f"""
+                    CREATE TRIGGER IF NOT EXISTS trg_recycle_blob_status AFTER UPDATE OF status ON recycle_bin
+                    WHEN (OLD.status IS 'in_recycle') != (NEW.status IS 'in_recycle')
+                    BEGIN
+                        {_blob_ref_sql('NEW.file_path', "CASE WHEN NEW.status IS 'in_recycle' THEN 1 ELSE -1 END")}
+                    END
+                """)
+                if not blobs_exist:
+                    self.rebuild_blob_refcounts()
+
+                # Upload resumable qua HTTP (resumable_upload.py): offset đã ghi nhận, còn dùng sau khi restart
+                conn.execute("""
+                    CREATE TABLE IF NOT EXISTS uploads (
+                        id TEXT PRIMARY KEY,
+                        user_id INTEGER,
+                        client_file_id TEXT,
+                        file_name TEXT NOT NULL,
+                        file_size INTEGER NOT NULL,
+                        folder_id TEXT,
+                        hash_algorithm TEXT,
+                        expected_hash TEXT,
+                        upload_offset INTEGER NOT NULL DEFAULT 0,
+                        status TEXT DEFAULT 'active',
+                        file_id INTEGER,
+                        content_hash TEXT,
+                        lease_token TEXT,
+                        lease_until REAL,
+                        created_at TIMESTAMP,
+                        updated_at TIMESTAMP
+                    )
+                """)
+                # Database cũ chưa có lease (request đang giữ phiên, xem claim_upload)
+                upload_columns = {row[1] for row in conn.execute("PRAGMA table_info(uploads)")}
+                if 'lease_token' not in upload_columns:
+                    conn.execute("ALTER TABLE uploads ADD COLUMN lease_token TEXT")
+                    conn.execute("ALTER TABLE uploads ADD COLUMN lease_until REAL")
+                conn.execute("CREATE INDEX IF NOT EXISTS idx_uploads_user_client ON uploads(user_id, client_file_id)")
+                conn.execute("CREATE INDEX IF NOT EXISTS idx_uploads_updated ON uploads(updated_at)")
                 conn.execute("CREATE INDEX IF NOT EXISTS idx_recycle_user ON recycle_bin(user_id)")
                 conn.execute("CREATE INDEX IF NOT EXISTS idx_recycle_status ON recycle_bin(status)")
                 conn.execute("CREATE INDEX IF NOT EXISTS idx_recycle_deadline ON recycle_bin(restore_deadline)")
-                conn.commit()
+                # Phân trang keyset thùng rác theo (deleted_at, id), cho user và cho admin
+                conn.execute("CREATE INDEX IF NOT EXISTS idx_recycle_user_status_deleted ON recycle_bin(user_id, status, deleted_at, id)")
+                conn.execute("CREATE INDEX IF NOT EXISTS idx_recycle_status_deleted ON recycle_bin(status, deleted_at, id)")
                 logger.info("Database initialized successfully")
         except sqlite3.Error as e:
             logger.error(f"Database initialization error: {e}")
             raise
     
-    def add_file(self, filename, original_filename, size, uploader="Anonymous", user_id=None, temp_path=None, folder_id=None):
+    def add_file(self, filename, original_filename, size, uploader="Anonymous", user_id=None, temp_path=None, folder_id=None,
+                 content_hash=None):
         """Thêm file mới vào database với user context"""
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self.pool.connect() as conn:
                 cursor = conn.execute("""
-                    INSERT INTO files (filename, original_filename, size, uploader, user_id, status, temp_path, folder_id, created_at, updated_at)
-                    VALUES (?, ?, ?, ?, ?, 'uploading', ?, ?, ?, ?)
-                """, (filename, original_filename, size, uploader, user_id, temp_path, folder_id, vietnam_now_isoformat(), vietnam_now_isoformat()))
+                    INSERT INTO files (filename, original_filename, size, uploader, user_id, status, temp_path, folder_id, content_hash, created_at, updated_at)
+                    VALUES (?, ?, ?, ?, ?, 'uploading', ?, ?, ?, ?, ?)
+                """, (filename, original_filename, size, uploader, user_id, temp_path, folder_id, content_hash, vietnam_now_isoformat(), vietnam_now_isoformat()))
                 
                 file_id = cursor.lastrowid
-                conn.commit()
                 logger.info(f"File added to database: {original_filename} (ID: {file_id})")
                 return file_id
         except sqlite3.Error as e:
@@ -96,7 +437,7 @@ class FileDatabase:
     def update_file_status(self, file_id, status, file_path=None):
         """Cập nhật trạng thái file"""
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self.pool.connect() as conn:
                 if file_path:
                     conn.execute("""
                         UPDATE files 
@@ -110,7 +451,6 @@ class FileDatabase:
                         WHERE id = ?
                     """, (status, vietnam_now_isoformat(), file_id))
                 
-                conn.commit()
                 logger.info(f"File status updated: ID {file_id} -> {status}")
                 return True
         except sqlite3.Error as e:
@@ -120,7 +460,7 @@ class FileDatabase:
     def get_file_by_id(self, file_id):
         """Lấy thông tin file theo ID"""
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self.pool.connect() as conn:
                 conn.row_factory = sqlite3.Row
                 cursor = conn.execute("SELECT * FROM files WHERE id = ?", (file_id,))
                 result = cursor.fetchone()
@@ -132,7 +472,7 @@ class FileDatabase:
     def get_file_by_filename(self, filename):
         """Lấy thông tin file theo tên file"""
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self.pool.connect() as conn:
                 conn.row_factory = sqlite3.Row
                 cursor = conn.execute("SELECT * FROM files WHERE filename = ?", (filename,))
                 result = cursor.fetchone()
@@ -148,7 +488,7 @@ class FileDatabase:
             
         try:
             auth_db_path = os.path.join(os.path.dirname(self.db_path), "auth.db")
-            with sqlite3.connect(auth_db_path) as conn:
+            with get_pool(auth_db_path).connect() as conn:
                 cursor = conn.execute("SELECT username FROM users WHERE id = ?", (user_id,))
                 result = cursor.fetchone()
                 return result[0] if result else None
@@ -159,7 +499,7 @@ class FileDatabase:
     def get_all_files(self, status=None, limit=None, offset=0, user_id=None):
         """Lấy danh sách files theo user (nếu user_id được cung cấp)"""
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self.pool.connect() as conn:
                 conn.row_factory = sqlite3.Row
                 
                 # Build query với user filtering
@@ -201,11 +541,153 @@ class FileDatabase:
     def get_user_files(self, user_id, status=None):
         """Lấy tất cả files của một user cụ thể"""
         return self.get_all_files(status=status, user_id=user_id)
+
+    def get_user_files_page(self, user_id, status=None, sort='date', order='desc', limit=100, cursor=None):
+        """Lấy một trang files của user theo keyset (sort_column, id); trả về (files, next_cursor)
+
+        cursor là giá trị do trang trước trả về; next_cursor = None khi đã hết.
+        ValueError nếu sort/order/cursor không hợp lệ.
+        """
+        column = FILE_SORT_COLUMNS.get(sort)
+        if column is None or order not in ('asc', 'desc'):
+            raise ValueError("Invalid sort or order")
+
+        where_conditions = ["user_id = ?"]
+        params = [user_id]
+        if status:
+            where_conditions.append("status = ?")
+            params.append(status)
+        else:
+            where_conditions.append("status != 'deleted'")
+
+        if cursor:
+            last_value, last_id = decode_cursor(cursor)
+            # Row value so sánh (cột, id) để SQLite đi thẳng tới vị trí trong index
+            where_conditions.append(f"({column}, id) {'<' if order == 'desc' else '>'} (?, ?)")
+            params.extend([last_value, last_id])
+
+        direction = order.upper()
+        query = f"""
+            SELECT id, original_filename, file_path, folder_id, size, created_at, status, uploader, user_id
+            FROM files
+            WHERE {' AND '.join(where_conditions)}
+            ORDER BY {column} {direction}, id {direction}
+            LIMIT ?
+        """
+        params.append(limit + 1)  # lấy dư một dòng để biết còn trang sau
+
+        try:
+            with self.pool.connect() as conn:
+                conn.row_factory = sqlite3.Row
+                rows = [dict(row) for row in conn.execute(query, params).fetchall()]
+        except sqlite3.Error as e:
+            logger.error(f"Error getting files page: {e}")
+            return [], None
+
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            last = rows[-1]
+            next_cursor = encode_cursor([last[column], last['id']])
+        return rows, next_cursor
     
+    def search_user_files(self, user_id, text, status=None, limit=50, cursor=None):
+        """Tìm file của user theo tên/path folder qua files_fts; trả về (files, next_cursor)
+
+        Kết quả xếp theo bm25 (khớp ở tên nặng hơn khớp ở path folder). bm25 phụ thuộc thống kê
+        của cả index nên không dùng làm khóa keyset được: cursor giữ (id lớn nhất lúc trang đầu,
+        offset), các trang sau chỉ xét file có id <= mốc đó nên file mới upload không chen vào
+        làm lệch trang. ValueError nếu cursor không hợp lệ.
+        """
+        match = build_search_query(text, user_id)
+        if match is None:
+            return [], None
+
+        snapshot_id, offset = None, 0
+        if cursor:
+            values = decode_cursor(cursor)
+            if len(values) != 2 or not all(isinstance(v, int) and v >= 0 for v in values):
+                raise ValueError("Invalid cursor")
+            snapshot_id, offset = values
+
+        where_conditions = ["files_fts MATCH ?", "f.user_id = ?"]
+        params = [match, user_id]
+        if status:
+            where_conditions.append("f.status = ?")
+            params.append(status)
+        else:
+            where_conditions.append("f.status != 'deleted'")
+
+        try:
+            with self.pool.connect() as conn:
+                conn.row_factory = sqlite3.Row
+                if snapshot_id is None:
+                    snapshot_id = conn.execute("SELECT IFNULL(MAX(id), 0) FROM files").fetchone()[0]
+                # Điều kiện rowid được FTS5 áp ngay trong index
+                where_conditions.append("files_fts.rowid <= ?")
+                params.append(snapshot_id)
+                query = f"""
+                    SELECT f.id, f.original_filename, f.file_path, f.folder_id, f.size, f.created_at,
+                           f.status, f.uploader, f.user_id, d.path AS folder_path,
+                           bm25(files_fts, 10.0, 1.0, 0.0) AS score
+                    FROM files_fts
+                    JOIN files f ON f.id = files_fts.rowid
+                    LEFT JOIN folders d ON d.id = f.folder_id
+                    WHERE {' AND '.join(where_conditions)}
+                    ORDER BY score, f.id
+                    LIMIT ? OFFSET ?
+                """
+                params.extend([limit + 1, offset])
+                rows = [dict(row) for row in conn.execute(query, params).fetchall()]
+        except sqlite3.Error as e:
+            logger.error(f"Error searching files: {e}")
+            return [], None
+
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = encode_cursor([snapshot_id, offset + limit])
+        return rows, next_cursor
+
+    def rebuild_search_index(self):
+        """Tạo lại toàn bộ files_fts từ bảng files và folders"""
+        with self.pool.connect() as conn:
+            conn.execute("DELETE FROM files_fts")
+            conn.execute(f"""
+                INSERT INTO files_fts (rowid, name, folder_path, owner)
+                SELECT f.id, {_sql_search_fold('f.original_filename')}, {_sql_search_fold('d.path')},
+                       {_sql_search_owner('f.user_id')}
+                FROM files f LEFT JOIN folders d ON d.id = f.folder_id
+            """)
+            conn.execute("INSERT INTO files_fts (files_fts) VALUES ('optimize')")
+        logger.info("Search index rebuilt")
+
+    def rebuild_blob_refcounts(self):
+        """Tính lại refcount của bảng blobs từ files và recycle_bin (thêm dòng cho blob chưa được ghi nhận)"""
+        with self.pool.connect() as conn:
+            conn.execute("""
+                INSERT INTO blobs (path, size)
+                SELECT file_path, MAX(size) FROM files WHERE file_path LIKE '.blobs/%' GROUP BY file_path
+                ON CONFLICT (path) DO NOTHING
+            """)
+            conn.execute("UPDATE blobs SET refcount = 0")
+            conn.execute("""
+                UPDATE blobs SET refcount = refs.n
+                FROM (
+                    SELECT file_path, COUNT(*) AS n FROM (
+                        SELECT file_path FROM files
+                        UNION ALL
+                        SELECT file_path FROM recycle_bin WHERE status = 'in_recycle'
+                    ) GROUP BY file_path
+                ) AS refs
+                WHERE refs.file_path = blobs.path
+            """)
+        logger.info("Blob refcounts rebuilt")
+
     def get_files_by_folder(self, folder_id, user_id=None):
         """Lấy tất cả files trong một folder cụ thể"""
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self.pool.connect() as conn:
                 conn.row_factory = sqlite3.Row
                 
                 if user_id:
@@ -229,12 +711,85 @@ class FileDatabase:
             logger.error(f"Error getting files by folder: {e}")
             return []
     
+    def add_folder(self, folder_id, name, path, parent_id, user_id, username, created_time=None):
+        """Thêm folder mới"""
+        try:
+            with self.pool.connect() as conn:
+                conn.execute("""
+                    INSERT INTO folders (id, name, path, parent_id, user_id, username, created_time)
+                    VALUES (?, ?, ?, ?, ?, ?, ?)
+                """, (folder_id, name, path, parent_id, user_id, username,
+                      created_time or datetime.now().isoformat()))
+                return True
+        except sqlite3.Error as e:
+            logger.error(f"Error adding folder: {e}")
+            return False
+    
+    def get_folder(self, folder_id, user_id=None):
+        """Lấy folder theo id (chỉ của user_id nếu được cung cấp)"""
+        try:
+            with self.pool.connect() as conn:
+                conn.row_factory = sqlite3.Row
+                if user_id is not None:
+                    cursor = conn.execute("SELECT * FROM folders WHERE id = ? AND user_id = ?", (folder_id, user_id))
+                else:
+                    cursor = conn.execute("SELECT * FROM folders WHERE id = ?", (folder_id,))
+                row = cursor.fetchone()
+                return _folder_dict(row) if row else None
+        except sqlite3.Error as e:
+            logger.error(f"Error getting folder: {e}")
+            return None
+    
+    def get_user_folders(self, user_id, parent_id=None):
+        """Lấy folders của user; chỉ con trực tiếp của parent_id nếu được cung cấp"""
+        try:
+            with self.pool.connect() as conn:
+                conn.row_factory = sqlite3.Row
+                if parent_id is not None:
+                    cursor = conn.execute("""
+                        SELECT * FROM folders WHERE user_id = ? AND parent_id = ? ORDER BY created_time
+                    """, (user_id, parent_id))
+                else:
+                    cursor = conn.execute("""
+                        SELECT * FROM folders WHERE user_id = ? ORDER BY created_time
+                    """, (user_id,))
+                return [_folder_dict(row) for row in cursor.fetchall()]
+        except sqlite3.Error as e:
+            logger.error(f"Error getting folders: {e}")
+            return []
+    
+    def delete_folder(self, folder_id, user_id):
+        """Xóa folder của user; trả về thông tin folder đã xóa hoặc None"""
+        try:
+            with self.pool.connect() as conn:
+                conn.row_factory = sqlite3.Row
+                row = conn.execute("SELECT * FROM folders WHERE id = ? AND user_id = ?",
+                                   (folder_id, user_id)).fetchone()
+                if not row:
+                    return None
+                conn.execute("DELETE FROM folders WHERE id = ?", (folder_id,))
+                return _folder_dict(row)
+        except sqlite3.Error as e:
+            logger.error(f"Error deleting folder: {e}")
+            return None
+    
+    def import_folders(self, folders):
+        """Nhập folders từ files_db.json cũ (bỏ qua id đã có); trả về số folder được thêm"""
+        with self.pool.connect() as conn:
+            before = conn.execute("SELECT COUNT(*) FROM folders").fetchone()[0]
+            conn.executemany("""
+                INSERT OR IGNORE INTO folders (id, name, path, parent_id, user_id, username, created_time)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            """, [(f.get("id"), f.get("name"), f.get("path"), f.get("parent_id"), f.get("user_id"),
+                   f.get("username"), f.get("created_time")) for f in folders if f.get("id")])
+            added = conn.execute("SELECT COUNT(*) FROM folders").fetchone()[0] - before
+        return added
+    
     def delete_file(self, file_id):
         """Xóa file khỏi database"""
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self.pool.connect() as conn:
                 cursor = conn.execute("DELETE FROM files WHERE id = ?", (file_id,))
-                conn.commit()
                 
                 if cursor.rowcount > 0:
                     logger.info(f"File deleted from database: ID {file_id}")
@@ -247,17 +802,17 @@ class FileDatabase:
             return False
     
     def get_file_stats(self):
-        """Lấy thống kê files"""
+        """Lấy thống kê files (cộng từ user_stats, không quét bảng files)"""
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self.pool.connect() as conn:
                 cursor = conn.execute("""
                     SELECT 
-                        COUNT(*) as total_files,
-                        COUNT(CASE WHEN status = 'completed' THEN 1 END) as completed_files,
-                        COUNT(CASE WHEN status = 'uploading' THEN 1 END) as uploading_files,
-                        COUNT(CASE WHEN status = 'paused' THEN 1 END) as paused_files,
-                        COALESCE(SUM(CASE WHEN status = 'completed' THEN size ELSE 0 END), 0) as total_size
-                    FROM files
+                        COALESCE(SUM(total_files), 0),
+                        COALESCE(SUM(completed_files), 0),
+                        COALESCE(SUM(uploading_files), 0),
+                        COALESCE(SUM(paused_files), 0),
+                        COALESCE(SUM(total_size), 0)
+                    FROM user_stats
                 """)
                 
                 result = cursor.fetchone()
@@ -278,10 +833,87 @@ class FileDatabase:
                 'total_size': 0
             }
     
+    def get_user_stats(self, user_id):
+        """Lấy thống kê của một user từ user_stats/user_file_types"""
+        stats = {
+            'total_files': 0,
+            'completed_files': 0,
+            'uploading_files': 0,
+            'paused_files': 0,
+            'total_folders': 0,
+            'total_size': 0,
+            'file_types': {}
+        }
+        try:
+            with self.pool.connect() as conn:
+                row = conn.execute("""
+                    SELECT total_files, completed_files, uploading_files, paused_files, total_folders, total_size
+                    FROM user_stats WHERE user_id = ?
+                """, (user_id,)).fetchone()
+                if row:
+                    stats.update(zip(('total_files', 'completed_files', 'uploading_files', 'paused_files',
+                                      'total_folders', 'total_size'), row))
+                cursor = conn.execute("SELECT ext, count FROM user_file_types WHERE user_id = ?", (user_id,))
+                stats['file_types'] = {ext: count for ext, count in cursor.fetchall()}
+        except sqlite3.Error as e:
+            logger.error(f"Error getting user stats: {e}")
+        return stats
+    
+    def count_files_created_since(self, since):
+        """Đếm file tạo từ thời điểm since (chuỗi ISO, so sánh theo chuỗi như created_at)"""
+        try:
+            with self.pool.connect() as conn:
+                cursor = conn.execute("SELECT COUNT(*) FROM files WHERE created_at >= ?", (since,))
+                return cursor.fetchone()[0]
+        except sqlite3.Error as e:
+            logger.error(f"Error counting recent files: {e}")
+            return 0
+    
+    def rebuild_user_stats(self):
+        """Tính lại toàn bộ user_stats/user_file_types từ bảng files và folders"""
+        with self.pool.connect() as conn:
+            conn.execute("""
+                UPDATE user_stats SET total_files = 0, completed_files = 0, uploading_files = 0,
+                                      paused_files = 0, total_size = 0, total_folders = 0
+            """)
+            conn.execute("""
+                INSERT INTO user_stats (user_id, total_files, completed_files, uploading_files, paused_files, total_size)
+                SELECT IFNULL(user_id, 0),
+                       SUM(status IS NOT 'deleted'),
+                       SUM(status IS 'completed'),
+                       SUM(status IS 'uploading'),
+                       SUM(status IS 'paused'),
+                       SUM(CASE WHEN status IS 'completed' THEN IFNULL(size, 0) ELSE 0 END)
+                FROM files
+                GROUP BY IFNULL(user_id, 0)
+                ON CONFLICT (user_id) DO UPDATE SET
+                    total_files = excluded.total_files,
+                    completed_files = excluded.completed_files,
+                    uploading_files = excluded.uploading_files,
+                    paused_files = excluded.paused_files,
+                    total_size = excluded.total_size
+            """)
+            conn.execute("DELETE FROM user_file_types")
+            conn.execute(f"""
+                INSERT INTO user_file_types (user_id, ext, count)
+                SELECT uid, ext, COUNT(*) FROM (
+                    SELECT IFNULL(user_id, 0) AS uid, {_sql_file_ext('original_filename')} AS ext
+                    FROM files WHERE status = 'completed'
+                )
+                WHERE ext != ''
+                GROUP BY uid, ext
+            """)
+            conn.execute("""
+                INSERT INTO user_stats (user_id, total_folders)
+                SELECT IFNULL(user_id, 0), COUNT(*) FROM folders GROUP BY IFNULL(user_id, 0)
+                ON CONFLICT (user_id) DO UPDATE SET total_folders = excluded.total_folders
+            """)
+        logger.info("User stats rebuilt")
+    
     def get_file_by_id(self, file_id):
         """Lấy thông tin file theo ID"""
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self.pool.connect() as conn:
                 conn.row_factory = sqlite3.Row
                 cursor = conn.execute("SELECT * FROM files WHERE id = ?", (file_id,))
                 result = cursor.fetchone()
@@ -290,18 +922,118 @@ class FileDatabase:
             logger.error(f"Error getting file by ID: {e}")
             return None
     
+    def get_files_by_ids(self, file_ids):
+        """Lấy {id: file} cho danh sách id bằng truy vấn IN (chia lô theo giới hạn tham số)"""
+        ids = sorted({int(fid) for fid in file_ids})
+        files = {}
+        try:
+            with self.pool.connect() as conn:
+                conn.row_factory = sqlite3.Row
+                for start in range(0, len(ids), 500):
+                    batch = ids[start:start + 500]
+                    placeholders = ",".join("?" * len(batch))
+                    cursor = conn.execute(f"SELECT * FROM files WHERE id IN ({placeholders})", batch)
+                    files.update((row['id'], dict(row)) for row in cursor.fetchall())
+        except sqlite3.Error as e:
+            logger.error(f"Error getting files by ids: {e}")
+        return files
+    
+    def get_completed_files_in_folders(self, folder_ids, user_id):
+        """Các file completed của user_id nằm trong các folder_ids (truy vấn IN theo lô), sắp theo tên"""
+        ids = sorted(set(folder_ids))
+        files = []
+        try:
+            with self.pool.connect() as conn:
+                conn.row_factory = sqlite3.Row
+                for start in range(0, len(ids), 500):
+                    batch = ids[start:start + 500]
+                    placeholders = ",".join("?" * len(batch))
+                    cursor = conn.execute(f"""
+                        SELECT id, original_filename, file_path, folder_id, size, content_hash FROM files
+                        WHERE folder_id IN ({placeholders}) AND user_id = ? AND status = 'completed'
+                        ORDER BY original_filename, id
+                    """, batch + [user_id])
+                    files.extend(dict(row) for row in cursor.fetchall())
+        except sqlite3.Error as e:
+            logger.error(f"Error getting files in folders: {e}")
+        return files
+    
+    def get_recycle_items_by_ids(self, recycle_ids):
+        """Lấy {id: (user_id, status, file_path)} của các dòng recycle_bin bằng truy vấn IN"""
+        ids = sorted({int(rid) for rid in recycle_ids})
+        items = {}
+        try:
+            with self.pool.connect() as conn:
+                for start in range(0, len(ids), 500):
+                    batch = ids[start:start + 500]
+                    placeholders = ",".join("?" * len(batch))
+                    cursor = conn.execute(
+                        f"SELECT id, user_id, status, file_path FROM recycle_bin WHERE id IN ({placeholders})", batch
+                    )
+                    items.update((row[0], row[1:]) for row in cursor.fetchall())
+        except sqlite3.Error as e:
+            logger.error(f"Error getting recycle bin items by ids: {e}")
+        return items
+    
+    def update_files_location(self, moves, folder_id):
+        """Cập nhật file_path và folder_id cho nhiều file trong một transaction
+
+        moves: [(file_id, new_path)]. sqlite3.Error được ném ra để caller hoàn tác việc di chuyển trên disk.
+        """
+        with self.pool.connect() as conn:
+            conn.executemany("""
+                UPDATE files 
+                SET file_path = ?, folder_id = ?, updated_at = CURRENT_TIMESTAMP 
+                WHERE id = ?
+            """, [(new_path, folder_id, file_id) for file_id, new_path in moves])
+        logger.info(f"Updated location of {len(moves)} files -> folder {folder_id}")
+    
+    def move_files_to_recycle_bin(self, file_ids, deleted_by_user_id, days_to_keep=30):
+        """Di chuyển nhiều file vào thùng rác trong một transaction; trả về {file_id: thành công}
+
+        Mỗi file chạy trong savepoint riêng (connect() lồng nhau): file lỗi được hoàn tác hết,
+        các file còn lại vẫn được commit.
+        """
+        with self.pool.connect():
+            # Các lời gọi lồng dùng chung connection nên chỉ commit một lần
+            return {file_id: self.move_to_recycle_bin(file_id, deleted_by_user_id, days_to_keep)
+                    for file_id in file_ids}
+    
+    def restore_many_from_recycle_bin(self, recycle_ids, user_id=None):
+        """Khôi phục nhiều file trong một transaction (mỗi file một savepoint); trả về {recycle_id: thành công}"""
+        with self.pool.connect():
+            return {recycle_id: self.restore_from_recycle_bin(recycle_id, user_id) for recycle_id in recycle_ids}
+    
+    def permanently_delete_many_from_recycle(self, recycle_ids, user_id=None):
+        """Xóa vĩnh viễn nhiều file trong một transaction (mỗi file một savepoint); trả về {recycle_id: (thành công, file_path)}"""
+        with self.pool.connect():
+            return {recycle_id: self.permanently_delete_from_recycle(recycle_id, user_id)
+                    for recycle_id in recycle_ids}
+    
+    def file_name_exists(self, user_id, original_filename, exclude_file_id=None):
+        """User có file (khác exclude_file_id) tên original_filename không, không phân biệt hoa thường
+
+        Tra index idx_files_user_name_nocase; NOCASE chỉ gộp hoa/thường chữ ASCII.
+        """
+        with self.pool.connect() as conn:
+            return bool(conn.execute("""
+                SELECT EXISTS (
+                    SELECT 1 FROM files
+                    WHERE user_id = ? AND original_filename = ? COLLATE NOCASE AND id IS NOT ?
+                )
+            """, (user_id, original_filename, exclude_file_id)).fetchone()[0])
+
     def update_file_path(self, file_id, new_path):
         """Cập nhật đường dẫn file"""
         try:
-            with sqlite3.connect(self.db_path) as conn:
-                conn.execute("""
+            with self.pool.connect() as conn:
+                cursor = conn.execute("""
                     UPDATE files 
                     SET file_path = ?, updated_at = CURRENT_TIMESTAMP 
                     WHERE id = ?
                 """, (new_path, file_id))
-                conn.commit()
                 
-                if conn.total_changes > 0:
+                if cursor.rowcount > 0:
                     logger.info(f"Updated file path for ID {file_id}: {new_path}")
                     return True
                 else:
@@ -314,15 +1046,14 @@ class FileDatabase:
     def update_file_folder(self, file_id, folder_id):
         """Cập nhật folder_id của file"""
         try:
-            with sqlite3.connect(self.db_path) as conn:
-                conn.execute("""
+            with self.pool.connect() as conn:
+                cursor = conn.execute("""
                     UPDATE files 
                     SET folder_id = ?, updated_at = CURRENT_TIMESTAMP 
                     WHERE id = ?
                 """, (folder_id, file_id))
-                conn.commit()
                 
-                if conn.total_changes > 0:
+                if cursor.rowcount > 0:
                     logger.info(f"Updated file folder for ID {file_id}: {folder_id}")
                     return True
                 else:
@@ -335,15 +1066,14 @@ class FileDatabase:
     def update_file_name(self, file_id, new_name, new_path):
         """Cập nhật tên file và đường dẫn file"""
         try:
-            with sqlite3.connect(self.db_path) as conn:
-                conn.execute("""
+            with self.pool.connect() as conn:
+                cursor = conn.execute("""
                     UPDATE files 
                     SET original_filename = ?, file_path = ?, updated_at = CURRENT_TIMESTAMP 
                     WHERE id = ?
                 """, (new_name, new_path, file_id))
-                conn.commit()
                 
-                if conn.total_changes > 0:
+                if cursor.rowcount > 0:
                     logger.info(f"Updated file name for ID {file_id}: {new_name} -> {new_path}")
                     return True
                 else:
@@ -353,34 +1083,148 @@ class FileDatabase:
             logger.error(f"Error updating file name: {e}")
             return False
     
-    def cleanup_temp_files(self):
-        """Dọn dẹp các file tạm cũ (có thể chạy định kỳ)"""
+    def create_upload(self, upload_id, user_id, file_name, file_size, folder_id=None, client_file_id=None,
+                      hash_algorithm=None, expected_hash=None):
+        """Tạo phiên upload resumable (offset 0); sqlite3.Error được ném ra cho caller"""
+        now = vietnam_now_isoformat()
+        with self.pool.connect() as conn:
+            conn.execute("""
+                INSERT INTO uploads (id, user_id, client_file_id, file_name, file_size, folder_id,
+                                     hash_algorithm, expected_hash, created_at, updated_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """, (upload_id, user_id, client_file_id, file_name, file_size, folder_id,
+                  hash_algorithm, expected_hash, now, now))
+        logger.info(f"Resumable upload created: {upload_id} ({file_name}, {file_size} bytes)")
+
+    def get_upload(self, upload_id):
+        with self.pool.connect() as conn:
+            conn.row_factory = sqlite3.Row
+            row = conn.execute("SELECT * FROM uploads WHERE id = ?", (upload_id,)).fetchone()
+            return dict(row) if row else None
+
+    def find_active_upload(self, user_id, client_file_id, file_name, file_size):
+        """Phiên đang dở của cùng file phía client (tạo lại sau khi mất response không mở phiên mới)"""
+        with self.pool.connect() as conn:
+            conn.row_factory = sqlite3.Row
+            row = conn.execute("""
+                SELECT * FROM uploads
+                WHERE user_id IS ? AND client_file_id = ? AND file_name = ? AND file_size = ? AND status = 'active'
+                ORDER BY created_at DESC LIMIT 1
+            """, (user_id, client_file_id, file_name, file_size)).fetchone()
+            return dict(row) if row else None
+
+    def claim_upload(self, upload_id, lease_token, lease_seconds):
+        """Giữ phiên 'active' cho một request (PATCH/finalize) trong lease_seconds giây
+
+        Lease nằm trong DB nên loại trừ cả request ở worker process khác; lease hết hạn (worker
+        chết giữa chừng) thì request khác lấy lại được. False nếu phiên không active hoặc đang bị giữ.
+        """
+        now = time.time()
+        with self.pool.connect() as conn:
+            cursor = conn.execute("""
+                UPDATE uploads SET lease_token = ?, lease_until = ?
+                WHERE id = ? AND status = 'active' AND (lease_until IS NULL OR lease_until < ?)
+            """, (lease_token, now + lease_seconds, upload_id, now))
+            return cursor.rowcount > 0
+
+    def renew_upload_lease(self, upload_id, lease_token, lease_seconds):
+        """Gia hạn lease; False nếu lease đã hết hạn và bị request khác lấy (hoặc phiên bị xóa)"""
+        with self.pool.connect() as conn:
+            cursor = conn.execute("""
+                UPDATE uploads SET lease_until = ? WHERE id = ? AND lease_token = ?
+            """, (time.time() + lease_seconds, upload_id, lease_token))
+            return cursor.rowcount > 0
+
+    def release_upload(self, upload_id, lease_token):
+        with self.pool.connect() as conn:
+            conn.execute("""
+                UPDATE uploads SET lease_token = NULL, lease_until = NULL WHERE id = ? AND lease_token = ?
+            """, (upload_id, lease_token))
+
+    def advance_upload_offset(self, upload_id, lease_token, old_offset, new_offset):
+        """Ghi nhận offset mới nếu request vẫn giữ lease và offset hiện tại vẫn là old_offset"""
+        with self.pool.connect() as conn:
+            cursor = conn.execute("""
+                UPDATE uploads SET upload_offset = ?, updated_at = ?
+                WHERE id = ? AND lease_token = ? AND upload_offset = ? AND status = 'active'
+            """, (new_offset, vietnam_now_isoformat(), upload_id, lease_token, old_offset))
+            return cursor.rowcount > 0
+
+    def complete_upload(self, upload_id, lease_token, file_id, content_hash):
+        """Đánh dấu phiên đã thành file file_id và bỏ lease; False nếu request không còn giữ lease"""
+        with self.pool.connect() as conn:
+            cursor = conn.execute("""
+                UPDATE uploads SET status = 'completed', file_id = ?, content_hash = ?, updated_at = ?,
+                                   lease_token = NULL, lease_until = NULL
+                WHERE id = ? AND lease_token = ? AND status = 'active'
+            """, (file_id, content_hash, vietnam_now_isoformat(), upload_id, lease_token))
+            return cursor.rowcount > 0
+
+    def delete_upload(self, upload_id):
+        with self.pool.connect() as conn:
+            return conn.execute("DELETE FROM uploads WHERE id = ?", (upload_id,)).rowcount > 0
+
+    def get_expired_uploads(self, cutoff, limit=500):
+        """Phiên upload không được cập nhật từ cutoff (datetime): list (id, status), cũ nhất trước"""
+        with self.pool.connect() as conn:
+            return [tuple(row) for row in conn.execute("""
+                SELECT id, status FROM uploads WHERE updated_at < ? ORDER BY updated_at LIMIT ?
+            """, (cutoff.isoformat(), limit)).fetchall()]
+
+    def get_stale_uploads(self, cutoff, limit=500):
+        """Các file còn 'uploading' tạo trước cutoff (datetime): list (id, temp_path), cũ nhất trước"""
+        # created_at lưu dạng ISO giờ Việt Nam nên so sánh chuỗi trực tiếp, dùng được index
+        with self.pool.connect() as conn:
+            cursor = conn.execute("""
+                SELECT id, temp_path FROM files
+                WHERE status = 'uploading' AND created_at < ?
+                ORDER BY created_at
+                LIMIT ?
+            """, (cutoff.astimezone(VIETNAM_TZ).isoformat(), limit))
+            return cursor.fetchall()
+    
+    def delete_files(self, file_ids):
+        """Xóa nhiều dòng files trong một transaction; trả về số dòng đã xóa"""
+        if not file_ids:
+            return 0
+        with self.pool.connect() as conn:
+            cursor = conn.executemany("DELETE FROM files WHERE id = ?", [(file_id,) for file_id in file_ids])
+            return cursor.rowcount
+    
+    def get_pending_temp_paths(self):
+        """temp_path của các upload chưa xong (uploading/paused), dùng để không xóa nhầm file tạm"""
+        with self.pool.connect() as conn:
+            cursor = conn.execute("""
+                SELECT temp_path FROM files
+                WHERE status IN ('uploading', 'paused') AND temp_path IS NOT NULL
+            """)
+            return {row[0] for row in cursor.fetchall()}
+    
+    def cleanup_temp_files(self, max_age=timedelta(days=1), batch_size=500):
+        """Dọn dẹp các file uploading cũ hơn max_age theo lô; trả về số dòng đã xóa"""
+        cutoff = get_vietnam_time() - max_age
+        deleted_count = 0
         try:
-            with sqlite3.connect(self.db_path) as conn:
-                # Xóa các file uploading cũ hơn 24h
-                conn.execute("""
-                    DELETE FROM files 
-                    WHERE status = 'uploading' 
-                    AND datetime(created_at) < datetime('now', '-1 day')
-                """)
-                
-                deleted_count = conn.total_changes
-                conn.commit()
-                
-                if deleted_count > 0:
-                    logger.info(f"Cleaned up {deleted_count} old temp files")
-                
-                return deleted_count
+            while True:
+                stale = self.get_stale_uploads(cutoff, batch_size)
+                deleted_count += self.delete_files([file_id for file_id, _ in stale])
+                if len(stale) < batch_size:
+                    break
+            
+            if deleted_count > 0:
+                logger.info(f"Cleaned up {deleted_count} old temp files")
+            
+            return deleted_count
         except sqlite3.Error as e:
             logger.error(f"Error cleaning up temp files: {e}")
-            return 0
+            return deleted_count
     
     # ==================== RECYCLE BIN METHODS ====================
     
     def move_to_recycle_bin(self, file_id, deleted_by_user_id, days_to_keep=30):
         """Di chuyển file vào thùng rác"""
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self.pool.connect() as conn:
                 # Lấy thông tin file
                 cursor = conn.execute("""
                     SELECT filename, original_filename, size, user_id, file_path 
@@ -409,7 +1253,6 @@ class FileDatabase:
                 
                 # Xóa khỏi bảng files chính
                 conn.execute("DELETE FROM files WHERE id = ?", (file_id,))
-                conn.commit()
                 
                 logger.info(f"File moved to recycle bin: ID {file_id}")
                 return True
@@ -418,63 +1261,95 @@ class FileDatabase:
             logger.error(f"Error moving file to recycle bin: {e}")
             return False
     
-    def get_recycle_bin_files(self, user_id=None):
-        """Lấy danh sách file trong thùng rác với username thật"""
+    def get_usernames_by_ids(self, user_ids):
+        """Lấy {user_id: username} từ auth database bằng một truy vấn IN (chia lô theo giới hạn tham số)"""
+        ids = sorted({uid for uid in user_ids if uid})
+        if not ids:
+            return {}
+        
+        usernames = {}
         try:
-            with sqlite3.connect(self.db_path) as conn:
-                if user_id:
-                    cursor = conn.execute("""
-                        SELECT r.id, r.original_file_id, r.filename, r.original_filename, 
-                               r.size, r.user_id, r.file_path, r.deleted_at, r.restore_deadline,
-                               r.status, r.deleted_by
-                        FROM recycle_bin r 
-                        WHERE r.user_id = ? AND r.status = 'in_recycle'
-                        ORDER BY r.deleted_at DESC
-                    """, (user_id,))
-                else:
-                    cursor = conn.execute("""
-                        SELECT r.id, r.original_file_id, r.filename, r.original_filename, 
-                               r.size, r.user_id, r.file_path, r.deleted_at, r.restore_deadline,
-                               r.status, r.deleted_by
-                        FROM recycle_bin r 
-                        WHERE r.status = 'in_recycle'
-                        ORDER BY r.deleted_at DESC
-                    """)
-                
-                files = []
-                for row in cursor.fetchall():
-                    # Lấy username thật từ auth database
-                    owner_username = self.get_username_by_id(row[5])
-                    deleted_by_username = self.get_username_by_id(row[10]) if row[10] else None
-                    
-                    files.append({
-                        'id': row[0],
-                        'original_file_id': row[1],
-                        'filename': row[2],
-                        'original_filename': row[3],
-                        'size': row[4],
-                        'user_id': row[5],
-                        'file_path': row[6],
-                        'deleted_at': row[7],
-                        'restore_deadline': row[8],
-                        'status': row[9],
-                        'deleted_by': row[10],
-                        'owner_name': owner_username or f'User_{row[5]}',  # Username thật hoặc fallback
-                        'deleted_by_name': deleted_by_username or f'User_{row[10]}' if row[10] else None
-                    })
-                
-                return files
-                
-                return files
-                
+            auth_db_path = os.path.join(os.path.dirname(self.db_path), "auth.db")
+            with get_pool(auth_db_path).connect() as conn:
+                for start in range(0, len(ids), 500):
+                    batch = ids[start:start + 500]
+                    placeholders = ",".join("?" * len(batch))
+                    cursor = conn.execute(f"SELECT id, username FROM users WHERE id IN ({placeholders})", batch)
+                    usernames.update(cursor.fetchall())
+        except sqlite3.Error as e:
+            logger.error(f"Error getting usernames: {e}")
+        return usernames
+    
+    def get_recycle_bin_files(self, user_id=None, limit=None, cursor=None):
+        """Lấy danh sách file trong thùng rác với username thật; trả về (files, next_cursor)
+
+        limit = None lấy tất cả; ngược lại phân trang keyset theo (deleted_at, id) giảm dần.
+        ValueError nếu cursor không hợp lệ.
+        """
+        where_conditions = ["r.status = 'in_recycle'"]
+        params = []
+        if user_id:
+            where_conditions.append("r.user_id = ?")
+            params.append(user_id)
+        if cursor:
+            last_deleted_at, last_id = decode_cursor(cursor)
+            where_conditions.append("(r.deleted_at, r.id) < (?, ?)")
+            params.extend([last_deleted_at, last_id])
+        
+        query = f"""
+            SELECT r.id, r.original_file_id, r.filename, r.original_filename, 
+                   r.size, r.user_id, r.file_path, r.deleted_at, r.restore_deadline,
+                   r.status, r.deleted_by
+            FROM recycle_bin r 
+            WHERE {' AND '.join(where_conditions)}
+            ORDER BY r.deleted_at DESC, r.id DESC
+        """
+        if limit:
+            query += " LIMIT ?"
+            params.append(limit + 1)  # lấy dư một dòng để biết còn trang sau
+        
+        try:
+            with self.pool.connect() as conn:
+                rows = conn.execute(query, params).fetchall()
         except sqlite3.Error as e:
             logger.error(f"Error getting recycle bin files: {e}")
-            return []
+            return [], None
+        
+        next_cursor = None
+        if limit and len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = encode_cursor([rows[-1][7], rows[-1][0]])
+        
+        # Lấy username thật của chủ file và người xóa trong một truy vấn
+        usernames = self.get_usernames_by_ids([row[5] for row in rows] + [row[10] for row in rows])
+        
+        files = []
+        for row in rows:
+            owner_username = usernames.get(row[5])
+            deleted_by_username = usernames.get(row[10]) if row[10] else None
+            
+            files.append({
+                'id': row[0],
+                'original_file_id': row[1],
+                'filename': row[2],
+                'original_filename': row[3],
+                'size': row[4],
+                'user_id': row[5],
+                'file_path': row[6],
+                'deleted_at': row[7],
+                'restore_deadline': row[8],
+                'status': row[9],
+                'deleted_by': row[10],
+                'owner_name': owner_username or f'User_{row[5]}',  # Username thật hoặc fallback
+                'deleted_by_name': deleted_by_username or f'User_{row[10]}' if row[10] else None
+            })
+        
+        return files, next_cursor
     
     def restore_from_recycle_bin(self, recycle_id, user_id=None):
         """Khôi phục file từ thùng rác"""
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self.pool.connect() as conn:
                 # Lấy thông tin file từ recycle_bin
                 query = """
                     SELECT original_file_id, filename, original_filename, size, 
@@ -509,7 +1384,6 @@ class FileDatabase:
                     UPDATE recycle_bin SET status = 'restored' WHERE id = ?
                 """, (recycle_id,))
                 
-                conn.commit()
                 logger.info(f"File restored from recycle bin: ID {recycle_id}")
                 return True
                 
@@ -520,7 +1394,7 @@ class FileDatabase:
     def permanently_delete_from_recycle(self, recycle_id, user_id=None):
         """Xóa vĩnh viễn file từ thùng rác"""
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self.pool.connect() as conn:
                 query = """
                     SELECT file_path FROM recycle_bin 
                     WHERE id = ? AND status = 'in_recycle'
@@ -545,7 +1419,6 @@ class FileDatabase:
                     UPDATE recycle_bin SET status = 'permanently_deleted' WHERE id = ?
                 """, (recycle_id,))
                 
-                conn.commit()
                 logger.info(f"File permanently deleted from recycle bin: ID {recycle_id}")
                 return True, file_path
                 
@@ -553,29 +1426,28 @@ class FileDatabase:
             logger.error(f"Error permanently deleting file from recycle bin: {e}")
             return False, None
     
-    def cleanup_expired_recycle_files(self):
-        """Dọn dẹp các file hết hạn trong thùng rác"""
+    def cleanup_expired_recycle_files(self, batch_size=500):
+        """Đánh dấu 'expired' một lô file quá hạn trong thùng rác; trả về list (id, file_path) để xóa file vật lý"""
         try:
-            with sqlite3.connect(self.db_path) as conn:
-                # Lấy danh sách file hết hạn
+            with self.pool.connect() as conn:
+                # restore_deadline lưu dạng ISO giờ Việt Nam: so sánh với now cùng định dạng
                 cursor = conn.execute("""
                     SELECT id, file_path FROM recycle_bin 
                     WHERE status = 'in_recycle' 
-                    AND restore_deadline < datetime('now')
-                """)
+                    AND restore_deadline < ?
+                    ORDER BY restore_deadline
+                    LIMIT ?
+                """, (vietnam_now_isoformat(), batch_size))
                 
                 expired_files = cursor.fetchall()
                 
                 # Đánh dấu các file hết hạn
-                conn.execute("""
-                    UPDATE recycle_bin 
-                    SET status = 'expired' 
-                    WHERE status = 'in_recycle' 
-                    AND restore_deadline < datetime('now')
-                """)
+                conn.executemany("""
+                    UPDATE recycle_bin SET status = 'expired' WHERE id = ?
+                """, [(recycle_id,) for recycle_id, _ in expired_files])
                 
-                conn.commit()
-                logger.info(f"Marked {len(expired_files)} expired recycle bin files")
+                if expired_files:
+                    logger.info(f"Marked {len(expired_files)} expired recycle bin files")
                 return expired_files
                 
         except sqlite3.Error as e:
@@ -0,0 +1,152 @@
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+from typing import Dict, List
+
+from logger import setup_logger
+
+logger = setup_logger("db_pool")
+
+# Cấu hình connection SQLite dùng chung cho FileDatabase/AuthDatabase
+DB_POOL_SIZE = int(os.environ.get("DB_POOL_SIZE", "8"))  # số connection rảnh giữ lại mỗi file DB
+DB_BUSY_TIMEOUT = int(os.environ.get("DB_BUSY_TIMEOUT", "5000"))  # ms chờ khi DB đang bị khóa ghi
+DB_CACHE_SIZE_KB = int(os.environ.get("DB_CACHE_SIZE_KB", "8192"))  # page cache mỗi connection
+DB_CACHED_STATEMENTS = int(os.environ.get("DB_CACHED_STATEMENTS", "256"))  # prepared statement cache
+
+
+class ConnectionPool:
+    """Pool connection SQLite sống lâu cho một file DB
+
+    Mỗi connection được mở một lần với WAL + synchronous=NORMAL, busy timeout, page cache
+    lớn và cache prepared statement, rồi được dùng lại thay vì connect/close mỗi lần gọi.
+    connect() trả connection theo kiểu `with sqlite3.connect(...) as conn`: commit khi thoát
+    bình thường, rollback khi lỗi. Gọi lồng nhau trong cùng thread dùng lại connection (và
+    transaction) của lời gọi ngoài cùng, trong một SAVEPOINT riêng: lỗi của lời gọi trong chỉ
+    hoàn tác phần nó đã ghi.
+    """
+
+    def __init__(self, db_path: str, size: int = DB_POOL_SIZE) -> None:
+        self.db_path = db_path
+        self.size = max(1, size)
+        self.idle: List[sqlite3.Connection] = []
+        self.lock = threading.Lock()
+        self.local = threading.local()
+
+    def _open(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(
+            self.db_path,
+            timeout=DB_BUSY_TIMEOUT / 1000,
+            check_same_thread=False,  # connection đi qua nhiều thread, nhưng mỗi lúc chỉ một thread giữ
+            cached_statements=DB_CACHED_STATEMENTS,
+        )
+        # Chỉ có hiệu lực với file DB mới tạo (DB cũ cần VACUUM một lần để chuyển sang)
+        conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(f"PRAGMA busy_timeout={DB_BUSY_TIMEOUT}")
+        conn.execute(f"PRAGMA cache_size={-DB_CACHE_SIZE_KB}")
+        conn.execute("PRAGMA temp_store=MEMORY")
+        return conn
+
+    def _acquire(self) -> sqlite3.Connection:
+        with self.lock:
+            if self.idle:
+                return self.idle.pop()
+        return self._open()
+
+    def _release(self, conn: sqlite3.Connection) -> None:
+        conn.row_factory = None
+        if conn.in_transaction:
+            conn.rollback()
+        with self.lock:
+            if len(self.idle) < self.size:
+                self.idle.append(conn)
+                return
+        # Quá số connection rảnh cho phép (lúc tải cao): đóng bớt
+        conn.close()
+
+    @contextmanager
+    def connect(self):
+        conn = getattr(self.local, "conn", None)
+        if conn is not None:
+            # Lời gọi lồng nhau: transaction do lời gọi ngoài cùng commit/rollback
+            depth = self.local.depth = self.local.depth + 1
+            savepoint = f"nested_{depth}"
+            row_factory = conn.row_factory
+            if not conn.in_transaction:
+                # RELEASE savepoint ngoài cùng khi chưa có transaction sẽ commit ngay
+                conn.execute("BEGIN")
+            conn.execute(f"SAVEPOINT {savepoint}")
+            try:
+                yield conn
+            except BaseException:
+                try:
+                    conn.execute(f"ROLLBACK TO {savepoint}")
+                    conn.execute(f"RELEASE {savepoint}")
+                except sqlite3.Error as e:
+                    # SQLite đã tự rollback cả transaction (vd. SQLITE_FULL): lời gọi ngoài cùng xử lý tiếp
+                    logger.warning("Rollback to savepoint %s failed: %s", savepoint, e)
+                raise
+            else:
+                conn.execute(f"RELEASE {savepoint}")
+            finally:
+                conn.row_factory = row_factory
+                self.local.depth = depth - 1
+            return
+
+        conn = self._acquire()
+        self.local.conn = conn
+        self.local.depth = 0
+        try:
+            with conn:
+                yield conn
+        finally:
+            self.local.conn = None
+            self._release(conn)
+
+    def optimize(self, vacuum_pages: int = 0) -> dict:
+        """Cập nhật thống kê cho query planner (ANALYZE giới hạn) và trả lại trang trống
+
+        incremental_vacuum chỉ chạy khi DB ở chế độ auto_vacuum=INCREMENTAL; vacuum_pages = 0
+        là trả hết freelist. Trả về số trang trống trước/sau để log.
+        """
+        with self.connect() as conn:
+            conn.execute("PRAGMA analysis_limit=1000")
+            conn.execute("ANALYZE")
+        with self.connect() as conn:
+            auto_vacuum = conn.execute("PRAGMA auto_vacuum").fetchone()[0]
+            free_before = conn.execute("PRAGMA freelist_count").fetchone()[0]
+            if auto_vacuum == 2 and free_before:
+                conn.execute(f"PRAGMA incremental_vacuum({max(0, int(vacuum_pages))})").fetchall()
+            free_after = conn.execute("PRAGMA freelist_count").fetchone()[0]
+        return {'auto_vacuum': auto_vacuum, 'free_pages_before': free_before, 'free_pages_after': free_after}
+
+    def close(self) -> None:
+        with self.lock:
+            idle, self.idle = self.idle, []
+        for conn in idle:
+            conn.close()
+
+
+_pools: Dict[str, ConnectionPool] = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(db_path: str) -> ConnectionPool:
+    """Pool dùng chung theo đường dẫn file DB (mọi instance cùng file dùng chung một pool)"""
+    key = os.path.abspath(db_path)
+    with _pools_lock:
+        pool = _pools.get(key)
+        if pool is None:
+            pool = _pools[key] = ConnectionPool(db_path)
+            logger.info("SQLite pool opened: %s (size=%d, busy_timeout=%dms)", key, pool.size, DB_BUSY_TIMEOUT)
+        return pool
+
+
+def close_pools() -> None:
+    with _pools_lock:
+        pools = list(_pools.values())
+        _pools.clear()
+    for pool in pools:
+        pool.close()
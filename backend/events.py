@@ -0,0 +1,71 @@
+import asyncio
+import json
+from typing import Dict, List, Optional, Tuple
+
+from logger import setup_logger
+
+logger = setup_logger("events")
+
+
+class EventAggregator:
+    """Gộp chunk-ack của mọi session trên một connection, gửi một message "batch" mỗi tick
+
+    chunk-ack lũy tiến của cùng một file chỉ giữ bản mới nhất (cộng dồn receivedBytes);
+    ack chế độ ranges (có "range") được giữ nguyên từng cái vì lane cần biết từng chunk.
+    Caller gọi flush() ngay khi window của client cần ack hoặc trước khi gửi event khác,
+    để thứ tự event không bị đảo.
+    """
+
+    def __init__(self, ws, tick: float) -> None:
+        self.ws = ws
+        self.tick = tick  # giây
+        self.pending: List[dict] = []
+        self.ack_index: Dict[str, int] = {}  # fileId -> vị trí chunk-ack lũy tiến trong pending
+        self.ack_counts: Dict[str, Tuple[int, int]] = {}  # fileId -> (số chunk, số byte) chưa gửi ack
+        self.task: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        if self.task is None:
+            self.task = asyncio.create_task(self._run())
+
+    def stop(self) -> None:
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+
+    def add(self, message: dict) -> Tuple[int, int]:
+        """Thêm chunk-ack vào batch; trả về (số chunk, số byte) của file đó đang chờ ack"""
+        file_id = message.get("fileId")
+        received = message.get("receivedBytes", 0)
+        index = self.ack_index.get(file_id)
+        if "range" not in message and index is not None:
+            message["receivedBytes"] += self.pending[index]["receivedBytes"]
+            self.pending[index] = message
+        else:
+            if "range" not in message:
+                self.ack_index[file_id] = len(self.pending)
+            self.pending.append(message)
+
+        chunks, size = self.ack_counts.get(file_id, (0, 0))
+        self.ack_counts[file_id] = (chunks + 1, size + received)
+        return self.ack_counts[file_id]
+
+    async def flush(self) -> None:
+        if not self.pending:
+            return
+        events, self.pending = self.pending, []
+        self.ack_index.clear()
+        self.ack_counts.clear()
+        if len(events) == 1:
+            await self.ws.send(json.dumps(events[0]))
+        else:
+            await self.ws.send(json.dumps({"event": "batch", "events": events}))
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.tick)
+            try:
+                await self.flush()
+            except Exception as e:
+                # Connection đã đóng: unregister_connection sẽ dừng task
+                logger.debug("Event flush failed: %s", e)
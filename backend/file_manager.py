@@ -1,17 +1,24 @@
-from flask import Flask, render_template, request, jsonify, send_file, abort, session, redirect, url_for
+from flask import Flask, Response, render_template, request, jsonify, abort, session, redirect, url_for
 from flask_cors import CORS
 import os
 import json
 import uuid
 import sqlite3
 import re
-from datetime import datetime, timedelta
+from datetime import datetime
 from pathlib import Path
 import shutil
 from werkzeug.utils import secure_filename
 import logging
 from database import db
 from auth_database import AuthDatabase
+from maintenance import build_scheduler
+from file_serving import content_disposition, serve_file
+from archive import stream_zip, unique_arcname
+from blob_store import BlobStore, is_blob_path
+from resumable_upload import (UPLOAD_LENGTH_HEADER, UPLOAD_OFFSET_HEADER, OffsetMismatch, ResumableUploads,
+                              UploadBusy)
+from hashing import HASH_ALGORITHM_HEADER, HASH_HEADER, HASH_SHA256, format_hash, new_hasher, parse_hash
 from functools import wraps
 
 # Thiết lập logging
@@ -29,8 +36,8 @@ app.secret_key = os.environ.get('SECRET_KEY', os.urandom(32).hex())
 auth_db = AuthDatabase()
 
 # Cấu hình
-UPLOAD_FOLDER = Path(__file__).parent / "remote_uploads"
-TEMP_FOLDER = Path(__file__).parent / "temp_uploads"
+UPLOAD_FOLDER = Path(os.environ.get('UPLOAD_FOLDER', Path(__file__).parent / "remote_uploads"))
+TEMP_FOLDER = Path(os.environ.get('TEMP_FOLDER', Path(__file__).parent / "temp_uploads"))
 UPLOAD_FOLDER.mkdir(parents=True, exist_ok=True)
 TEMP_FOLDER.mkdir(parents=True, exist_ok=True)
 
@@ -41,7 +48,8 @@ def login_required(f):
     def decorated_function(*args, **kwargs):
         # Kiểm tra session token
         token = request.headers.get('Authorization')
-        logger.info(f"🔐 Login check - Authorization header: {token}")
+        # SECURITY FIX: Do not log the token itself
+        logger.debug(f"🔐 Login check - Authorization header present: {bool(token)}")
         if token and token.startswith('Bearer '):
             token = token[7:]  # Remove 'Bearer ' prefix
             user = auth_db.get_user_by_token(token)
@@ -51,7 +59,7 @@ def login_required(f):
                 return f(*args, **kwargs)
         
         # Kiểm tra session cookie
-        logger.info(f"🍪 Session data: {dict(session)}")
+        logger.debug(f"🍪 Session has user_token: {'user_token' in session}")
         if 'user_token' in session:
             user = auth_db.get_user_by_token(session['user_token'])
             if user:
@@ -82,33 +90,49 @@ def admin_required(f):
     return decorated_function
 
 # Cấu hình
-UPLOAD_FOLDER = Path(__file__).parent / "remote_uploads"
-TEMP_FOLDER = Path(__file__).parent / "temp_uploads"
+UPLOAD_FOLDER = Path(os.environ.get('UPLOAD_FOLDER', Path(__file__).parent / "remote_uploads"))
+TEMP_FOLDER = Path(os.environ.get('TEMP_FOLDER', Path(__file__).parent / "temp_uploads"))
 UPLOAD_FOLDER.mkdir(parents=True, exist_ok=True)
 TEMP_FOLDER.mkdir(parents=True, exist_ok=True)
 
-# Legacy JSON database cho folders (giữ lại tạm thời)
+# Kho blob theo nội dung: file upload mới nằm ở remote_uploads/.blobs, tên file chỉ có trong DB
+blobs = BlobStore(UPLOAD_FOLDER, db)
+# Upload resumable qua HTTP (/api/uploads), dữ liệu ghi thẳng vào thư mục của kho blob
+resumable = ResumableUploads(db, blobs)
+
+# Job bảo trì định kỳ (upload treo, file tạm mồ côi, thùng rác, blob, session, ANALYZE/vacuum)
+maintenance = build_scheduler(db, auth_db, blobs, resumable, TEMP_FOLDER)
+
+# Phân trang /api/files
+FILES_PAGE_SIZE = int(os.environ.get('FILES_PAGE_SIZE', '100'))
+FILES_PAGE_MAX = int(os.environ.get('FILES_PAGE_MAX', '1000'))
+
+# Phân trang /api/search
+SEARCH_PAGE_SIZE = int(os.environ.get('SEARCH_PAGE_SIZE', '50'))
+SEARCH_PAGE_MAX = int(os.environ.get('SEARCH_PAGE_MAX', '200'))
+
+# Số id tối đa trong một request bulk
+BULK_MAX_ITEMS = int(os.environ.get('BULK_MAX_ITEMS', '1000'))
+
+# Legacy JSON database cho folders: chỉ còn dùng để migrate một lần sang bảng folders
 DB_FILE = UPLOAD_FOLDER / "files_db.json"
 
-def load_legacy_db():
-    """Load legacy database từ file JSON (chỉ cho folders)"""
-    if DB_FILE.exists():
-        try:
-            with open(DB_FILE, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-                # Chỉ trả về folders, files sẽ lấy từ SQLite
-                return {"folders": data.get("folders", [])}
-        except Exception as e:
-            logger.error(f"Error loading legacy database: {e}")
-    return {"folders": []}
-
-def save_legacy_db(data):
-    """Lưu legacy database vào file JSON (chỉ cho folders)"""
+def migrate_legacy_folders():
+    """Chuyển folders từ files_db.json sang SQLite rồi đổi tên file JSON để không nhập lại"""
+    if not DB_FILE.exists():
+        return
     try:
-        with open(DB_FILE, 'w', encoding='utf-8') as f:
-            json.dump(data, f, ensure_ascii=False, indent=2)
+        with open(DB_FILE, 'r', encoding='utf-8') as f:
+            folders = json.load(f).get("folders", [])
+        added = db.import_folders(folders)
+        # Số folder trước đây được đếm tay trong user_stats: tính lại theo bảng folders
+        db.rebuild_user_stats()
+        DB_FILE.rename(DB_FILE.with_name(DB_FILE.name + ".migrated"))
+        logger.info(f"Migrated {added}/{len(folders)} folders from {DB_FILE.name} to SQLite")
     except Exception as e:
-        logger.error(f"Error saving database: {e}")
+        logger.error(f"Error migrating legacy folders: {e}")
+
+migrate_legacy_folders()
 
 def create_folder_structure(file_path):
     """Tạo cấu trúc folder cho file"""
@@ -267,6 +291,24 @@ def get_user_info():
     user = get_current_user()
     return jsonify({'user': user})
 
+def add_completed_file(blob_path, user, file_name, file_size, folder_id, content_hash):
+    """Thêm dòng files 'completed' trỏ tới blob; gọi trong khối blobs.store() để cùng transaction"""
+    file_db_id = db.add_file(
+        filename=secure_filename(file_name),  # tên an toàn chỉ lưu trong metadata, tên trên đĩa là hash nội dung
+        original_filename=file_name,
+        size=file_size,
+        uploader=user['username'],
+        user_id=user['id'],
+        folder_id=folder_id,
+        temp_path=None,  # File đã hoàn tất, không còn ở temp
+        content_hash=content_hash
+    )
+    
+    # Cập nhật status thành completed và trỏ file_path tới blob
+    if not db.update_file_status(file_id=file_db_id, status="completed", file_path=blob_path):
+        raise sqlite3.Error(f"Failed to complete file {file_db_id}")
+    return file_db_id
+
 @app.route('/api/upload', methods=['POST'])
 @login_required
 def upload_file():
@@ -286,101 +328,262 @@ def upload_file():
         if not file_name or not file_size or not file_id:
             return jsonify({"error": "Missing required headers"}), 400
         
-        # Tạo tên file an toàn
-        safe_filename = secure_filename(file_name)
-        
-        # Tạo đường dẫn file với user folder (sử dụng username thay vì user_id)
-        user_folder = UPLOAD_FOLDER / user['username']
-        user_folder.mkdir(exist_ok=True)
-        file_path = user_folder / safe_filename
-        
-        # Xử lý trùng tên file
-        counter = 1
-        original_name = file_path.stem
-        original_ext = file_path.suffix
-        while file_path.exists():
-            file_path = user_folder / f"{original_name} ({counter}){original_ext}"
-            counter += 1
-        
-        # Lưu file
-        with open(file_path, 'wb') as f:
+        # Digest do WebSocket server tính trong lúc nhận chunk: kiểm tra khi ghi, không đọc lại file
+        expected_hash = parse_hash(request.headers.get(HASH_HEADER))
+        hash_algorithm = expected_hash[0] if expected_hash else request.headers.get(HASH_ALGORITHM_HEADER)
+        hasher = new_hasher(hash_algorithm) if hash_algorithm else None
+        if hash_algorithm and hasher is None:
+            logger.warning(f"Unsupported content hash algorithm, skipping verification: {hash_algorithm}")
+        
+        # Ghi vào file tạm trong kho blob, sha256 của kho được tính cùng lượt ghi
+        writer = blobs.open_writer()
+        if hash_algorithm == HASH_SHA256:
+            hasher = None  # dùng luôn sha256 của writer
+        try:
             chunk_size = 1024 * 1024  # 1MB
             while True:
                 chunk = request.stream.read(chunk_size)
                 if not chunk:
                     break
-                f.write(chunk)
+                writer.write(chunk)
+                if hasher is not None:
+                    hasher.update(chunk)
+        except Exception:
+            # Client ngắt kết nối giữa chừng: xóa file dở
+            writer.discard()
+            raise
+        written = writer.size
+
+        # Relay streaming có thể bị ngắt giữa chừng (pause quá lâu, stop): không lưu file thiếu
+        if written != file_size:
+            writer.discard()
+            logger.warning(f"Incomplete upload body for {file_name}: {written}/{file_size} bytes")
+            return jsonify({"error": "Incomplete upload"}), 400
+        
+        if hash_algorithm == HASH_SHA256:
+            content_hash = format_hash(HASH_SHA256, writer.hexdigest())
+        elif hasher is not None:
+            content_hash = format_hash(hash_algorithm, hasher.hexdigest())
+        else:
+            content_hash = None
+        if expected_hash and content_hash != format_hash(*expected_hash):
+            writer.discard()
+            logger.warning(f"Content hash mismatch for {file_name}: expected {format_hash(*expected_hash)}, got {content_hash}")
+            return jsonify({"error": "Content hash mismatch"}), 400
 
-        # Lưu thông tin file vào SQLite database với user_id
+        # Lưu thông tin file vào SQLite database với user_id, cùng transaction với việc đặt blob
         try:
-            file_db_id = db.add_file(
-                filename=safe_filename,
-                original_filename=file_name,
-                size=file_size,
-                uploader=user['username'],
-                user_id=user['id'],
-                folder_id=folder_id,
-                temp_path=None  # File đã hoàn tất, không còn ở temp
-            )
-            
-            # Cập nhật status thành completed và lưu file_path tương đối
-            # Lấy tên file cuối cùng sau khi xử lý duplicate
-            final_filename = file_path.name
-            relative_file_path = f"{user['username']}/{final_filename}"
-            
-            db.update_file_status(
-                file_id=file_db_id,
-                status="completed",
-                file_path=relative_file_path
-            )
+            with blobs.store(writer) as blob_path:
+                file_db_id = add_completed_file(blob_path, user, file_name, file_size, folder_id, content_hash)
             
-            logger.info(f"File uploaded successfully: {file_name} -> {file_path} (DB ID: {file_db_id})")
+            logger.info(f"File uploaded successfully: {file_name} -> {blob_path} (DB ID: {file_db_id})")
             
             return jsonify({
                 "success": True,
                 "file_id": file_db_id,
+                "content_hash": content_hash,
                 "message": "File uploaded successfully"
             })
             
         except Exception as db_error:
-            # Nếu lỗi database, xóa file đã tạo
-            if file_path.exists():
-                file_path.unlink()
+            # Lỗi database: transaction đã rollback, blob mới tạo đã bị xóa
+            writer.discard()
             logger.error(f"Database error: {db_error}")
             return jsonify({"error": "Database error"}), 500
     except Exception as e:
         logger.error(f"Error uploading file: {e}")
         return jsonify({"error": str(e)}), 500
 
-def cleanup_stuck_uploads(user_id):
-    """Clean up files stuck in uploading status for more than 30 minutes"""
+# ============ RESUMABLE UPLOAD (HTTP) ============
+
+def upload_session_response(upload, status=200):
+    """Trạng thái phiên upload resumable: JSON + header Upload-Offset/Upload-Length"""
+    response = jsonify({
+        "upload_id": upload['id'],
+        "offset": upload['upload_offset'],
+        "file_size": upload['file_size'],
+        "status": upload['status'],
+        "file_id": upload['file_id'],
+    })
+    response.status_code = status
+    response.headers[UPLOAD_OFFSET_HEADER] = str(upload['upload_offset'])
+    response.headers[UPLOAD_LENGTH_HEADER] = str(upload['file_size'])
+    response.headers['Cache-Control'] = 'no-store'
+    return response
+
+def get_own_upload(upload_id):
+    """Phiên upload của user hiện tại; trả về (upload, None) hoặc (None, response lỗi)"""
+    upload = db.get_upload(upload_id)
+    if not upload:
+        return None, (jsonify({"error": "Upload not found"}), 404)
+    if upload['user_id'] != get_current_user()['id']:
+        return None, (jsonify({"error": "Permission denied"}), 403)
+    return upload, None
+
+@app.route('/api/uploads', methods=['POST'])
+@login_required
+def create_resumable_upload():
+    """Tạo phiên upload resumable; headers giống /api/upload (X-File-Name, X-File-Size, X-File-ID, X-Folder-ID, hash)
+
+    Trình duyệt gửi JSON body {file_name, file_size, file_id, folder_id} thay cho header
+    (header HTTP không chứa được tên file Unicode).
+    """
     try:
-        cutoff_time = datetime.now() - timedelta(minutes=30)
-        
-        # Get files stuck in uploading status
-        with sqlite3.connect(db.db_path) as conn:
-            cursor = conn.cursor()
-            cursor.execute("""
-                SELECT id, filename FROM files 
-                WHERE user_id = ? AND status = 'uploading' 
-                AND datetime(created_at) < datetime(?)
-            """, (user_id, cutoff_time.isoformat()))
-            
-            stuck_files = cursor.fetchall()
-            
-            if stuck_files:
-                logger.info(f"🧹 Found {len(stuck_files)} stuck uploads for user {user_id}, cleaning up...")
-                
-                # Delete stuck uploads
-                for file_id, filename in stuck_files:
-                    cursor.execute("DELETE FROM files WHERE id = ?", (file_id,))
-                    logger.info(f"  Deleted stuck upload: {filename}")
+        user = get_current_user()
+        data = request.get_json(silent=True) or {}
+        file_name = request.headers.get('X-File-Name') or data.get('file_name')
+        file_size = int(request.headers.get('X-File-Size') or request.headers.get(UPLOAD_LENGTH_HEADER)
+                        or data.get('file_size') or 0)
+        if not file_name or file_size <= 0:
+            return jsonify({"error": "Missing required headers"}), 400
+        
+        expected_hash = parse_hash(request.headers.get(HASH_HEADER))
+        hash_algorithm = expected_hash[0] if expected_hash else request.headers.get(HASH_ALGORITHM_HEADER)
+        upload, created = resumable.create(
+            user, file_name, file_size,
+            folder_id=request.headers.get('X-Folder-ID') or data.get('folder_id'),
+            client_file_id=request.headers.get('X-File-ID') or data.get('file_id'),
+            hash_algorithm=hash_algorithm,
+            expected_hash=format_hash(*expected_hash) if expected_hash else None
+        )
+        response = upload_session_response(upload, 201 if created else 200)
+        response.headers['Location'] = url_for('get_resumable_upload', upload_id=upload['id'])
+        return response
+    except ValueError:
+        return jsonify({"error": "Invalid file size"}), 400
+    except Exception as e:
+        logger.error(f"Error creating resumable upload: {e}")
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/api/uploads/<upload_id>', methods=['GET', 'HEAD'])
+@login_required
+def get_resumable_upload(upload_id):
+    """Offset đã ghi nhận của phiên (HEAD chỉ trả header Upload-Offset)"""
+    upload, error = get_own_upload(upload_id)
+    if error:
+        return error
+    return upload_session_response(upload)
+
+@app.route('/api/uploads/<upload_id>', methods=['PATCH'])
+@login_required
+def append_resumable_upload(upload_id):
+    """Gửi tiếp dữ liệu từ header Upload-Offset; offset khác offset đã ghi nhận -> 409 kèm offset đúng"""
+    try:
+        upload, error = get_own_upload(upload_id)
+        if error:
+            return error
+        try:
+            offset = int(request.headers[UPLOAD_OFFSET_HEADER])
+        except (KeyError, ValueError):
+            return jsonify({"error": f"Missing or invalid {UPLOAD_OFFSET_HEADER} header"}), 400
+        if request.content_length is not None and offset + request.content_length > upload['file_size']:
+            return jsonify({"error": "Upload exceeds file size"}), 413
+        
+        try:
+            new_offset = resumable.append(upload, offset, request.stream)
+        except OffsetMismatch as e:
+            # UploadBusy: request khác đang ghi phiên này, client hỏi lại offset rồi thử lại sau
+            response = jsonify({"error": "Upload is busy" if isinstance(e, UploadBusy) else "Offset mismatch",
+                                "offset": e.offset})
+            response.status_code = 409
+            response.headers[UPLOAD_OFFSET_HEADER] = str(e.offset)
+            return response
+        except FileNotFoundError:
+            return jsonify({"error": "Upload not found"}), 404
+        upload['upload_offset'] = new_offset
+        return upload_session_response(upload)
+    except Exception as e:
+        # Phần body đã nhận trước khi lỗi vẫn được ghi nhận: client HEAD rồi gửi tiếp
+        logger.error(f"Error appending to upload {upload_id}: {e}")
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/api/uploads/<upload_id>/finalize', methods=['POST'])
+@login_required
+def finalize_resumable_upload(upload_id):
+    """Đưa file đã nhận đủ vào kho blob; trả về giống /api/upload (gọi lại trả cùng kết quả)"""
+    try:
+        user = get_current_user()
+        upload, error = get_own_upload(upload_id)
+        if error:
+            return error
+        
+        # Lease trong DB: chỉ một request (ở bất kỳ worker nào) được finalize hoặc ghi phiên này
+        lease = resumable.claim(upload_id)
+        upload = db.get_upload(upload_id)
+        if not upload:
+            # Bị hủy (DELETE) ngay trước đó
+            return jsonify({"error": "Upload not found"}), 404
+        if lease is None:
+            if upload['status'] == 'active':
+                return jsonify({"error": "Upload is busy", "offset": upload['upload_offset']}), 409
+            if upload['status'] != 'completed':
+                return jsonify({"error": f"Upload is {upload['status']}"}), 409
+        else:
+            try:
+                try:
+                    writer, content_hash = resumable.finalize(upload)
+                except ValueError as e:
+                    if upload['upload_offset'] != upload['file_size']:
+                        return jsonify({"error": str(e), "offset": upload['upload_offset']}), 400
+                    # Hash không khớp: dữ liệu sai, bỏ phiên để client upload lại từ đầu
+                    resumable.abort(upload_id)
+                    logger.warning(f"Resumable upload {upload_id} rejected: {e}")
+                    return jsonify({"error": "Content hash mismatch"}), 400
                 
-                conn.commit()
-                logger.info(f"✅ Cleaned up {len(stuck_files)} stuck uploads")
+                with blobs.store(writer) as blob_path:
+                    file_db_id = add_completed_file(blob_path, user, upload['file_name'], upload['file_size'],
+                                                    upload['folder_id'], content_hash)
+                    if not db.complete_upload(upload_id, lease, file_db_id, content_hash):
+                        # Mất lease (hết hạn hoặc phiên bị hủy): rollback dòng files và blob vừa thêm
+                        raise UploadBusy(upload['upload_offset'])
+            except UploadBusy:
+                return jsonify({"error": "Upload is busy", "offset": upload['upload_offset']}), 409
+            finally:
+                resumable.release(upload_id, lease)
+            upload = db.get_upload(upload_id)
+            logger.info(f"Resumable upload finalized: {upload['file_name']} -> {blob_path} (DB ID: {file_db_id})")
+        resumable.forget(upload_id)
         
+        return jsonify({
+            "success": True,
+            "file_id": upload['file_id'],
+            "content_hash": upload['content_hash'],
+            "message": "File uploaded successfully"
+        })
     except Exception as e:
-        logger.error(f"Error cleaning up stuck uploads: {e}")
+        logger.error(f"Error finalizing upload {upload_id}: {e}")
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/api/uploads/<upload_id>', methods=['DELETE'])
+@login_required
+def abort_resumable_upload(upload_id):
+    """Hủy phiên upload và xóa dữ liệu đã nhận"""
+    upload, error = get_own_upload(upload_id)
+    if error:
+        return error
+    resumable.abort(upload_id)
+    return jsonify({"success": True})
+
+def format_file_item(file):
+    """Dòng files -> item file theo định dạng frontend dùng"""
+    # Normalize file path separators cho consistency; blob không có path theo folder nên không trả về
+    # (frontend suy ra root/folder từ file_path của file cũ)
+    normalized_path = file["file_path"].replace('\\', '/') if file["file_path"] else None
+    if is_blob_path(normalized_path):
+        normalized_path = None
+    return {
+        "id": file["id"],
+        "name": file["original_filename"],
+        "filename": file["original_filename"],
+        "file_path": normalized_path,
+        "folder_id": file.get("folder_id"),
+        "size": file["size"],
+        "upload_time": file["created_at"],
+        "status": file["status"],
+        "uploader": file["uploader"],
+        "user_id": file["user_id"],
+        "type": "file"
+    }
 
 @app.route('/api/files', methods=['GET'])
 @login_required
@@ -390,16 +593,27 @@ def get_files():
         user = get_current_user()
         logger.info(f"🔍 API /api/files called by user: {user['id']} ({user['username']})")
         
-        # FIX: Clean up stuck uploads before returning files
-        cleanup_stuck_uploads(user['id'])
-        
         # Lấy tham số query
         status = request.args.get('status')  # completed, uploading, paused
         limit = request.args.get('limit', type=int)
-        offset = request.args.get('offset', 0, type=int)
-        
-        # Lấy files của user từ database
-        files = db.get_user_files(user['id'], status=status)
+        cursor = request.args.get('cursor')
+        sort = request.args.get('sort', 'date')  # date, name, size
+        order = request.args.get('order', 'asc' if sort == 'name' else 'desc')
+        
+        # Có limit/cursor/sort -> phân trang keyset, trả {"files": [...], "next_cursor": ...}
+        paginated = limit is not None or cursor is not None or 'sort' in request.args
+        next_cursor = None
+        if paginated:
+            limit = max(1, min(limit or FILES_PAGE_SIZE, FILES_PAGE_MAX))
+            try:
+                files, next_cursor = db.get_user_files_page(
+                    user['id'], status=status, sort=sort, order=order, limit=limit, cursor=cursor
+                )
+            except ValueError as e:
+                return jsonify({"error": str(e)}), 400
+        else:
+            # Client cũ: toàn bộ danh sách dạng mảng
+            files = db.get_user_files(user['id'], status=status)
         logger.info(f"📁 Found {len(files)} files for user {user['id']}")
         
         # Log first few files for debugging
@@ -407,53 +621,61 @@ def get_files():
             logger.info(f"  File {i+1}: {f['original_filename']} (Status: {f['status']}, Path: {f.get('file_path', 'NULL')})")
         
         # Convert format cho frontend compatibility
-        formatted_files = []
-        for file in files:
-            # Normalize file path separators cho consistency
-            normalized_path = file["file_path"].replace('\\', '/') if file["file_path"] else None
-            
-            formatted_files.append({
-                "id": file["id"],
-                "name": file["original_filename"],
-                "filename": file["original_filename"],
-                "file_path": normalized_path,
-                "folder_id": file.get("folder_id"),
-                "size": file["size"],
-                "upload_time": file["created_at"],
-                "status": file["status"],
-                "uploader": file["uploader"],
-                "user_id": file["user_id"],
-                "type": "file"
-            })
+        formatted_files = [format_file_item(file) for file in files]
         
         logger.info(f"✅ Returning {len(formatted_files)} formatted files to frontend")
+        if paginated:
+            return jsonify({"files": formatted_files, "next_cursor": next_cursor})
         return jsonify(formatted_files)
     except Exception as e:
         logger.error(f"Error getting files: {e}")
         return jsonify({"error": str(e)}), 500
 
+@app.route('/api/search', methods=['GET'])
+@login_required
+def search_files():
+    """Tìm file của user hiện tại theo tên (và path folder) bằng index FTS5
+
+    Query: q (bắt buộc), status, limit, cursor. Khớp theo tiền tố từng từ, không phân biệt
+    hoa thường và dấu tiếng Việt; kết quả xếp theo độ liên quan.
+    """
+    try:
+        user = get_current_user()
+        text = request.args.get('q', '').strip()
+        if not text:
+            return jsonify({"error": "Missing search query"}), 400
+        
+        status = request.args.get('status')
+        limit = max(1, min(request.args.get('limit', SEARCH_PAGE_SIZE, type=int), SEARCH_PAGE_MAX))
+        try:
+            files, next_cursor = db.search_user_files(
+                user['id'], text, status=status, limit=limit, cursor=request.args.get('cursor')
+            )
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        
+        results = []
+        for file in files:
+            item = format_file_item(file)
+            item["folder_path"] = file["folder_path"]
+            results.append(item)
+        logger.info(f"🔎 Search '{text}' by user {user['id']}: {len(results)} results")
+        return jsonify({"files": results, "next_cursor": next_cursor})
+    except Exception as e:
+        logger.error(f"Error searching files: {e}")
+        return jsonify({"error": str(e)}), 500
+
 @app.route('/api/folders', methods=['GET'])
 @login_required
 def get_folders():
-    """Lấy danh sách folders của user hiện tại từ legacy database - USER ISOLATED"""
+    """Lấy danh sách folders của user hiện tại - USER ISOLATED"""
     try:
         user = get_current_user()
         user_id = user['id']
         parent_id = request.args.get('parent_id')  # Thêm filter by parent_id
-        legacy_data = load_legacy_db()
-        
-        # Lọc folders của user hiện tại
-        user_folders = []
-        for folder in legacy_data.get("folders", []):
-            # Chỉ lấy folders của user hiện tại
-            if folder.get("user_id") == user_id:
-                if parent_id is not None:
-                    # Filter by parent_id nếu có
-                    if folder.get("parent_id") == parent_id:
-                        user_folders.append(folder)
-                else:
-                    # Lấy tất cả folders của user
-                    user_folders.append(folder)
+        
+        # Chỉ lấy folders của user hiện tại (lọc theo parent_id nếu có)
+        user_folders = db.get_user_folders(user_id, parent_id)
         
         logger.info(f"Found {len(user_folders)} folders for user {user['username']}")
         return jsonify(user_folders)
@@ -531,10 +753,11 @@ def download_file(file_id):
             
             if file_path.exists():
                 logger.info(f"🔽 File found at original path, sending: {file_info['original_filename']}")
-                return send_file(
+                return serve_file(
                     file_path,
+                    file_info["original_filename"],
                     as_attachment=True,
-                    download_name=file_info["original_filename"]
+                    content_hash=file_info.get("content_hash")
                 )
             else:
                 # If original path fails, try searching in user folders
@@ -552,10 +775,11 @@ def download_file(file_id):
                         logger.info(f"🔽 Checking: {potential_path}")
                         if potential_path.exists():
                             logger.info(f"🔽 File found in user folder, sending: {filename}")
-                            return send_file(
+                            return serve_file(
                                 potential_path,
+                                filename,
                                 as_attachment=True,
-                                download_name=filename
+                                content_hash=file_info.get("content_hash")
                             )
                 
                 logger.error(f"🔽 File not found: {filename}")
@@ -590,8 +814,8 @@ def preview_file(file_id):
         if file_info["file_path"]:
             file_path = UPLOAD_FOLDER / file_info["file_path"]
             if file_path.exists():
-                # Determine file type for appropriate headers
-                file_ext = file_path.suffix.lower()
+                # Determine file type for appropriate headers (theo tên gốc: blob không có phần mở rộng)
+                file_ext = Path(file_info["original_filename"]).suffix.lower()
                 
                 # Set appropriate MIME type
                 mime_types = {
@@ -604,11 +828,12 @@ def preview_file(file_id):
                 
                 mimetype = mime_types.get(file_ext, 'application/octet-stream')
                 
-                return send_file(
+                return serve_file(
                     file_path,
-                    mimetype=mimetype,
+                    file_info["original_filename"],
                     as_attachment=False,  # Display inline for preview
-                    download_name=file_info["original_filename"]
+                    mimetype=mimetype,
+                    content_hash=file_info.get("content_hash")
                 )
             else:
                 return jsonify({"error": "File not found on disk"}), 404
@@ -688,12 +913,7 @@ def create_folder():
         
         if parent_id:
             # Tìm parent folder - CHỈ TRONG FOLDER CỦA USER
-            legacy_data = load_legacy_db()
-            parent_folder = None
-            for folder in legacy_data["folders"]:
-                if folder["id"] == parent_id and folder.get("user_id") == user_id:
-                    parent_folder = folder
-                    break
+            parent_folder = db.get_folder(parent_id, user_id)
             
             if not parent_folder:
                 return jsonify({"error": "Parent folder not found or access denied"}), 404
@@ -721,10 +941,9 @@ def create_folder():
             "type": "folder"
         }
         
-        # Lưu vào legacy database (cho folders)
-        legacy_data = load_legacy_db()
-        legacy_data["folders"].append(folder_info)
-        save_legacy_db(legacy_data)
+        if not db.add_folder(folder_info["id"], folder_name, relative_path, parent_id, user_id, username,
+                             folder_info["created_time"]):
+            return jsonify({"error": "Failed to save folder"}), 500
         
         logger.info(f"Folder created: {folder_name} by user {username} (user_id: {user_id}, parent: {parent_id})")
         return jsonify({
@@ -740,7 +959,7 @@ def create_folder():
 @app.route('/api/folders/<folder_id>', methods=['DELETE'])
 @login_required
 def delete_folder(folder_id):
-    """Xóa folder từ legacy database - USER ISOLATED"""
+    """Xóa folder - USER ISOLATED"""
     try:
         user = get_current_user()
         user_id = user['id']
@@ -758,26 +977,22 @@ def delete_folder(folder_id):
         
         logger.info(f"Moved {deleted_files_count} files to recycle bin before deleting folder")
         
-        legacy_data = load_legacy_db()
-        for i, folder_info in enumerate(legacy_data["folders"]):
-            if folder_info["id"] == folder_id and folder_info.get("user_id") == user_id:
-                # Xóa folder từ disk
-                folder_path = UPLOAD_FOLDER / folder_info["path"]
-                logger.info(f"Attempting to delete folder path: {folder_path}")
-                if folder_path.exists():
-                    shutil.rmtree(folder_path)
-                    logger.info(f"Successfully deleted folder from disk: {folder_path}")
-                
-                # Xóa khỏi legacy database
-                deleted_folder = legacy_data["folders"].pop(i)
-                save_legacy_db(legacy_data)
-                
-                logger.info(f"Folder deleted: {deleted_folder['name']} by user {user['username']}")
-                return jsonify({
-                    "success": True, 
-                    "message": f"Folder deleted successfully. {deleted_files_count} files moved to recycle bin.",
-                    "deleted_files": deleted_files_count
-                })
+        # Xóa khỏi database (chỉ folder của user)
+        deleted_folder = db.delete_folder(folder_id, user_id)
+        if deleted_folder:
+            # Xóa folder từ disk
+            folder_path = UPLOAD_FOLDER / deleted_folder["path"]
+            logger.info(f"Attempting to delete folder path: {folder_path}")
+            if folder_path.exists():
+                shutil.rmtree(folder_path)
+                logger.info(f"Successfully deleted folder from disk: {folder_path}")
+            
+            logger.info(f"Folder deleted: {deleted_folder['name']} by user {user['username']}")
+            return jsonify({
+                "success": True, 
+                "message": f"Folder deleted successfully. {deleted_files_count} files moved to recycle bin.",
+                "deleted_files": deleted_files_count
+            })
         
         logger.warning(f"Folder {folder_id} not found or access denied for user {user_id}")
         return jsonify({"error": "Folder not found or access denied"}), 404
@@ -793,45 +1008,12 @@ def get_stats():
         user = get_current_user()
         logger.info(f"Getting stats for user: {user['id']} ({user['username']})")
         
-        # Lấy files của user hiện tại
-        user_files = db.get_user_files(user['id'])
-        
-        # Tính toán stats cho user
-        total_files = len(user_files)
-        completed_files = len([f for f in user_files if f['status'] == 'completed'])
-        uploading_files = len([f for f in user_files if f['status'] == 'uploading'])
-        paused_files = len([f for f in user_files if f['status'] == 'paused'])
-        total_size = sum(f['size'] or 0 for f in user_files if f['status'] == 'completed')
-        
-        # Lấy folder stats từ legacy database - FILTER THEO USER_ID (kể cả admin)
-        legacy_data = load_legacy_db()
-        user_folders = []
-        for folder in legacy_data.get("folders", []):
-            # Chỉ đếm folders thuộc về user hiện tại
-            if folder.get("user_id") == user['id']:
-                user_folders.append(folder)
-        
-        total_folders = len(user_folders)
+        # Thống kê được duy trì sẵn trong user_stats (trigger + số folder)
+        stats = db.get_user_stats(user['id'])
         
-        # Lấy thống kê file types từ completed files của user
-        file_types = {}
-        for file_info in user_files:
-            if file_info['status'] == 'completed':
-                ext = Path(file_info["original_filename"]).suffix.lower()
-                if ext:
-                    file_types[ext] = file_types.get(ext, 0) + 1
+        logger.info(f"User {user['id']} stats: {stats['total_files']} files, {stats['completed_files']} completed")
         
-        logger.info(f"User {user['id']} stats: {total_files} files, {completed_files} completed")
-        
-        return jsonify({
-            "total_files": total_files,
-            "completed_files": completed_files,
-            "uploading_files": uploading_files,
-            "paused_files": paused_files,
-            "total_folders": total_folders,
-            "total_size": total_size,
-            "file_types": file_types
-        })
+        return jsonify(stats)
     except Exception as e:
         logger.error(f"Error getting stats: {e}")
         return jsonify({"error": str(e)}), 500
@@ -876,6 +1058,64 @@ def cleanup_old_files():
         logger.error(f"Error during cleanup: {e}")
         return jsonify({"error": str(e)}), 500
 
+def find_file_on_disk(file_info, username):
+    """Tìm file trên disk theo file_path trong DB và các vị trí cũ; trả về (path hoặc None, các path đã thử)"""
+    possible_paths = []
+    current_file_path = file_info.get("file_path")
+    if current_file_path:
+        possible_paths.append(UPLOAD_FOLDER / current_file_path)
+    
+    # Thêm các đường dẫn có thể khác
+    possible_paths.extend([
+        UPLOAD_FOLDER / username / file_info["original_filename"],
+        UPLOAD_FOLDER / file_info["original_filename"],
+        UPLOAD_FOLDER / username / "root" / file_info["original_filename"]
+    ])
+    
+    for path in possible_paths:
+        if path.exists():
+            return path, possible_paths
+    return None, possible_paths
+
+def folder_disk_path(folder, username):
+    """Đường dẫn tương đối của folder trong UPLOAD_FOLDER (sửa path của folder cũ)"""
+    folder_path = folder.get("path")
+    if not folder_path or folder_path == "None" or folder_path.startswith("None/"):
+        # Folder cũ không có path đúng, tạo path mới
+        folder_path = f"{username}/{folder['name']}"
+    elif not folder_path.startswith(f"{username}/"):
+        # Path không có username prefix, thêm vào
+        folder_path = f"{username}/{folder['name']}"
+    return folder_path
+
+def move_target_path(file_info, current_path, target_folder_path):
+    """Đường dẫn đích khi chuyển file vào target_folder_path (tạo thư mục nếu cần)
+
+    Trùng tên với file khác thì thêm timestamp; None nếu file đã nằm sẵn ở đích.
+    """
+    target_folder_path.mkdir(parents=True, exist_ok=True)
+    new_file_path = target_folder_path / file_info["original_filename"]
+    if not new_file_path.exists():
+        return new_file_path
+    if new_file_path.resolve() == current_path.resolve():
+        return None
+    
+    # Tạo tên file mới với timestamp để tránh trùng lặp
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    name_parts = file_info["original_filename"].rsplit('.', 1)
+    counter = 0
+    while True:
+        suffix = timestamp if counter == 0 else f"{timestamp}_{counter}"
+        if len(name_parts) == 2:
+            new_filename = f"{name_parts[0]}_{suffix}.{name_parts[1]}"
+        else:
+            new_filename = f"{file_info['original_filename']}_{suffix}"
+        new_file_path = target_folder_path / new_filename
+        if not new_file_path.exists():
+            logger.info(f"📝 File exists, using new name: {new_filename}")
+            return new_file_path
+        counter += 1
+
 @app.route('/api/files/<file_id>/move', methods=['POST'])
 @login_required
 def move_file_to_folder(file_id):
@@ -898,12 +1138,7 @@ def move_file_to_folder(file_id):
             return jsonify({"error": "Folder ID is required"}), 400
             
         # Lấy thông tin file từ database
-        files = db.get_all_files()
-        file_info = None
-        for f in files:
-            if str(f["id"]) == str(file_id):
-                file_info = f
-                break
+        file_info = db.get_file_by_id(file_id)
                 
         if not file_info:
             logger.error(f"❌ File not found: {file_id}")
@@ -917,11 +1152,7 @@ def move_file_to_folder(file_id):
         # Lấy thông tin folder (nếu không phải di chuyển về root)
         folder = None
         if not move_to_root:
-            legacy_data = load_legacy_db()
-            for f in legacy_data["folders"]:
-                if f["id"] == folder_id:
-                    folder = f
-                    break
+            folder = db.get_folder(folder_id)
                     
             if not folder:
                 logger.error(f"❌ Folder not found: {folder_id}")
@@ -933,30 +1164,21 @@ def move_file_to_folder(file_id):
                 logger.error(f"❌ Folder permission denied: folder user_id={folder_user_id}, current user_id={user_id}")
                 return jsonify({"error": "Folder permission denied"}), 403
             
-        # Xác định đường dẫn file hiện tại
-        current_file_path = file_info.get("file_path")
-        logger.info(f"📁 Current file_path in DB: {current_file_path}")
+        target_folder_id = None if move_to_root else folder_id
+        target_name = "Root" if move_to_root else folder['name']
         
-        # Tìm file trên disk
-        possible_paths = []
-        if current_file_path:
-            possible_paths.append(UPLOAD_FOLDER / current_file_path)
-        
-        # Thêm các đường dẫn có thể khác
-        possible_paths.extend([
-            UPLOAD_FOLDER / username / file_info["original_filename"],
-            UPLOAD_FOLDER / file_info["original_filename"],
-            UPLOAD_FOLDER / username / "root" / file_info["original_filename"]
-        ])
-        
-        current_path = None
-        for path in possible_paths:
-            logger.info(f"🔍 Checking path: {path}")
-            if path.exists():
-                current_path = path
-                logger.info(f"✅ Found file at: {path}")
-                break
+        # File trong kho blob: folder chỉ là metadata, không di chuyển gì trên disk
+        if is_blob_path(file_info.get("file_path")):
+            if not db.update_file_folder(file_id, target_folder_id):
+                return jsonify({"error": "Failed to update database"}), 500
+            logger.info(f"✅ File {file_info['original_filename']} moved successfully to {target_name}")
+            return jsonify({
+                "success": True,
+                "message": f"File moved to {target_name} successfully"
+            })
         
+        # Tìm file trên disk
+        current_path, possible_paths = find_file_on_disk(file_info, username)
         if not current_path:
             logger.error(f"❌ File not found on disk. Searched paths: {[str(p) for p in possible_paths]}")
             return jsonify({"error": f"File not found on disk"}), 404
@@ -965,54 +1187,20 @@ def move_file_to_folder(file_id):
         if move_to_root:
             # Di chuyển về root - thư mục username
             target_folder_path = UPLOAD_FOLDER / username
-            new_file_path = target_folder_path / file_info["original_filename"]
-            new_relative_path = f"{username}/{file_info['original_filename']}"
-            target_name = "Root"
-            logger.info(f"📂 Moving to root: {target_folder_path}")
         else:
-            # Di chuyển vào folder
-            folder_path = folder.get("path")
-            if not folder_path or folder_path == "None" or folder_path.startswith("None/"):
-                # Folder cũ không có path đúng, tạo path mới
-                folder_path = f"{username}/{folder['name']}"
-            elif not folder_path.startswith(f"{username}/"):
-                # Path không có username prefix, thêm vào
-                folder_path = f"{username}/{folder['name']}"
-                
-            target_folder_path = UPLOAD_FOLDER / folder_path
-            new_file_path = target_folder_path / file_info["original_filename"]
-            new_relative_path = str(new_file_path.relative_to(UPLOAD_FOLDER))
-            target_name = folder['name']
-            logger.info(f"📂 Moving to folder: {target_folder_path}")
-            
-        logger.info(f"📄 New file path: {new_file_path}")
+            target_folder_path = UPLOAD_FOLDER / folder_disk_path(folder, username)
+        logger.info(f"📂 Moving to {target_name}: {target_folder_path}")
         
-        # Tạo thư mục đích
-        target_folder_path.mkdir(parents=True, exist_ok=True)
-        
-        # Kiểm tra file đích đã tồn tại chưa
-        if new_file_path.exists():
-            # Nếu file đích đã tồn tại và khác với file nguồn, tạo tên mới
-            if new_file_path.resolve() != current_path.resolve():
-                # Tạo tên file mới với timestamp để tránh trùng lặp
-                from datetime import datetime
-                timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-                name_parts = file_info["original_filename"].rsplit('.', 1)
-                if len(name_parts) == 2:
-                    new_filename = f"{name_parts[0]}_{timestamp}.{name_parts[1]}"
-                else:
-                    new_filename = f"{file_info['original_filename']}_{timestamp}"
-                
-                new_file_path = target_folder_path / new_filename
-                new_relative_path = str(new_file_path.relative_to(UPLOAD_FOLDER))
-                logger.info(f"📝 File exists, using new name: {new_filename}")
-            else:
-                # Nếu là cùng một file (chỉ là symbolic link hoặc hardlink), bỏ qua
-                logger.info(f"✅ Source and destination are the same file, operation completed")
-                return jsonify({
-                    "success": True,
-                    "message": f"File is already in {target_name}"
-                })
+        new_file_path = move_target_path(file_info, current_path, target_folder_path)
+        if new_file_path is None:
+            # Nếu là cùng một file (chỉ là symbolic link hoặc hardlink), bỏ qua
+            logger.info(f"✅ Source and destination are the same file, operation completed")
+            return jsonify({
+                "success": True,
+                "message": f"File is already in {target_name}"
+            })
+        new_relative_path = str(new_file_path.relative_to(UPLOAD_FOLDER))
+        logger.info(f"📄 New file path: {new_file_path}")
             
         # Di chuyển file
         shutil.move(str(current_path), str(new_file_path))
@@ -1029,7 +1217,6 @@ def move_file_to_folder(file_id):
             
         # Cập nhật folder_id trong database
         # Nếu di chuyển về root thì folder_id = null
-        target_folder_id = None if move_to_root else folder_id
         db.update_file_folder(file_id, target_folder_id)
         
         logger.info(f"✅ File {file_info['original_filename']} moved successfully to {target_name}")
@@ -1044,6 +1231,262 @@ def move_file_to_folder(file_id):
         logger.error(f"❌ Traceback: {traceback.format_exc()}")
         return jsonify({"error": str(e)}), 500
 
+# ============ BULK FILE OPERATIONS ============
+
+def bulk_ids_from_request():
+    """Đọc danh sách id từ body {"ids": [...]}; trả về (ids, None) hoặc (None, response lỗi)"""
+    data = request.get_json(silent=True) or {}
+    ids = data.get('ids')
+    if not isinstance(ids, list) or not ids:
+        return None, (jsonify({'error': 'ids must be a non-empty list'}), 400)
+    if len(ids) > BULK_MAX_ITEMS:
+        return None, (jsonify({'error': f'Too many ids (max {BULK_MAX_ITEMS})'}), 400)
+    try:
+        # Giữ thứ tự, bỏ id trùng
+        return list(dict.fromkeys(int(item_id) for item_id in ids)), None
+    except (TypeError, ValueError):
+        return None, (jsonify({'error': 'ids must be integers'}), 400)
+
+def bulk_response(results):
+    """Trả kết quả từng id kèm tổng số thành công/thất bại"""
+    succeeded = sum(1 for result in results if result['success'])
+    return jsonify({'results': results, 'succeeded': succeeded, 'failed': len(results) - succeeded})
+
+@app.route('/api/files/bulk/move', methods=['POST'])
+@login_required
+def bulk_move_files():
+    """Di chuyển nhiều file vào một folder (hoặc về root): {"ids": [...], "folder_id": ...}"""
+    try:
+        user = get_current_user()
+        username = user['username']
+        user_id = user['id']
+        
+        file_ids, error = bulk_ids_from_request()
+        if error:
+            return error
+        folder_id = (request.get_json(silent=True) or {}).get('folder_id')
+        move_to_root = folder_id is None or folder_id == ""
+        
+        # Kiểm tra folder đích một lần cho cả lô
+        if move_to_root:
+            target_folder_path = UPLOAD_FOLDER / username
+            target_folder_id = None
+        else:
+            folder = db.get_folder(folder_id)
+            if not folder:
+                return jsonify({"error": "Folder not found"}), 404
+            if folder.get("user_id") is not None and folder.get("user_id") != user_id:
+                return jsonify({"error": "Folder permission denied"}), 403
+            target_folder_path = UPLOAD_FOLDER / folder_disk_path(folder, username)
+            target_folder_id = folder_id
+        
+        # Kiểm tra quyền sở hữu của mọi file bằng một truy vấn
+        files = db.get_files_by_ids(file_ids)
+        results = {}
+        moved = []  # (file_id, đường dẫn cũ, đường dẫn mới)
+        relinked = []  # (file_id, file_path) của file trong kho blob
+        for file_id in file_ids:
+            file_info = files.get(file_id)
+            if not file_info:
+                results[file_id] = {'id': file_id, 'success': False, 'error': 'File not found'}
+                continue
+            if file_info['user_id'] != user_id:
+                results[file_id] = {'id': file_id, 'success': False, 'error': 'Permission denied'}
+                continue
+            
+            if is_blob_path(file_info.get('file_path')):
+                # Blob: chỉ đổi folder_id, file_path giữ nguyên
+                relinked.append((file_id, file_info['file_path']))
+                continue
+            
+            current_path, _ = find_file_on_disk(file_info, username)
+            if not current_path:
+                results[file_id] = {'id': file_id, 'success': False, 'error': 'File not found on disk'}
+                continue
+            
+            try:
+                new_file_path = move_target_path(file_info, current_path, target_folder_path)
+                if new_file_path is None:
+                    results[file_id] = {'id': file_id, 'success': True, 'message': 'File is already there'}
+                    continue
+                shutil.move(str(current_path), str(new_file_path))
+            except OSError as e:
+                results[file_id] = {'id': file_id, 'success': False, 'error': str(e)}
+                continue
+            moved.append((file_id, current_path, new_file_path))
+        
+        # Một transaction cho mọi file đã chuyển trên disk; lỗi thì chuyển file về chỗ cũ
+        try:
+            if moved or relinked:
+                db.update_files_location(
+                    [(file_id, str(new_path.relative_to(UPLOAD_FOLDER))) for file_id, _, new_path in moved] + relinked,
+                    target_folder_id
+                )
+            for file_id, _, new_path in moved:
+                results[file_id] = {'id': file_id, 'success': True,
+                                    'file_path': str(new_path.relative_to(UPLOAD_FOLDER)).replace('\\', '/')}
+            for file_id, _ in relinked:
+                results[file_id] = {'id': file_id, 'success': True, 'file_path': None}
+        except sqlite3.Error as e:
+            logger.error(f"❌ Bulk move database update failed, rolling back {len(moved)} files: {e}")
+            for file_id, old_path, new_path in moved:
+                try:
+                    shutil.move(str(new_path), str(old_path))
+                except OSError as move_error:
+                    logger.error(f"❌ Failed to move back {new_path}: {move_error}")
+                results[file_id] = {'id': file_id, 'success': False, 'error': 'Failed to update database'}
+            for file_id, _ in relinked:
+                results[file_id] = {'id': file_id, 'success': False, 'error': 'Failed to update database'}
+        
+        logger.info(f"🔄 Bulk move by {username}: {len(moved) + len(relinked)}/{len(file_ids)} files moved")
+        return bulk_response([results[file_id] for file_id in file_ids])
+    except Exception as e:
+        logger.error(f"❌ Error in bulk move: {e}")
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/api/files/bulk/delete', methods=['POST'])
+@login_required
+def bulk_delete_files():
+    """Chuyển nhiều file vào thùng rác: {"ids": [...]}"""
+    try:
+        current_user = get_current_user()
+        file_ids, error = bulk_ids_from_request()
+        if error:
+            return error
+        
+        # Kiểm tra quyền sở hữu bằng một truy vấn; user chỉ xóa file của mình, admin xóa được tất cả
+        files = db.get_files_by_ids(file_ids)
+        results = {}
+        allowed = []
+        for file_id in file_ids:
+            file_info = files.get(file_id)
+            if not file_info:
+                results[file_id] = {'id': file_id, 'success': False, 'error': 'File not found'}
+            elif current_user.get('role') != 'admin' and file_info.get('user_id') != current_user['id']:
+                results[file_id] = {'id': file_id, 'success': False, 'error': 'Permission denied'}
+            else:
+                allowed.append(file_id)
+        
+        outcome = db.move_files_to_recycle_bin(allowed, current_user['id'], days_to_keep=7) if allowed else {}
+        for file_id, success in outcome.items():
+            results[file_id] = {'id': file_id, 'success': success}
+            if not success:
+                results[file_id]['error'] = 'Failed to move file to recycle bin'
+        
+        return bulk_response([results[file_id] for file_id in file_ids])
+    except Exception as e:
+        logger.error(f"Error in bulk delete: {e}")
+        return jsonify({'error': str(e)}), 500
+
+# ============ ZIP ARCHIVES ============
+
+def upload_path(relative_path):
+    """Đường dẫn tuyệt đối của file trong UPLOAD_FOLDER; None nếu rỗng hoặc thoát ra ngoài (path traversal)"""
+    if not relative_path:
+        return None
+    path = (UPLOAD_FOLDER / relative_path).resolve()
+    if not path.is_relative_to(UPLOAD_FOLDER.resolve()):
+        logger.error(f"🚨 SECURITY: Path traversal attempt detected! Path: {path}")
+        return None
+    return path
+
+def arc_part(name):
+    """Tên file/folder -> một phần của tên entry trong ZIP (không chứa dấu phân cách hay '..')"""
+    name = re.sub(r'[\\/]+', '_', name or '').strip()
+    return name if name not in ('', '.', '..') else '_'
+
+def zip_response(entries, archive_name):
+    """Stream ZIP của entries (arcname, path) về client, không biết trước Content-Length"""
+    return Response(stream_zip(entries), mimetype='application/zip', headers={
+        'Content-Disposition': content_disposition('attachment', archive_name),
+        'Cache-Control': 'no-store',
+    })
+
+@app.route('/api/folders/<folder_id>/archive', methods=['GET'])
+@login_required
+def download_folder_archive(folder_id):
+    """Tải cả folder (gồm subfolder) dưới dạng ZIP stream"""
+    try:
+        user = get_current_user()
+        folder = db.get_folder(folder_id)
+        if not folder:
+            return jsonify({"error": "Folder not found"}), 404
+        if user.get('role') != 'admin' and folder['user_id'] != user['id']:
+            return jsonify({"error": "Permission denied"}), 403
+        
+        # Cây subfolder dựng từ một truy vấn folders của chủ folder
+        children = {}
+        for item in db.get_user_folders(folder['user_id']):
+            children.setdefault(item['parent_id'], []).append(item)
+        folder_paths = {folder['id']: arc_part(folder['name'])}
+        pending = [folder['id']]
+        while pending:
+            parent_id = pending.pop()
+            for child in children.get(parent_id, []):
+                if child['id'] not in folder_paths:
+                    folder_paths[child['id']] = f"{folder_paths[parent_id]}/{arc_part(child['name'])}"
+                    pending.append(child['id'])
+        
+        # Quyền được kiểm tra một lần: chỉ lấy file của chủ folder trong cây này
+        used = set()
+        entries = []
+        for file in db.get_completed_files_in_folders(list(folder_paths), folder['user_id']):
+            path = upload_path(file['file_path'])
+            if path is None:
+                continue
+            arcname = unique_arcname(f"{folder_paths[file['folder_id']]}/{arc_part(file['original_filename'])}", used)
+            entries.append((arcname, path))
+        
+        logger.info(f"📦 Folder archive {folder_id} for user {user['id']}: {len(entries)} files")
+        return zip_response(entries, f"{arc_part(folder['name'])}.zip")
+    except Exception as e:
+        logger.error(f"Error creating folder archive: {e}")
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/api/files/archive', methods=['GET', 'POST'])
+@login_required
+def download_files_archive():
+    """Tải nhiều file dưới dạng ZIP stream: GET ?ids=1,2,3 (link tải trực tiếp) hoặc POST {"ids": [...]}"""
+    try:
+        user = get_current_user()
+        if request.method == 'GET':
+            try:
+                file_ids = list(dict.fromkeys(int(item) for item in request.args.get('ids', '').split(',') if item.strip()))
+            except ValueError:
+                return jsonify({'error': 'ids must be integers'}), 400
+            if not file_ids:
+                return jsonify({'error': 'ids must be a non-empty list'}), 400
+            if len(file_ids) > BULK_MAX_ITEMS:
+                return jsonify({'error': f'Too many ids (max {BULK_MAX_ITEMS})'}), 400
+        else:
+            file_ids, error = bulk_ids_from_request()
+            if error:
+                return error
+        
+        # Kiểm tra quyền cho cả danh sách bằng một truy vấn, trước khi bắt đầu stream
+        files = db.get_files_by_ids(file_ids)
+        missing = [file_id for file_id in file_ids
+                   if file_id not in files or files[file_id]['status'] != 'completed']
+        if missing:
+            return jsonify({'error': 'File not found or not completed', 'ids': missing}), 404
+        if user.get('role') != 'admin':
+            denied = [file_id for file_id in file_ids if files[file_id]['user_id'] != user['id']]
+            if denied:
+                return jsonify({'error': 'Permission denied', 'ids': denied}), 403
+        
+        used = set()
+        entries = []
+        for file_id in file_ids:
+            path = upload_path(files[file_id]['file_path'])
+            if path is not None:
+                entries.append((unique_arcname(arc_part(files[file_id]['original_filename']), used), path))
+        
+        logger.info(f"📦 Files archive for user {user['id']}: {len(entries)} files")
+        return zip_response(entries, f"files-{datetime.now().strftime('%Y%m%d-%H%M%S')}.zip")
+    except Exception as e:
+        logger.error(f"Error creating files archive: {e}")
+        return jsonify({"error": str(e)}), 500
+
 # ============ ADMIN API ROUTES ============
 
 @app.route('/api/admin/stats', methods=['GET'])
@@ -1055,31 +1498,39 @@ def admin_get_stats():
         # Lấy tất cả users
         users = auth_db.get_all_users()
         
-        # Lấy tất cả files
-        all_files = db.get_all_files()
+        # Tổng hợp từ user_stats thay vì đọc mọi dòng files
+        file_stats = db.get_file_stats()
         
-        # Tính toán stats
-        total_users = len(users)
-        total_files = len(all_files)
-        total_size = sum(f.get('size', 0) or 0 for f in all_files if f.get('status') == 'completed')
-        
-        # Files upload hôm nay
-        from datetime import datetime, date
-        today = date.today().isoformat()
-        today_uploads = len([f for f in all_files if f.get('created_at', '').startswith(today)])
+        # Files upload hôm nay (created_at bắt đầu bằng ngày hôm nay)
+        from datetime import date
+        today_uploads = db.count_files_created_since(date.today().isoformat())
         
         return jsonify({
-            'total_users': total_users,
-            'total_files': total_files,
-            'total_size': total_size,
+            'total_users': len(users),
+            'total_files': file_stats['total_files'],
+            'total_size': file_stats['total_size'],
             'today_uploads': today_uploads,
             'active_users': len([u for u in users if u.get('last_login')]),
-            'completed_files': len([f for f in all_files if f.get('status') == 'completed'])
+            'completed_files': file_stats['completed_files']
         })
     except Exception as e:
         logger.error(f"Error getting admin stats: {e}")
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/admin/auth-cache', methods=['GET'])
+@login_required
+@admin_required
+def admin_get_auth_cache():
+    """API xem hit/miss của cache xác thực token"""
+    return jsonify(auth_db.token_cache.stats())
+
+@app.route('/api/admin/maintenance', methods=['GET'])
+@login_required
+@admin_required
+def admin_get_maintenance():
+    """API xem trạng thái các job bảo trì định kỳ"""
+    return jsonify({'running': maintenance.running, 'jobs': maintenance.status()})
+
 @app.route('/api/admin/users', methods=['GET'])
 @login_required
 @admin_required
@@ -1225,7 +1676,7 @@ def test_recycle_bin():
         logger.info("🧪 TEST RECYCLE BIN ENDPOINT CALLED")
         
         # Test database connection
-        with sqlite3.connect(db.db_path) as conn:
+        with db.pool.connect() as conn:
             cursor = conn.execute("SELECT COUNT(*) FROM recycle_bin")
             total_count = cursor.fetchone()[0]
             
@@ -1263,6 +1714,14 @@ def test_recycle_bin():
         logger.error(f"🧪 TEST ERROR: {e}")
         return jsonify({'error': str(e)}), 500
 
+def recycle_bin_page_args():
+    """Đọc limit/cursor phân trang thùng rác; (None, None) = lấy tất cả như client cũ"""
+    limit = request.args.get('limit', type=int)
+    cursor = request.args.get('cursor')
+    if limit is None and cursor is None:
+        return None, None
+    return max(1, min(limit or FILES_PAGE_SIZE, FILES_PAGE_MAX)), cursor
+
 @app.route('/api/recycle-bin', methods=['GET'])
 @login_required
 def get_recycle_bin():
@@ -1275,18 +1734,19 @@ def get_recycle_bin():
         
         logger.info(f"🗑️ GET RECYCLE BIN - User: {current_user['username']} (ID: {current_user['id']}) Role: {current_user.get('role', 'user')}")
         
+        limit, cursor = recycle_bin_page_args()
+        
         # Admin có thể xem tất cả files, user chỉ xem của mình
         if current_user.get('role') == 'admin':
-            files = db.get_recycle_bin_files()  # Admin xem tất cả
+            files, next_cursor = db.get_recycle_bin_files(limit=limit, cursor=cursor)  # Admin xem tất cả
             logger.info(f"🗑️ ADMIN - Found {len(files)} total files in recycle bin")
         else:
-            files = db.get_recycle_bin_files(current_user['id'])  # User xem của mình
+            files, next_cursor = db.get_recycle_bin_files(current_user['id'], limit=limit, cursor=cursor)  # User xem của mình
             logger.info(f"🗑️ USER - Found {len(files)} files in recycle bin for user {current_user['id']}")
         
-        for file in files:
-            logger.info(f"  - File: {file['original_filename']} (ID: {file['id']}) Owner: {file.get('user_id', 'Unknown')}")
-        
-        return jsonify({'files': files})
+        return jsonify({'files': files, 'next_cursor': next_cursor})
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         logger.error(f"Error getting recycle bin: {e}")
         return jsonify({'error': str(e)}), 500
@@ -1297,8 +1757,11 @@ def get_recycle_bin():
 def admin_get_recycle_bin():
     """API admin lấy tất cả file trong thùng rác"""
     try:
-        files = db.get_recycle_bin_files()  # Admin thấy tất cả
-        return jsonify({'files': files})
+        limit, cursor = recycle_bin_page_args()
+        files, next_cursor = db.get_recycle_bin_files(limit=limit, cursor=cursor)  # Admin thấy tất cả
+        return jsonify({'files': files, 'next_cursor': next_cursor})
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         logger.error(f"Error getting admin recycle bin: {e}")
         return jsonify({'error': str(e)}), 500
@@ -1350,6 +1813,13 @@ def delete_user_file(file_id):
         logger.error(f"Error moving user file to recycle bin: {e}")
         return jsonify({'error': str(e)}), 500
 
+def file_name_taken(user_id, file_id, new_name):
+    """User đã có file khác (không phải file_id) cùng tên, không phân biệt hoa thường"""
+    if db.file_name_exists(user_id, new_name, exclude_file_id=file_id):
+        logger.warning(f"🔧 Another file in database has same name: {new_name}")
+        return True
+    return False
+
 @app.route('/api/files/<int:file_id>/rename', methods=['PATCH'])
 @login_required
 def rename_file(file_id):
@@ -1380,12 +1850,8 @@ def rename_file(file_id):
         if current_user.get('role') != 'admin' and file_info.get('user_id') != current_user['id']:
             return jsonify({'error': 'Permission denied'}), 403
         
-        # Lấy đường dẫn file hiện tại
-        old_file_path = UPLOAD_FOLDER / file_info['file_path']
         old_name = file_info['original_filename']
-        
         logger.info(f"🔧 Rename file ID {file_id}: '{old_name}' -> '{new_name}'")
-        logger.info(f"🔧 Old file path: {old_file_path}")
         
         # Tạo tên file mới với extension cũ nếu có
         old_name_parts = old_name.rsplit('.', 1)
@@ -1398,6 +1864,24 @@ def rename_file(file_id):
                 new_name = f"{new_name}.{old_extension}"
                 logger.info(f"🔧 Auto-added extension: {new_name}")
         
+        # File trong kho blob: tên chỉ nằm trong metadata, không đổi gì trên disk
+        if is_blob_path(file_info.get('file_path')):
+            if new_name.lower() != old_name.lower() and file_name_taken(current_user['id'], file_id, new_name):
+                return jsonify({'error': 'A file with this name already exists'}), 409
+            if not db.update_file_name(file_id, new_name, file_info['file_path']):
+                return jsonify({'error': 'Failed to update database'}), 500
+            logger.info(f"🔧 Successfully renamed file ID {file_id} to '{new_name}'")
+            return jsonify({
+                'success': True,
+                'message': 'File renamed successfully',
+                'new_name': new_name,
+                'new_path': None
+            })
+        
+        # Lấy đường dẫn file hiện tại
+        old_file_path = UPLOAD_FOLDER / file_info['file_path']
+        logger.info(f"🔧 Old file path: {old_file_path}")
+        
         # Tạo đường dẫn file mới
         directory = old_file_path.parent
         new_file_path = directory / new_name
@@ -1423,12 +1907,8 @@ def rename_file(file_id):
                 return jsonify({'error': 'A file with this name already exists'}), 409
             
             # Kiểm tra trong database xem có file nào khác có tên giống (case-insensitive)
-            user_files = db.get_user_files(current_user['id'])
-            for user_file in user_files:
-                if (user_file['id'] != file_id and 
-                    user_file['original_filename'].lower() == new_name.lower()):
-                    logger.warning(f"🔧 Another file in database has same name: {user_file['original_filename']}")
-                    return jsonify({'error': 'A file with this name already exists'}), 409
+            if file_name_taken(current_user['id'], file_id, new_name):
+                return jsonify({'error': 'A file with this name already exists'}), 409
         
         # Đổi tên file vật lý
         if old_file_path.exists():
@@ -1472,12 +1952,8 @@ def permanently_delete_file(recycle_id):
         
         success, file_path = db.permanently_delete_from_recycle(recycle_id, user_id)
         if success:
-            # Xóa file vật lý
-            if file_path:
-                physical_path = UPLOAD_FOLDER / file_path
-                if physical_path.exists():
-                    physical_path.unlink()
-                    logger.info(f"Physical file deleted: {physical_path}")
+            # Xóa file vật lý (blob chỉ bị xóa khi không còn file nào trỏ tới)
+            blobs.remove_files([file_path])
             
             return jsonify({'success': True, 'message': 'File permanently deleted'})
         else:
@@ -1486,5 +1962,84 @@ def permanently_delete_file(recycle_id):
         logger.error(f"Error permanently deleting file: {e}")
         return jsonify({'error': str(e)}), 500
 
+def check_recycle_items(recycle_ids, current_user):
+    """Kiểm tra quyền trên các dòng thùng rác bằng một truy vấn; trả về (id được phép, kết quả lỗi)"""
+    items = db.get_recycle_items_by_ids(recycle_ids)
+    results = {}
+    allowed = []
+    for recycle_id in recycle_ids:
+        item = items.get(recycle_id)
+        if not item or item[1] != 'in_recycle':
+            results[recycle_id] = {'id': recycle_id, 'success': False, 'error': 'File not found in recycle bin'}
+        elif current_user.get('role') != 'admin' and item[0] != current_user['id']:
+            results[recycle_id] = {'id': recycle_id, 'success': False, 'error': 'Permission denied'}
+        else:
+            allowed.append(recycle_id)
+    return allowed, results
+
+@app.route('/api/recycle-bin/bulk/restore', methods=['POST'])
+@login_required
+def bulk_restore_files():
+    """Khôi phục nhiều file từ thùng rác: {"ids": [...]}"""
+    try:
+        current_user = get_current_user()
+        recycle_ids, error = bulk_ids_from_request()
+        if error:
+            return error
+        user_id = None if current_user.get('role') == 'admin' else current_user['id']
+        
+        allowed, results = check_recycle_items(recycle_ids, current_user)
+        outcome = db.restore_many_from_recycle_bin(allowed, user_id) if allowed else {}
+        for recycle_id, success in outcome.items():
+            results[recycle_id] = {'id': recycle_id, 'success': success}
+            if not success:
+                results[recycle_id]['error'] = 'Failed to restore file'
+        
+        return bulk_response([results[recycle_id] for recycle_id in recycle_ids])
+    except Exception as e:
+        logger.error(f"Error in bulk restore: {e}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/recycle-bin/bulk/delete', methods=['POST'])
+@login_required
+def bulk_permanently_delete_files():
+    """Xóa vĩnh viễn nhiều file từ thùng rác: {"ids": [...]}"""
+    try:
+        current_user = get_current_user()
+        recycle_ids, error = bulk_ids_from_request()
+        if error:
+            return error
+        user_id = None if current_user.get('role') == 'admin' else current_user['id']
+        
+        allowed, results = check_recycle_items(recycle_ids, current_user)
+        outcome = db.permanently_delete_many_from_recycle(allowed, user_id) if allowed else {}
+        
+        # Xóa file vật lý sau khi transaction đã commit
+        deleted_paths = []
+        for recycle_id, (success, file_path) in outcome.items():
+            results[recycle_id] = {'id': recycle_id, 'success': success}
+            if not success:
+                results[recycle_id]['error'] = 'Failed to delete file'
+                continue
+            deleted_paths.append(file_path)
+        blobs.remove_files(deleted_paths)
+        
+        return bulk_response([results[recycle_id] for recycle_id in recycle_ids])
+    except Exception as e:
+        logger.error(f"Error in bulk permanent delete: {e}")
+        return jsonify({'error': str(e)}), 500
+
+@app.cli.command('maintenance')
+def run_maintenance():
+    """Chạy các job bảo trì định kỳ ở foreground tới khi Ctrl+C
+
+    Dùng khi app chạy dưới gunicorn/WSGI server khác: chỉ process này chạy job,
+    các worker phục vụ request không tự khởi động scheduler.
+    """
+    maintenance.run_forever()
+
 if __name__ == '__main__':
+    # Debug reloader: process cha chỉ theo dõi code, job bảo trì chạy trong process con phục vụ request
+    if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        maintenance.start()
     app.run(debug=True, host='0.0.0.0', port=5000)
@@ -0,0 +1,201 @@
+import mimetypes
+import os
+import unicodedata
+import uuid
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Iterator, List, Optional, Tuple
+from urllib.parse import quote
+
+from flask import Response, request
+from werkzeug.http import http_date, quote_etag
+
+# Gửi file cho /api/files/<id>/download và /preview: Range (206, multi-range), ETag/If-None-Match,
+# Last-Modified/If-Modified-Since, If-Range
+FILE_SERVE_BLOCK_SIZE = int(os.environ.get("FILE_SERVE_BLOCK_SIZE", str(1024 * 1024)))  # byte mỗi lần đọc
+RANGE_MAX_PARTS = int(os.environ.get("RANGE_MAX_PARTS", "16"))  # nhiều hơn thì trả cả file (200)
+
+CACHE_CONTROL = "private, no-cache"  # file cần đăng nhập: browser giữ bản sao nhưng phải hỏi lại (304)
+
+
+def file_etag(stat: os.stat_result, content_hash: Optional[str] = None) -> str:
+    """ETag mạnh: từ hash nội dung đã lưu nếu có, nếu không thì từ size + mtime"""
+    if content_hash and ":" in content_hash:
+        algorithm, digest = content_hash.split(":", 1)
+        return f"{algorithm}-{digest}-{stat.st_size:x}"
+    return f"{stat.st_size:x}-{stat.st_mtime_ns:x}"
+
+
+def content_disposition(kind: str, filename: str) -> str:
+    """Header Content-Disposition, tên Unicode (vd. tiếng Việt) đi qua filename* (RFC 6266)"""
+    try:
+        filename.encode("ascii")
+        simple = filename
+    except UnicodeEncodeError:
+        simple = unicodedata.normalize("NFKD", filename).encode("ascii", "ignore").decode("ascii")
+    simple = simple.replace("\\", "\\\\").replace('"', '\\"')
+    if simple == filename:
+        return f'{kind}; filename="{simple}"'
+    return f"{kind}; filename=\"{simple}\"; filename*=UTF-8''{quote(filename, safe='')}"
+
+
+def _resolve_ranges(size: int) -> Optional[List[Tuple[int, int]]]:
+    """Header Range -> list [start, stop) đã gộp; None = bỏ qua Range (trả 200), [] = không thỏa (416)"""
+    header = request.range
+    if header is None or header.units != "bytes" or size == 0:
+        return None
+    ranges = []
+    for start, stop in header.ranges:
+        if start < 0:  # bytes=-N: N byte cuối
+            start, stop = max(size + start, 0), size
+        elif stop is None or stop > size:
+            stop = size
+        if start < stop:
+            ranges.append((start, stop))
+    # Gộp các đoạn chồng lấn/liền kề để không gửi trùng dữ liệu
+    merged: List[Tuple[int, int]] = []
+    for start, stop in sorted(ranges):
+        if merged and start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], stop))
+        else:
+            merged.append((start, stop))
+    if len(merged) > RANGE_MAX_PARTS:
+        return None
+    return merged
+
+
+def _range_applies(etag: str, last_modified: int) -> bool:
+    """If-Range: chỉ dùng Range khi bản client có vẫn là bản hiện tại"""
+    if_range = request.if_range
+    if if_range.etag is not None:
+        return if_range.etag == etag  # so sánh mạnh; ETag yếu (W/) không bao giờ khớp
+    if if_range.date is not None:
+        return int(if_range.date.timestamp()) == last_modified
+    return True
+
+
+def _not_modified(etag: str, last_modified: int) -> bool:
+    if request.if_none_match:
+        return request.if_none_match.contains_weak(etag)
+    if request.if_modified_since is not None:
+        return last_modified <= int(request.if_modified_since.timestamp())
+    return False
+
+
+def _read_range(path: Path, start: int, length: int) -> Iterator[bytes]:
+    with open(path, "rb") as f:
+        f.seek(start)
+        remaining = length
+        while remaining > 0:
+            data = f.read(min(FILE_SERVE_BLOCK_SIZE, remaining))
+            if not data:
+                break
+            remaining -= len(data)
+            yield data
+
+
+def _multipart_body(path: Path, ranges: List[Tuple[int, int]], size: int, mimetype: str,
+                    boundary: str) -> Tuple[Iterator[bytes], int]:
+    """Body multipart/byteranges và độ dài của nó (tính trước để có Content-Length)"""
+    heads = [
+        (f"\r\n--{boundary}\r\nContent-Type: {mimetype}\r\n"
+         f"Content-Range: bytes {start}-{stop - 1}/{size}\r\n\r\n").encode("ascii")
+        for start, stop in ranges
+    ]
+    tail = f"\r\n--{boundary}--\r\n".encode("ascii")
+    length = sum(len(head) for head in heads) + sum(stop - start for start, stop in ranges) + len(tail)
+
+    def generate() -> Iterator[bytes]:
+        for head, (start, stop) in zip(heads, ranges):
+            yield head
+            yield from _read_range(path, start, stop - start)
+        yield tail
+
+    return generate(), length
+
+
+class _FileSlice:
+    """File-like chỉ đọc được [start, start + length) của file, giữ fileno() cho sendfile
+
+    Server dùng os.sendfile (gunicorn) gửi từ vị trí hiện tại và dừng ở Content-Length;
+    server đọc bằng read() (wsgiref, ...) cũng không đọc quá đoạn được yêu cầu.
+    """
+
+    def __init__(self, path: Path, start: int, length: int) -> None:
+        self.file = open(path, "rb")
+        self.file.seek(start)
+        self.remaining = length
+
+    def read(self, size: int = -1) -> bytes:
+        if size is None or size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.file.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def fileno(self) -> int:
+        return self.file.fileno()
+
+    def close(self) -> None:
+        self.file.close()
+
+
+def _file_body(path: Path, start: int, length: int):
+    """Body cho cả file hoặc một đoạn: qua wsgi.file_wrapper nếu server có (zero-copy với
+    os.sendfile trên gunicorn), nếu không (werkzeug dev server) thì đọc theo khối"""
+    file_wrapper = request.environ.get("wsgi.file_wrapper")
+    if file_wrapper is None:
+        return _read_range(path, start, length), None
+    file_slice = _FileSlice(path, start, length)
+    return file_wrapper(file_slice, FILE_SERVE_BLOCK_SIZE), file_slice.close
+
+
+def serve_file(path: Path, download_name: str, as_attachment: bool = True,
+               mimetype: Optional[str] = None, content_hash: Optional[str] = None) -> Response:
+    """Response cho file trên đĩa, xử lý request có điều kiện và Range của request hiện tại"""
+    stat = path.stat()
+    size = stat.st_size
+    etag = file_etag(stat, content_hash)
+    last_modified = int(stat.st_mtime)
+    mimetype = mimetype or mimetypes.guess_type(download_name)[0] or "application/octet-stream"
+
+    headers = {
+        "ETag": quote_etag(etag),
+        "Last-Modified": http_date(datetime.fromtimestamp(last_modified, timezone.utc)),
+        "Cache-Control": CACHE_CONTROL,
+        "Accept-Ranges": "bytes",
+    }
+
+    if request.method in ("GET", "HEAD") and _not_modified(etag, last_modified):
+        return Response(status=304, headers=headers)
+
+    headers["Content-Disposition"] = content_disposition(
+        "attachment" if as_attachment else "inline", download_name
+    )
+    ranges = _resolve_ranges(size) if _range_applies(etag, last_modified) else None
+
+    on_close = None
+    if ranges is None:
+        status, content_type = 200, mimetype
+        body, on_close = _file_body(path, 0, size)
+        headers["Content-Length"] = str(size)
+    elif not ranges:
+        headers["Content-Range"] = f"bytes */{size}"
+        return Response(status=416, headers=headers)
+    elif len(ranges) == 1:
+        start, stop = ranges[0]
+        status, content_type = 206, mimetype
+        body, on_close = _file_body(path, start, stop - start)
+        headers["Content-Range"] = f"bytes {start}-{stop - 1}/{size}"
+        headers["Content-Length"] = str(stop - start)
+    else:
+        boundary = uuid.uuid4().hex
+        status, content_type = 206, f"multipart/byteranges; boundary={boundary}"
+        body, length = _multipart_body(path, ranges, size, mimetype, boundary)
+        headers["Content-Length"] = str(length)
+
+    response = Response(body, status=status, headers=headers, content_type=content_type,
+                        direct_passthrough=True)
+    if on_close is not None:
+        response.call_on_close(on_close)
+    return response
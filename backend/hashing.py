@@ -0,0 +1,54 @@
+import hashlib
+import zlib
+from typing import Optional, Tuple
+
+try:
+    import xxhash
+except ImportError:
+    xxhash = None
+
+# Header mang digest của file từ WebSocket server sang file manager: "<thuật toán>:<hex>"
+HASH_HEADER = "X-Content-Hash"
+# Relay streaming chưa biết digest khi mở request: chỉ báo thuật toán, file manager trả digest về
+HASH_ALGORITHM_HEADER = "X-Content-Hash-Algorithm"
+
+HASH_SHA256 = "sha256"
+HASH_CRC32 = "crc32"  # nhanh, không phải hash mật mã
+HASH_XXH64 = "xxh64"  # nhanh hơn nữa, cần package xxhash
+HASH_NONE = "none"
+
+
+class Crc32Hasher:
+    """CRC32 với giao diện giống hashlib (update/hexdigest)"""
+
+    def __init__(self) -> None:
+        self.value = 0
+
+    def update(self, data) -> None:
+        self.value = zlib.crc32(data, self.value)
+
+    def hexdigest(self) -> str:
+        return format(self.value & 0xFFFFFFFF, "08x")
+
+
+def new_hasher(algorithm: str):
+    """Tạo hasher theo tên thuật toán, None nếu tắt hoặc không hỗ trợ"""
+    if algorithm == HASH_SHA256:
+        return hashlib.sha256()
+    if algorithm == HASH_CRC32:
+        return Crc32Hasher()
+    if algorithm == HASH_XXH64 and xxhash is not None:
+        return xxhash.xxh64()
+    return None
+
+
+def format_hash(algorithm: str, digest: str) -> str:
+    return f"{algorithm}:{digest}"
+
+
+def parse_hash(value: Optional[str]) -> Optional[Tuple[str, str]]:
+    """Tách "<thuật toán>:<hex>" thành (thuật toán, hex); None nếu không hợp lệ"""
+    if not value or ":" not in value:
+        return None
+    algorithm, digest = value.split(":", 1)
+    return algorithm.strip().lower(), digest.strip().lower()
@@ -0,0 +1,49 @@
+import os
+from typing import Optional
+
+import aiohttp
+
+from logger import setup_logger
+
+logger = setup_logger("http_pool")
+
+# Connection pool dùng chung cho relay lên file manager và download
+HTTP_POOL_LIMIT = int(os.environ.get("HTTP_POOL_LIMIT", "100"))  # tổng số connection
+HTTP_POOL_LIMIT_PER_HOST = int(os.environ.get("HTTP_POOL_LIMIT_PER_HOST", "16"))
+HTTP_DNS_CACHE_TTL = int(os.environ.get("HTTP_DNS_CACHE_TTL", "300"))  # giây
+HTTP_KEEPALIVE_TIMEOUT = float(os.environ.get("HTTP_KEEPALIVE_TIMEOUT", "30"))  # giây giữ connection rảnh
+
+_session: Optional[aiohttp.ClientSession] = None
+
+
+async def open_http_session() -> aiohttp.ClientSession:
+    """Tạo ClientSession dùng chung cho cả process (gọi khi server khởi động)"""
+    global _session
+    if _session is None or _session.closed:
+        connector = aiohttp.TCPConnector(
+            limit=HTTP_POOL_LIMIT,
+            limit_per_host=HTTP_POOL_LIMIT_PER_HOST,
+            ttl_dns_cache=HTTP_DNS_CACHE_TTL,
+            keepalive_timeout=HTTP_KEEPALIVE_TIMEOUT,
+        )
+        # Không đặt timeout tổng ở đây: mỗi request tự truyền timeout phù hợp
+        _session = aiohttp.ClientSession(connector=connector, timeout=aiohttp.ClientTimeout(total=None))
+        logger.info("HTTP pool opened: limit=%d, per_host=%d, dns_ttl=%ds",
+                    HTTP_POOL_LIMIT, HTTP_POOL_LIMIT_PER_HOST, HTTP_DNS_CACHE_TTL)
+    return _session
+
+
+async def get_http_session() -> aiohttp.ClientSession:
+    """ClientSession dùng chung; tự tạo nếu server chưa gọi open_http_session()"""
+    if _session is None or _session.closed:
+        return await open_http_session()
+    return _session
+
+
+async def close_http_session() -> None:
+    """Đóng ClientSession dùng chung (gọi khi server tắt)"""
+    global _session
+    if _session is not None and not _session.closed:
+        await _session.close()
+        logger.info("HTTP pool closed")
+    _session = None
@@ -0,0 +1,255 @@
+import os
+import threading
+import time
+from datetime import timedelta
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+from database import get_vietnam_time
+from logger import setup_logger
+
+logger = setup_logger("maintenance")
+
+# Chu kỳ (giây) của từng job bảo trì; 0 = tắt job đó
+MAINT_STUCK_UPLOADS_INTERVAL = float(os.environ.get("MAINT_STUCK_UPLOADS_INTERVAL", "300"))
+MAINT_TEMP_SWEEP_INTERVAL = float(os.environ.get("MAINT_TEMP_SWEEP_INTERVAL", "3600"))
+MAINT_RECYCLE_INTERVAL = float(os.environ.get("MAINT_RECYCLE_INTERVAL", "3600"))
+MAINT_SESSIONS_INTERVAL = float(os.environ.get("MAINT_SESSIONS_INTERVAL", "3600"))
+MAINT_OPTIMIZE_INTERVAL = float(os.environ.get("MAINT_OPTIMIZE_INTERVAL", "86400"))
+MAINT_BLOB_GC_INTERVAL = float(os.environ.get("MAINT_BLOB_GC_INTERVAL", "3600"))
+MAINT_UPLOADS_INTERVAL = float(os.environ.get("MAINT_UPLOADS_INTERVAL", "3600"))
+
+# Ngưỡng của các job
+MAINT_STUCK_UPLOAD_MINUTES = float(os.environ.get("MAINT_STUCK_UPLOAD_MINUTES", "30"))  # upload không tiến triển
+MAINT_TEMP_MAX_AGE_HOURS = float(os.environ.get("MAINT_TEMP_MAX_AGE_HOURS", "24"))  # file tạm không ai dùng
+MAINT_BATCH_SIZE = int(os.environ.get("MAINT_BATCH_SIZE", "500"))  # số dòng mỗi transaction xóa
+MAINT_VACUUM_PAGES = int(os.environ.get("MAINT_VACUUM_PAGES", "0"))  # 0 = trả hết trang trống
+
+# Đuôi file tạm: .part/.ranges (upload qua WebSocket), .download (download; trạng thái segment chỉ nằm trong bộ nhớ)
+TEMP_SUFFIXES = (".part", ".ranges", ".download")
+
+
+class MaintenanceScheduler:
+    """Chạy các job bảo trì định kỳ trên một daemon thread
+
+    Mỗi job có chu kỳ riêng; job lỗi chỉ được log và chạy lại ở chu kỳ sau.
+    status() trả về lần chạy gần nhất, thời gian chạy và kết quả của từng job.
+    """
+
+    def __init__(self) -> None:
+        self.jobs: List[Dict] = []
+        self.stop_event = threading.Event()
+        self.thread: Optional[threading.Thread] = None
+        self.foreground = False  # đang chạy bằng run_forever()
+        self.lock = threading.Lock()
+
+    def add_job(self, name: str, interval: float, func: Callable[[], object]) -> None:
+        if interval <= 0:
+            logger.info("Maintenance job %s disabled", name)
+            return
+        self.jobs.append({
+            'name': name,
+            'interval': interval,
+            'func': func,
+            'next_run': time.monotonic() + min(interval, 60),  # lần đầu chạy sớm sau khi khởi động
+            'last_run': None,
+            'last_duration': None,
+            'last_result': None,
+            'last_error': None,
+        })
+
+    def start(self) -> None:
+        with self.lock:
+            if self.thread is not None and self.thread.is_alive():
+                return
+            self.stop_event.clear()
+            self.thread = threading.Thread(target=self._run, name="maintenance", daemon=True)
+            self.thread.start()
+        logger.info("Maintenance scheduler started: %s",
+                    ", ".join(f"{job['name']}={job['interval']:g}s" for job in self.jobs))
+
+    def run_forever(self) -> None:
+        """Chạy các job trên thread hiện tại tới khi stop() hoặc Ctrl+C (process bảo trì riêng)"""
+        self.stop_event.clear()
+        self.foreground = True
+        logger.info("Maintenance scheduler running in foreground: %s",
+                    ", ".join(f"{job['name']}={job['interval']:g}s" for job in self.jobs))
+        try:
+            self._run()
+        except KeyboardInterrupt:
+            logger.info("Maintenance scheduler interrupted")
+        finally:
+            self.foreground = False
+
+    @property
+    def running(self) -> bool:
+        """Scheduler có đang chạy trong process này không (thread nền hoặc run_forever)"""
+        return self.foreground or (self.thread is not None and self.thread.is_alive())
+
+    def stop(self, timeout: float = 5.0) -> None:
+        self.stop_event.set()
+        with self.lock:
+            thread, self.thread = self.thread, None
+        if thread is not None:
+            thread.join(timeout)
+
+    def run_job(self, job: Dict) -> None:
+        started = time.monotonic()
+        try:
+            job['last_result'] = job['func']()
+            job['last_error'] = None
+        except Exception as e:
+            job['last_error'] = str(e)
+            logger.error("Maintenance job %s failed: %s", job['name'], e)
+        job['last_duration'] = round(time.monotonic() - started, 3)
+        job['last_run'] = time.time()
+        job['next_run'] = time.monotonic() + job['interval']
+
+    def _run(self) -> None:
+        while not self.stop_event.is_set():
+            if not self.jobs:
+                return
+            now = time.monotonic()
+            for job in self.jobs:
+                if job['next_run'] <= now and not self.stop_event.is_set():
+                    self.run_job(job)
+            wait = min(job['next_run'] for job in self.jobs) - time.monotonic()
+            self.stop_event.wait(max(wait, 0.5))
+
+    def status(self) -> List[Dict]:
+        return [{key: value for key, value in job.items() if key not in ('func', 'next_run')}
+                for job in self.jobs]
+
+
+def _temp_stem(name: str) -> str:
+    """Tên file tạm -> tên gốc (temp_path trong DB) bằng cách bỏ các đuôi tạm"""
+    for suffix in TEMP_SUFFIXES:
+        if name.endswith(suffix):
+            return name[:-len(suffix)]
+    return name
+
+
+def cleanup_stuck_uploads(db, temp_folder: Path) -> int:
+    """Xóa theo lô các dòng 'uploading' quá hạn mà file .part cũng không được ghi thêm từ đó"""
+    max_age = timedelta(minutes=MAINT_STUCK_UPLOAD_MINUTES)
+    cutoff_ts = time.time() - max_age.total_seconds()
+    cutoff = get_vietnam_time() - max_age
+    deleted = 0
+    while True:
+        stale = db.get_stale_uploads(cutoff, MAINT_BATCH_SIZE)
+        stuck_ids = []
+        for file_id, temp_path in stale:
+            part = temp_folder / f"{temp_path}.part" if temp_path else None
+            try:
+                if part is not None and part.stat().st_mtime >= cutoff_ts:
+                    continue  # vẫn đang nhận dữ liệu
+            except OSError:
+                pass
+            stuck_ids.append(file_id)
+        deleted += db.delete_files(stuck_ids)
+        # Lô toàn upload còn sống: các dòng cũ hơn vẫn ở đầu danh sách, dừng để không lặp vô hạn
+        if len(stale) < MAINT_BATCH_SIZE or not stuck_ids:
+            break
+    if deleted:
+        logger.info("🧹 Removed %d stuck uploads", deleted)
+    return deleted
+
+
+def sweep_temp_files(db, temp_folder: Path) -> int:
+    """Xóa file tạm không được sửa trong MAINT_TEMP_MAX_AGE_HOURS và không thuộc upload dở dang nào"""
+    cutoff_ts = time.time() - MAINT_TEMP_MAX_AGE_HOURS * 3600
+    pending = db.get_pending_temp_paths()
+    removed = 0
+    try:
+        entries = list(os.scandir(temp_folder))
+    except FileNotFoundError:
+        return 0
+    for entry in entries:
+        try:
+            if not entry.is_file() or entry.stat().st_mtime >= cutoff_ts:
+                continue
+            if _temp_stem(entry.name) in pending:
+                continue  # upload đang tạm dừng, còn resume được
+            os.remove(entry.path)
+            removed += 1
+        except OSError as e:
+            logger.warning("Failed to remove temp file %s: %s", entry.path, e)
+    if removed:
+        logger.info("🧹 Removed %d orphaned temp files", removed)
+    return removed
+
+
+def purge_expired_recycle_bin(db, blobs) -> int:
+    """Đánh dấu file quá hạn trong thùng rác theo lô và dọn file vật lý sau khi commit"""
+    purged = 0
+    while True:
+        expired = db.cleanup_expired_recycle_files(MAINT_BATCH_SIZE)
+        blobs.remove_files(file_path for _, file_path in expired)
+        purged += len(expired)
+        if len(expired) < MAINT_BATCH_SIZE:
+            break
+    if purged:
+        logger.info("🗑️ Purged %d expired recycle bin files", purged)
+    return purged
+
+
+def collect_blobs(blobs) -> Dict[str, int]:
+    """Xóa blob không còn tham chiếu và file tạm bị bỏ lại trong kho"""
+    result = {
+        'blobs': blobs.collect(MAINT_BATCH_SIZE),
+        'temp_files': blobs.sweep_temp(MAINT_TEMP_MAX_AGE_HOURS * 3600),
+    }
+    if result['temp_files']:
+        logger.info("🧹 Removed %d orphaned blob temp files", result['temp_files'])
+    return result
+
+
+def expire_resumable_uploads(db, resumable) -> int:
+    """Xóa phiên upload resumable không được cập nhật trong MAINT_TEMP_MAX_AGE_HOURS (kể cả dữ liệu đã nhận)"""
+    cutoff = get_vietnam_time() - timedelta(hours=MAINT_TEMP_MAX_AGE_HOURS)
+    expired = 0
+    while True:
+        uploads = db.get_expired_uploads(cutoff, MAINT_BATCH_SIZE)
+        for upload_id, _ in uploads:
+            resumable.abort(upload_id)
+        expired += len(uploads)
+        if len(uploads) < MAINT_BATCH_SIZE:
+            break
+    if expired:
+        logger.info("🧹 Removed %d expired resumable uploads", expired)
+    return expired
+
+
+def cleanup_sessions(auth_db) -> int:
+    deleted = auth_db.cleanup_expired_sessions(MAINT_BATCH_SIZE)
+    if deleted:
+        logger.info("Removed %d expired sessions", deleted)
+    return deleted
+
+
+def optimize_databases(*pools) -> Dict[str, dict]:
+    results = {}
+    for pool in pools:
+        results[os.path.basename(pool.db_path)] = pool.optimize(MAINT_VACUUM_PAGES)
+    logger.info("Databases optimized: %s", results)
+    return results
+
+
+def build_scheduler(db, auth_db, blobs, resumable, temp_folder: Path) -> MaintenanceScheduler:
+    """Scheduler với đủ các job bảo trì của file manager"""
+    scheduler = MaintenanceScheduler()
+    scheduler.add_job("stuck_uploads", MAINT_STUCK_UPLOADS_INTERVAL,
+                      lambda: cleanup_stuck_uploads(db, temp_folder))
+    scheduler.add_job("temp_sweep", MAINT_TEMP_SWEEP_INTERVAL,
+                      lambda: sweep_temp_files(db, temp_folder))
+    scheduler.add_job("recycle_bin", MAINT_RECYCLE_INTERVAL,
+                      lambda: purge_expired_recycle_bin(db, blobs))
+    scheduler.add_job("blob_gc", MAINT_BLOB_GC_INTERVAL,
+                      lambda: collect_blobs(blobs))
+    scheduler.add_job("resumable_uploads", MAINT_UPLOADS_INTERVAL,
+                      lambda: expire_resumable_uploads(db, resumable))
+    scheduler.add_job("sessions", MAINT_SESSIONS_INTERVAL,
+                      lambda: cleanup_sessions(auth_db))
+    scheduler.add_job("optimize", MAINT_OPTIMIZE_INTERVAL,
+                      lambda: optimize_databases(db.pool, auth_db.pool))
+    return scheduler
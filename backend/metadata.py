@@ -0,0 +1,138 @@
+import asyncio
+import os
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List, Optional, Tuple
+
+from logger import setup_logger
+
+logger = setup_logger("metadata")
+
+# Số thao tác ghi tối đa gộp vào một transaction của writer thread
+METADATA_WRITE_BATCH = int(os.environ.get("METADATA_WRITE_BATCH", "64"))
+# Số thread đọc metadata (lookup token, ...) chạy ngoài event loop
+METADATA_READ_WORKERS = int(os.environ.get("METADATA_READ_WORKERS", "4"))
+
+_STOP = object()
+
+
+class AsyncMetadataStore:
+    """Facade async cho FileDatabase/AuthDatabase dùng trong WebSocket server
+
+    Ghi: được đưa vào hàng đợi, một writer thread riêng lấy ra theo lô và chạy cả lô trong
+    một transaction (một lần fsync) trên connection của pool; thứ tự ghi được giữ nguyên.
+    Đọc: chạy trên ThreadPoolExecutor. Mọi method trả về asyncio.Future, caller chỉ await
+    khi cần kết quả (vd. row id của add_file); lỗi của thao tác không ai await chỉ được log.
+    """
+
+    def __init__(self, db, auth_db=None) -> None:
+        self.db = db
+        self.auth_db = auth_db
+        self.queue: "queue.Queue" = queue.Queue()
+        self.writer: Optional[threading.Thread] = None
+        self.executor: Optional[ThreadPoolExecutor] = None
+        self.lock = threading.Lock()
+
+    def start(self) -> None:
+        with self.lock:
+            if self.writer is None or not self.writer.is_alive():
+                self.writer = threading.Thread(target=self._run_writer, name="metadata-writer", daemon=True)
+                self.writer.start()
+            if self.executor is None:
+                self.executor = ThreadPoolExecutor(max_workers=max(1, METADATA_READ_WORKERS),
+                                                   thread_name_prefix="metadata-read")
+
+    async def stop(self) -> None:
+        """Ghi nốt hàng đợi rồi dừng writer thread và executor (gọi khi server tắt)"""
+        with self.lock:
+            writer, self.writer = self.writer, None
+            executor, self.executor = self.executor, None
+        if writer is not None:
+            self.queue.put(_STOP)
+            await asyncio.to_thread(writer.join)
+        if executor is not None:
+            executor.shutdown(wait=False)
+
+    def _submit_write(self, func: Callable, *args, **kwargs) -> asyncio.Future:
+        self.start()
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        # Tránh cảnh báo "exception never retrieved" với thao tác fire-and-forget
+        future.add_done_callback(lambda f: f.cancelled() or f.exception())
+        self.queue.put((func, args, kwargs, loop, future))
+        return future
+
+    def _submit_read(self, func: Callable, *args) -> asyncio.Future:
+        self.start()
+        return asyncio.get_running_loop().run_in_executor(self.executor, func, *args)
+
+    # ----- Ghi (qua writer thread) -----
+
+    def add_file(self, **kwargs) -> asyncio.Future:
+        return self._submit_write(self.db.add_file, **kwargs)
+
+    def update_file_status(self, file_id, status, file_path=None) -> asyncio.Future:
+        return self._submit_write(self.db.update_file_status, file_id, status, file_path)
+
+    def delete_file(self, file_id) -> asyncio.Future:
+        return self._submit_write(self.db.delete_file, file_id)
+
+    # ----- Đọc (qua executor) -----
+
+    def get_file_by_id(self, file_id) -> asyncio.Future:
+        return self._submit_read(self.db.get_file_by_id, file_id)
+
+    def get_user_by_token(self, token) -> asyncio.Future:
+        return self._submit_read(self.auth_db.get_user_by_token, token)
+
+    # ----- Writer thread -----
+
+    def _run_writer(self) -> None:
+        while True:
+            batch: List[Tuple] = [self.queue.get()]
+            while len(batch) < METADATA_WRITE_BATCH:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            stop = any(item is _STOP for item in batch)
+            batch = [item for item in batch if item is not _STOP]
+            if batch:
+                self._write_batch(batch)
+            if stop:
+                return
+
+    def _write_batch(self, batch: List[Tuple]) -> None:
+        results = []
+        try:
+            # Các method của FileDatabase lồng trong connect() này dùng chung connection,
+            # nên cả lô commit một lần khi thoát khối with
+            with self.db.pool.connect():
+                for func, args, kwargs, loop, future in batch:
+                    try:
+                        results.append((loop, future, True, func(*args, **kwargs)))
+                    except Exception as e:
+                        logger.error("Metadata write %s failed: %s", func.__name__, e)
+                        results.append((loop, future, False, e))
+        except Exception as e:
+            # Commit lỗi: cả lô coi như thất bại
+            logger.error("Metadata batch commit failed (%d writes): %s", len(batch), e)
+            results = [(loop, future, False, e) for _, _, _, loop, future in batch]
+
+        if len(batch) > 1:
+            logger.debug("Metadata batch committed: %d writes", len(batch))
+        for loop, future, ok, value in results:
+            try:
+                loop.call_soon_threadsafe(_set_future, future, ok, value)
+            except RuntimeError:
+                pass  # event loop đã đóng
+
+
+def _set_future(future: asyncio.Future, ok: bool, value) -> None:
+    if future.done():
+        return
+    if ok:
+        future.set_result(value)
+    else:
+        future.set_exception(value)
@@ -0,0 +1,36 @@
+import struct
+from typing import Tuple
+
+# Binary chunk frame: header cố định + fileId (utf-8) + dữ liệu thô
+#   uint16 fileId length | uint64 offset | uint32 data length
+CHUNK_HEADER = struct.Struct("!HQI")
+
+# Giá trị chunkMode được thương lượng trong start / start-ack
+CHUNK_MODE_BASE64 = "base64"
+CHUNK_MODE_BINARY = "binary"
+
+
+def encode_chunk_frame(file_id: str, offset: int, data: bytes) -> bytes:
+    """Đóng gói một chunk thành binary frame để gửi qua WebSocket"""
+    file_id_bytes = file_id.encode("utf-8")
+    header = CHUNK_HEADER.pack(len(file_id_bytes), offset, len(data))
+    return b"".join((header, file_id_bytes, data))
+
+
+def decode_chunk_frame(frame: bytes) -> Tuple[str, int, memoryview]:
+    """Tách binary frame thành (file_id, offset, data)
+
+    Raises:
+        ValueError: frame không đúng định dạng
+    """
+    if len(frame) < CHUNK_HEADER.size:
+        raise ValueError("Frame too short")
+
+    id_length, offset, data_length = CHUNK_HEADER.unpack_from(frame, 0)
+    data_start = CHUNK_HEADER.size + id_length
+    if id_length == 0 or len(frame) != data_start + data_length:
+        raise ValueError("Frame length mismatch")
+
+    view = memoryview(frame)
+    file_id = bytes(view[CHUNK_HEADER.size:data_start]).decode("utf-8")
+    return file_id, offset, view[data_start:]
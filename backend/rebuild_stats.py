@@ -0,0 +1,21 @@
+#!/usr/bin/env python3
+"""
+Script tính lại bảng user_stats, index tìm kiếm files_fts và refcount của blobs từ dữ liệu hiện có (bảng files + folders + recycle_bin trong files.db)
+Chạy khi thống kê bị lệch, vd. sau khi sửa database bằng tay
+"""
+
+from database import db
+
+
+def rebuild_stats():
+    db.rebuild_user_stats()
+    stats = db.get_file_stats()
+    print(f"✅ User stats rebuilt: {stats['total_files']} files, {stats['total_size']} bytes completed")
+    db.rebuild_search_index()
+    print("✅ Search index rebuilt")
+    db.rebuild_blob_refcounts()
+    print("✅ Blob refcounts rebuilt")
+
+
+if __name__ == "__main__":
+    rebuild_stats()
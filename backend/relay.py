@@ -0,0 +1,240 @@
+import asyncio
+import os
+import random
+from pathlib import Path
+from typing import Optional
+
+import aiofiles
+import aiohttp
+
+from http_pool import get_http_session
+from logger import setup_logger
+from resumable_upload import UPLOAD_OFFSET_HEADER
+
+logger = setup_logger("relay")
+
+RELAY_BLOCK_SIZE = 1024 * 1024  # đọc phần .part có sẵn theo khối 1MB
+
+# Relay resumable (ResumableUpload): kích thước mỗi PATCH và chính sách thử lại
+RELAY_PATCH_SIZE = int(os.environ.get("UPLOAD_RELAY_PATCH_SIZE", str(16 * 1024 * 1024)))
+RELAY_MAX_RETRIES = int(os.environ.get("UPLOAD_RELAY_RETRIES", "6"))  # số lần thử lại liên tiếp không tiến triển
+RELAY_BACKOFF_BASE = float(os.environ.get("UPLOAD_RELAY_BACKOFF_BASE", "0.5"))  # giây, nhân đôi mỗi lần
+RELAY_BACKOFF_MAX = float(os.environ.get("UPLOAD_RELAY_BACKOFF_MAX", "30"))
+RELAY_REQUEST_TIMEOUT = aiohttp.ClientTimeout(total=None, sock_connect=10,
+                                              sock_read=float(os.environ.get("UPLOAD_RELAY_TIMEOUT", "60")))
+
+
+class StreamingRelay:
+    """Chuyển tiếp file lên file manager trong lúc chunk còn đang đến (chế độ sequential)
+
+    Một POST duy nhất với Content-Length = file_size; body được lấy từ:
+      1. phần đã có trong file .part khi relay bắt đầu (resume sau restart/relay lỗi)
+      2. các chunk liên tục do UploadManager đẩy vào qua feed()
+    Hàng đợi có giới hạn nên file manager chậm sẽ làm chậm ack về client (backpressure).
+    Khi relay lỗi, finish() trả về None để caller upload lại từ file tạm như cũ.
+    """
+
+    def __init__(self, url: str, headers: dict, part_path: Path, disk_bytes: int, file_size: int,
+                 queue_chunks: int, idle_timeout: float) -> None:
+        self.url = url
+        self.headers = dict(headers, **{"Content-Length": str(file_size)})
+        self.part_path = part_path
+        self.disk_bytes = disk_bytes
+        self.file_size = file_size
+        self.idle_timeout = idle_timeout
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=max(1, queue_chunks))
+        self.sent = 0
+        self.failed = False
+        self.task: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        self.task = asyncio.create_task(self._run())
+        # Lỗi được xử lý qua finish(); tránh cảnh báo "exception never retrieved"
+        self.task.add_done_callback(lambda t: t.cancelled() or t.exception())
+
+    async def feed(self, data) -> None:
+        """Đẩy chunk liên tục tiếp theo vào relay (chờ nếu hàng đợi đầy)"""
+        if self.failed:
+            return
+        await self.queue.put(bytes(data))
+
+    async def finish(self, timeout: Optional[float] = None) -> Optional[dict]:
+        """Chờ file manager trả lời; None nếu relay lỗi"""
+        if self.task is None or self.failed:
+            return None
+        try:
+            return await asyncio.wait_for(asyncio.shield(self.task), timeout=timeout)
+        except Exception as e:
+            logger.warning("Streaming relay failed for %s: %s", self.headers.get('X-File-ID'), e)
+            return None
+
+    def cancel(self) -> None:
+        self._fail()
+        if self.task is not None:
+            self.task.cancel()
+
+    def _fail(self) -> None:
+        self.failed = True
+        # Giải phóng feed() đang chờ hàng đợi đầy
+        while not self.queue.empty():
+            self.queue.get_nowait()
+
+    async def _body(self):
+        while self.sent < self.disk_bytes:
+            async with aiofiles.open(self.part_path, 'rb') as f:
+                await f.seek(self.sent)
+                block = await f.read(min(RELAY_BLOCK_SIZE, self.disk_bytes - self.sent))
+            if not block:
+                raise IOError(f"Partial file shorter than expected: {self.part_path}")
+            self.sent += len(block)
+            yield block
+
+        while self.sent < self.file_size:
+            # Client pause/mất kết nối quá lâu -> bỏ relay, complete sẽ upload lại từ file tạm
+            data = await asyncio.wait_for(self.queue.get(), timeout=self.idle_timeout)
+            self.sent += len(data)
+            yield data
+
+    async def _run(self) -> dict:
+        try:
+            http_session = await get_http_session()
+            async with http_session.post(self.url, data=self._body(), headers=self.headers,
+                                         timeout=aiohttp.ClientTimeout(total=None)) as response:
+                if response.status != 200:
+                    error_text = await response.text()
+                    raise RuntimeError(f"HTTP {response.status}: {error_text}")
+                return await response.json()
+        except BaseException:
+            self._fail()
+            raise
+
+
+class RemoteUploadError(Exception):
+    """File manager từ chối upload (4xx không thử lại được: sai token, hash không khớp, ...)"""
+
+
+class _TransientError(Exception):
+    """Lỗi HTTP thử lại được (5xx, 408, 429, 409 offset mismatch)"""
+
+
+class _UploadGone(Exception):
+    """Phiên upload không còn trên file manager (hết hạn, DB bị xóa): tạo phiên mới"""
+
+
+class ResumableUpload:
+    """Gửi file tạm lên file manager qua giao thức resumable (/api/uploads)
+
+    POST tạo phiên (hoặc dùng lại upload_id cũ), PATCH từng đoạn RELAY_PATCH_SIZE byte kèm
+    Upload-Offset, rồi finalize. Lỗi tạm thời (mất kết nối, timeout, 5xx, file manager restart)
+    được thử lại sau backoff lũy thừa, hỏi offset đã ghi nhận (HEAD) và gửi tiếp từ đó thay vì
+    gửi lại từ byte 0. Số lần thử được tính lại mỗi khi offset tiến thêm.
+    """
+
+    def __init__(self, url: str, headers: dict, file_path: Path, file_size: int,
+                 upload_id: Optional[str] = None) -> None:
+        self.url = url.rstrip("/")
+        self.create_headers = headers
+        # PATCH/HEAD/finalize chỉ cần xác thực
+        self.auth_headers = {key: value for key, value in headers.items() if key == "Authorization"}
+        self.file_path = file_path
+        self.file_size = file_size
+        self.upload_id = upload_id
+        self.offset = 0
+
+    async def run(self) -> dict:
+        """Gửi hết file và finalize; trả về JSON của file manager (giống /api/upload)
+
+        Raises:
+            RemoteUploadError: file manager từ chối
+            aiohttp.ClientError, asyncio.TimeoutError: hết RELAY_MAX_RETRIES lần thử
+        """
+        http_session = await get_http_session()
+        attempt = 0
+        progress_mark = -1
+        while True:
+            try:
+                if self.upload_id is None:
+                    await self._create(http_session)
+                else:
+                    await self._head(http_session)
+                while self.offset < self.file_size:
+                    await self._patch(http_session)
+                return await self._finalize(http_session)
+            except _UploadGone:
+                if self.upload_id is None:
+                    raise RemoteUploadError(f"Resumable upload endpoint not found: {self.url}")
+                logger.warning("Remote upload %s not found, starting a new one", self.upload_id)
+                self.upload_id = None
+                self.offset = 0
+                progress_mark = -1
+            except (aiohttp.ClientError, asyncio.TimeoutError, _TransientError) as e:
+                if self.offset > progress_mark:
+                    attempt = 0  # có tiến triển từ lần lỗi trước
+                    progress_mark = self.offset
+                attempt += 1
+                if attempt > RELAY_MAX_RETRIES:
+                    raise
+                delay = min(RELAY_BACKOFF_MAX, RELAY_BACKOFF_BASE * (2 ** (attempt - 1)))
+                delay *= random.uniform(0.5, 1.0)  # jitter: nhiều relay không thử lại cùng lúc
+                logger.warning("Remote upload %s failed at offset %d (%s), retry %d/%d in %.1fs",
+                               self.upload_id, self.offset, e or type(e).__name__, attempt,
+                               RELAY_MAX_RETRIES, delay)
+                await asyncio.sleep(delay)
+
+    async def _check(self, response: aiohttp.ClientResponse) -> None:
+        if response.status < 400:
+            return
+        error_text = await response.text()
+        if response.status == 404:
+            raise _UploadGone()
+        if response.status == 409:
+            raise _TransientError("HTTP 409: offset mismatch")
+        if response.status in (408, 429) or response.status >= 500:
+            raise _TransientError(f"HTTP {response.status}: {error_text}")
+        raise RemoteUploadError(f"HTTP {response.status}: {error_text}")
+
+    def _set_offset(self, response: aiohttp.ClientResponse) -> None:
+        self.offset = int(response.headers.get(UPLOAD_OFFSET_HEADER, self.offset))
+
+    async def _create(self, http_session: aiohttp.ClientSession) -> None:
+        async with http_session.post(self.url, headers=self.create_headers, timeout=RELAY_REQUEST_TIMEOUT) as response:
+            await self._check(response)
+            self.upload_id = (await response.json())["upload_id"]
+            self._set_offset(response)
+        logger.info("Remote upload created: %s, offset=%d", self.upload_id, self.offset)
+
+    async def _head(self, http_session: aiohttp.ClientSession) -> None:
+        async with http_session.head(f"{self.url}/{self.upload_id}", headers=self.auth_headers,
+                                     timeout=RELAY_REQUEST_TIMEOUT) as response:
+            await self._check(response)
+            self._set_offset(response)
+        logger.info("Remote upload %s resuming from offset %d", self.upload_id, self.offset)
+
+    async def _read_segment(self, start: int, length: int):
+        async with aiofiles.open(self.file_path, 'rb') as f:
+            await f.seek(start)
+            remaining = length
+            while remaining > 0:
+                block = await f.read(min(RELAY_BLOCK_SIZE, remaining))
+                if not block:
+                    raise IOError(f"Temp file shorter than expected: {self.file_path}")
+                remaining -= len(block)
+                yield block
+
+    async def _patch(self, http_session: aiohttp.ClientSession) -> None:
+        length = min(RELAY_PATCH_SIZE, self.file_size - self.offset)
+        headers = dict(self.auth_headers, **{
+            "Content-Type": "application/offset+octet-stream",
+            "Content-Length": str(length),
+            UPLOAD_OFFSET_HEADER: str(self.offset),
+        })
+        async with http_session.patch(f"{self.url}/{self.upload_id}", data=self._read_segment(self.offset, length),
+                                      headers=headers, timeout=RELAY_REQUEST_TIMEOUT) as response:
+            await self._check(response)
+            self._set_offset(response)
+
+    async def _finalize(self, http_session: aiohttp.ClientSession) -> dict:
+        async with http_session.post(f"{self.url}/{self.upload_id}/finalize", headers=self.auth_headers,
+                                     timeout=RELAY_REQUEST_TIMEOUT) as response:
+            await self._check(response)
+            return await response.json()
@@ -0,0 +1,212 @@
+import os
+import time
+import uuid
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+from blob_store import BLOB_DIR_NAME, BlobWriter
+from hashing import HASH_NONE, HASH_SHA256, format_hash, new_hasher
+from logger import setup_logger
+
+logger = setup_logger("resumable_upload")
+
+# Upload resumable qua HTTP: POST /api/uploads tạo phiên, PATCH gửi tiếp từ offset, HEAD hỏi offset,
+# POST /api/uploads/<id>/finalize đưa file vào kho blob
+UPLOAD_OFFSET_HEADER = "Upload-Offset"  # offset bắt đầu của PATCH / offset đã ghi nhận trong response
+UPLOAD_LENGTH_HEADER = "Upload-Length"  # kích thước file của phiên
+UPLOAD_READ_SIZE = 1024 * 1024  # byte mỗi lần đọc body PATCH / đọc lại phần đã ghi
+UPLOAD_LEASE_SECONDS = float(os.environ.get("UPLOAD_LEASE_SECONDS", "60"))  # PATCH/finalize giữ phiên, gia hạn khi đang ghi
+
+
+class OffsetMismatch(Exception):
+    """PATCH không bắt đầu ở offset đã ghi nhận; client hỏi lại offset (HEAD) rồi gửi tiếp"""
+
+    def __init__(self, offset: int) -> None:
+        super().__init__(f"Upload offset is {offset}")
+        self.offset = offset
+
+
+class UploadBusy(OffsetMismatch):
+    """Phiên đang được một request khác (có thể ở worker khác) ghi hoặc finalize"""
+
+    def __init__(self, offset: int) -> None:
+        super().__init__(offset)
+        self.args = (f"Upload is busy at offset {offset}",)
+
+
+class ResumableUploads:
+    """Dữ liệu các phiên upload resumable nằm trong remote_uploads/.blobs/uploads/<id>
+
+    Cùng filesystem với kho blob nên finalize chỉ đổi tên file, không ghi lại dữ liệu. Offset được
+    ghi nhận trong bảng uploads sau khi dữ liệu đã flush; phần thừa sau offset (request bị ngắt
+    trước khi ghi nhận) được cắt bỏ ở lần ghi tiếp theo. Mỗi PATCH/finalize giữ lease của phiên
+    trong DB (claim) nên chỉ một request ghi vào file tại một thời điểm, kể cả giữa nhiều worker
+    process. Hash lũy tiến giữ trong bộ nhớ theo phiên, ở process khác hoặc sau khi restart thì
+    đọc lại phần đã ghi một lần.
+    """
+
+    def __init__(self, db, blobs) -> None:
+        self.db = db
+        self.blobs = blobs
+        self.data_dir = blobs.upload_folder / BLOB_DIR_NAME / "uploads"
+        self.data_dir.mkdir(parents=True, exist_ok=True)
+        self.hashers: Dict[str, Tuple[int, object, Optional[object]]] = {}  # id -> (offset, sha256, hasher khác)
+
+    def data_path(self, upload_id: str) -> Path:
+        return self.data_dir / upload_id
+
+    def claim(self, upload_id: str) -> Optional[str]:
+        """Lấy lease của phiên active; trả về lease token, None nếu phiên không active hoặc đang bị giữ"""
+        lease = uuid.uuid4().hex
+        return lease if self.db.claim_upload(upload_id, lease, UPLOAD_LEASE_SECONDS) else None
+
+    def release(self, upload_id: str, lease: str) -> None:
+        self.db.release_upload(upload_id, lease)
+
+    def create(self, user: dict, file_name: str, file_size: int, folder_id: Optional[str] = None,
+               client_file_id: Optional[str] = None, hash_algorithm: Optional[str] = None,
+               expected_hash: Optional[str] = None) -> Tuple[dict, bool]:
+        """Tạo phiên mới, hoặc trả phiên đang dở của cùng file phía client (client_file_id); (upload, đã tạo mới)"""
+        if client_file_id:
+            upload = self.db.find_active_upload(user['id'], client_file_id, file_name, file_size)
+            if upload is not None:
+                return upload, False
+        if hash_algorithm == HASH_NONE:
+            hash_algorithm = None
+        upload_id = uuid.uuid4().hex
+        self.data_path(upload_id).touch()
+        try:
+            self.db.create_upload(upload_id, user['id'], file_name, file_size, folder_id, client_file_id,
+                                  hash_algorithm, expected_hash)
+        except Exception:
+            self.data_path(upload_id).unlink(missing_ok=True)
+            raise
+        return self.db.get_upload(upload_id), True
+
+    def _hashers(self, upload: dict, offset: int):
+        """(sha256, hasher của hash_algorithm nếu khác sha256) khớp với offset byte đầu của file"""
+        cached = self.hashers.get(upload['id'])
+        if cached is not None and cached[0] == offset:
+            return cached[1], cached[2]
+        sha256 = new_hasher(HASH_SHA256)
+        algorithm = upload.get('hash_algorithm')
+        extra = new_hasher(algorithm) if algorithm and algorithm != HASH_SHA256 else None
+        if algorithm and algorithm != HASH_SHA256 and extra is None:
+            logger.warning("Unsupported content hash algorithm, skipping verification: %s", algorithm)
+        if offset:
+            with open(self.data_path(upload['id']), "rb") as f:
+                remaining = offset
+                while remaining > 0:
+                    block = f.read(min(UPLOAD_READ_SIZE, remaining))
+                    if not block:
+                        raise IOError(f"Upload data shorter than committed offset: {upload['id']}")
+                    sha256.update(block)
+                    if extra is not None:
+                        extra.update(block)
+                    remaining -= len(block)
+            logger.info("Upload hash restored from disk: %s, %d bytes", upload['id'], offset)
+        return sha256, extra
+
+    def append(self, upload: dict, offset: int, stream) -> int:
+        """Ghi body từ offset (phải bằng offset đã ghi nhận); trả về offset mới đã ghi nhận
+
+        Body bị ngắt giữa chừng vẫn giữ phần đã nhận: offset mới được ghi nhận rồi lỗi được ném lại.
+        Raises:
+            OffsetMismatch: offset khác offset đã ghi nhận hoặc phiên không còn active
+            UploadBusy: request khác đang giữ phiên, hoặc lease bị mất giữa chừng
+            FileNotFoundError: phiên đã bị hủy
+        """
+        upload_id = upload['id']
+        lease = self.claim(upload_id)
+        try:
+            upload = self.db.get_upload(upload_id)
+            if upload is None:
+                raise FileNotFoundError(f"Upload not found: {upload_id}")
+            committed = upload['upload_offset']
+            if lease is None and upload['status'] == 'active':
+                raise UploadBusy(committed)
+            if lease is None or offset != committed:
+                raise OffsetMismatch(committed)
+            return self._append_leased(upload, lease, stream)
+        finally:
+            if lease is not None:
+                self.release(upload_id, lease)
+
+    def _append_leased(self, upload: dict, lease: str, stream) -> int:
+        """append() khi đã giữ lease; lease được gia hạn trong lúc nhận body dài"""
+        upload_id = upload['id']
+        committed = upload['upload_offset']
+        path = self.data_path(upload_id)
+        with open(path, "r+b" if path.exists() else "wb") as f:
+            f.truncate(committed)  # bỏ dữ liệu chưa được ghi nhận của request bị ngắt trước đó
+        sha256, extra = self._hashers(upload, committed)
+        writer = BlobWriter(path, sha256, committed)
+        renewed = time.monotonic()
+        error = None
+        try:
+            remaining = upload['file_size'] - committed
+            while remaining > 0:
+                data = stream.read(min(UPLOAD_READ_SIZE, remaining))
+                if not data:
+                    break
+                # Client chậm làm lease sắp hết: gia hạn trước khi ghi, mất lease thì không ghi thêm byte nào
+                if time.monotonic() - renewed > UPLOAD_LEASE_SECONDS / 3:
+                    if not self.db.renew_upload_lease(upload_id, lease, UPLOAD_LEASE_SECONDS):
+                        raise UploadBusy(committed)
+                    renewed = time.monotonic()
+                writer.write(data)
+                writer.file.flush()  # không để lại dữ liệu trong buffer tới lúc lease có thể đã hết
+                if extra is not None:
+                    extra.update(data)
+                remaining -= len(data)
+            os.fsync(writer.file.fileno())
+        except Exception as e:
+            error = e
+        finally:
+            writer.close()
+
+        new_offset = committed
+        if writer.size > committed and path.stat().st_size >= writer.size:
+            if self.db.advance_upload_offset(upload_id, lease, committed, writer.size):
+                new_offset = writer.size
+                self.hashers[upload_id] = (new_offset, sha256, extra)
+        if new_offset == committed:
+            self.hashers.pop(upload_id, None)
+        if error is not None:
+            logger.warning("Upload %s interrupted at offset %d: %s", upload_id, new_offset, error)
+            raise error
+        return new_offset
+
+    def finalize(self, upload: dict) -> Tuple[BlobWriter, Optional[str]]:
+        """Writer của file đã nhận đủ để đưa vào kho blob, và content_hash "<thuật toán>:<hex>"
+
+        Raises:
+            ValueError: chưa nhận đủ file_size byte hoặc hash không khớp expected_hash
+        """
+        upload_id = upload['id']
+        offset = upload['upload_offset']
+        if offset != upload['file_size']:
+            raise ValueError(f"Upload incomplete: {offset}/{upload['file_size']} bytes")
+        sha256, extra = self._hashers(upload, offset)
+        algorithm = upload.get('hash_algorithm')
+        if algorithm == HASH_SHA256:
+            content_hash = format_hash(HASH_SHA256, sha256.hexdigest())
+        elif extra is not None:
+            content_hash = format_hash(algorithm, extra.hexdigest())
+        else:
+            content_hash = None
+        expected_hash = upload.get('expected_hash')
+        if expected_hash and content_hash and content_hash != expected_hash:
+            raise ValueError(f"Content hash mismatch: expected {expected_hash}, got {content_hash}")
+        return BlobWriter(self.data_path(upload_id), sha256, offset), content_hash
+
+    def forget(self, upload_id: str) -> None:
+        """Bỏ trạng thái trong bộ nhớ của phiên đã xong"""
+        self.hashers.pop(upload_id, None)
+
+    def abort(self, upload_id: str) -> None:
+        """Xóa phiên và dữ liệu đã nhận (request đang ghi dở sẽ không ghi nhận được offset)"""
+        self.data_path(upload_id).unlink(missing_ok=True)
+        self.db.delete_upload(upload_id)
+        self.forget(upload_id)
+        logger.info("Resumable upload aborted: %s", upload_id)
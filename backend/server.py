@@ -5,7 +5,7 @@ import os
 import time
 from dataclasses import dataclass, field
 from pathlib import Path
-from typing import Dict, Optional
+from typing import Dict, List, Optional, Set
 from urllib.parse import urlparse, parse_qs
 import aiohttp
 import aiofiles
@@ -14,6 +14,13 @@ import websockets
 from websockets.server import WebSocketServerProtocol
 from logger import setup_logger
 from database import db
+from metadata import AsyncMetadataStore
+from protocol import CHUNK_MODE_BASE64, CHUNK_MODE_BINARY, decode_chunk_frame
+from relay import RemoteUploadError, ResumableUpload, StreamingRelay
+from http_pool import open_http_session, get_http_session, close_http_session
+from events import EventAggregator
+from hashing import (HASH_ALGORITHM_HEADER, HASH_HEADER, HASH_NONE, HASH_SHA256,
+                     format_hash, new_hasher)
 
 # Import auth database để verify tokens
 try:
@@ -23,12 +30,92 @@ except ImportError:
     auth_db = None
     print("Warning: AuthDatabase not available")
 
+# Ghi metadata qua writer thread, đọc qua executor: SQLite không chặn event loop
+metadata = AsyncMetadataStore(db, auth_db)
+
 # Thiết lập logger cho server
 logger = setup_logger("server")
 
 # Cấu hình remote server
 REMOTE_UPLOAD_URL = os.environ.get("REMOTE_UPLOAD_URL", "http://localhost:5000/api/upload")
 REMOTE_SERVER_TOKEN = os.environ.get("REMOTE_SERVER_TOKEN", "your-secret-token")
+# Giao thức resumable của file manager (create/PATCH/HEAD/finalize), vd. http://localhost:5000/api/uploads;
+# rỗng (mặc định) = một POST lên REMOTE_UPLOAD_URL như cũ
+REMOTE_RESUMABLE_URL = os.environ.get("REMOTE_RESUMABLE_URL", "")
+
+# Hash nội dung tính dần trong lúc ghi chunk (sha256 | crc32 | xxh64 | none), gửi cho file manager kiểm tra
+UPLOAD_HASH_ALGORITHM = os.environ.get("UPLOAD_HASH_ALGORITHM", HASH_SHA256).lower()
+
+# Relay lên file manager: buffered (gửi cả file sau khi complete) | streaming (gửi dần trong lúc nhận chunk)
+RELAY_MODE_BUFFERED = "buffered"
+RELAY_MODE_STREAMING = "streaming"
+RELAY_MODE = os.environ.get("UPLOAD_RELAY_MODE", RELAY_MODE_BUFFERED)
+RELAY_QUEUE_CHUNKS = int(os.environ.get("UPLOAD_RELAY_QUEUE_CHUNKS", "32"))
+RELAY_IDLE_TIMEOUT = int(os.environ.get("UPLOAD_RELAY_IDLE_TIMEOUT", "600"))
+
+# Sliding window: giới hạn số chunk / số byte client được gửi mà chưa nhận ack
+MAX_WINDOW_CHUNKS = int(os.environ.get("UPLOAD_MAX_WINDOW_CHUNKS", "16"))
+MAX_WINDOW_BYTES = int(os.environ.get("UPLOAD_MAX_WINDOW_BYTES", str(8 * 1024 * 1024)))
+
+# Thời gian tối đa gửi một event broadcast tới một client (client chậm không chặn client khác)
+BROADCAST_SEND_TIMEOUT = float(os.environ.get("UPLOAD_BROADCAST_TIMEOUT", "5"))
+
+# Gộp chunk-ack: client đề nghị "eventTick" (ms) trong start, server giới hạn trong khoảng này.
+# Không đề nghị = gửi từng ack ngay như cũ
+EVENT_TICK_MIN_MS = int(os.environ.get("UPLOAD_EVENT_TICK_MIN_MS", "20"))
+EVENT_TICK_MAX_MS = int(os.environ.get("UPLOAD_EVENT_TICK_MAX_MS", "500"))
+
+# Ghi .part: gom các chunk liên tiếp trong bộ đệm rồi mới ghi xuống đĩa,
+# handle được đóng khi pause/stop/disconnect hoặc không hoạt động quá lâu
+WRITE_BUFFER_SIZE = int(os.environ.get("UPLOAD_WRITE_BUFFER", str(1024 * 1024)))
+IDLE_HANDLE_TIMEOUT = int(os.environ.get("UPLOAD_IDLE_HANDLE_TIMEOUT", "60"))
+
+# Download nhiều connection: chia file thành các segment tải song song bằng Range (server trả 206)
+DOWNLOAD_SEGMENTS = int(os.environ.get("DOWNLOAD_SEGMENTS", "4"))
+DOWNLOAD_MIN_SEGMENT_SIZE = int(os.environ.get("DOWNLOAD_MIN_SEGMENT_SIZE", str(1024 * 1024)))
+DOWNLOAD_SEGMENT_RETRIES = 3
+
+# Chế độ upload: sequential (một luồng theo offset) | ranges (nhiều luồng, ghi theo vị trí)
+UPLOAD_MODE_SEQUENTIAL = "sequential"
+UPLOAD_MODE_RANGES = "ranges"
+# Trạng thái mà "start" được phép đưa session về active; completing/uploading/completed giữ nguyên
+UPLOAD_STARTABLE_STATUSES = ("active", "paused", "pending", "error")
+RANGES_PERSIST_INTERVAL = 1.0  # giây tối thiểu giữa 2 lần lưu file .ranges
+
+
+def add_range(ranges: List[List[int]], start: int, end: int) -> int:
+    """Gộp [start, end) vào danh sách ranges (đã sắp xếp, không chồng lấn).
+    Trả về số byte mới được thêm."""
+    merged = []
+    added = end - start
+    i = 0
+    while i < len(ranges) and ranges[i][1] < start:
+        merged.append(ranges[i])
+        i += 1
+    while i < len(ranges) and ranges[i][0] <= end:
+        overlap = min(end, ranges[i][1]) - max(start, ranges[i][0])
+        if overlap > 0:
+            added -= overlap
+        start = min(start, ranges[i][0])
+        end = max(end, ranges[i][1])
+        i += 1
+    merged.append([start, end])
+    merged.extend(ranges[i:])
+    ranges[:] = merged
+    return added
+
+
+def missing_ranges(ranges: List[List[int]], size: int) -> List[List[int]]:
+    """Các khoảng [start, end) còn thiếu trong [0, size)"""
+    missing = []
+    cursor = 0
+    for start, end in ranges:
+        if start > cursor:
+            missing.append([cursor, start])
+        cursor = max(cursor, end)
+    if cursor < size:
+        missing.append([cursor, size])
+    return missing
 
 # Thư mục tạm để lưu file trước khi gửi đi
 TEMP_DIR = Path(__file__).parent / "temp_uploads"
@@ -43,7 +130,7 @@ class UploadSession:
     file_id: str
     file_name: str
     file_size: int
-    status: str = "active"  # active | paused | completed | stopped | error | uploading
+    status: str = "active"  # active | paused | completing | uploading | completed | stopped | error
     bytes_received: int = 0
     temp_file_path: Path = field(default_factory=Path)
     remote_file_id: Optional[str] = None
@@ -51,11 +138,172 @@ class UploadSession:
     db_id: Optional[int] = None  # ID từ SQLite database
     user_id: Optional[int] = None  # ID của user upload
     user_token: Optional[str] = None  # Auth token của user
+    chunk_mode: str = CHUNK_MODE_BASE64  # base64 (JSON) | binary (binary frame)
+    window_chunks: int = 1  # số chunk tối đa đang bay (đã thương lượng)
+    window_bytes: int = MAX_WINDOW_BYTES
+    mismatch_reported: Optional[int] = None  # offset đã báo offset-mismatch, tránh báo lặp
+    relay: Optional[StreamingRelay] = None  # relay streaming lên file manager (UPLOAD_RELAY_MODE=streaming)
+    remote_upload_id: Optional[str] = None  # phiên resumable trên file manager, dùng lại khi complete được gửi lại
+    hasher: Optional[object] = None  # hash lũy tiến của phần .part liên tục (chế độ sequential)
+    hashed_bytes: int = 0
+    part_file: Optional[object] = None  # handle aiofiles của file .part, mở trong suốt phiên active
+    write_buffer: bytearray = field(default_factory=bytearray)
+    buffer_offset: int = 0  # offset trong file của byte đầu tiên trong write_buffer
+    last_activity: float = field(default_factory=time.time)
+    mode: str = UPLOAD_MODE_SEQUENTIAL
+    received_ranges: List[List[int]] = field(default_factory=list)  # chỉ dùng ở chế độ ranges
+    ranges_saved_at: float = 0.0
 
     def temp_path(self) -> Path:
     # session.temp_file_path: .../temp_uploads/<file-id>_<name>
         return self.temp_file_path.with_name(self.temp_file_path.name + ".part")
 
+    def ranges_path(self) -> Path:
+        """File lưu các khoảng đã nhận (chế độ ranges) để resume sau khi restart"""
+        return self.temp_file_path.with_name(self.temp_file_path.name + ".ranges")
+
+    def load_progress(self) -> None:
+        """Khôi phục tiến độ từ đĩa: file .ranges (chế độ ranges) hoặc kích thước .part"""
+        ranges_path = self.ranges_path()
+        if ranges_path.exists():
+            try:
+                saved = json.loads(ranges_path.read_text(encoding="utf-8"))
+            except (OSError, ValueError) as e:
+                logger.warning("Corrupted ranges file %s, restarting upload: %s", ranges_path, e)
+                saved = []
+            self.mode = UPLOAD_MODE_RANGES
+            self.received_ranges = []
+            for start, end in saved:
+                add_range(self.received_ranges, max(0, int(start)), min(int(end), self.file_size))
+            self.bytes_received = sum(end - start for start, end in self.received_ranges)
+        elif self.temp_path().exists():
+            self.bytes_received = self.temp_path().stat().st_size
+
+    def enable_range_mode(self) -> None:
+        """Chuyển session sang chế độ ranges, phần đã nhận tuần tự thành range đầu tiên.
+        Gọi khi handle .part đã đóng."""
+        if self.mode == UPLOAD_MODE_RANGES:
+            return
+        self.mode = UPLOAD_MODE_RANGES
+        self.received_ranges = [[0, self.bytes_received]] if self.bytes_received else []
+        # Chunk đến không theo thứ tự -> không hash lũy tiến được
+        self.hasher = None
+
+    def ack_offset(self) -> int:
+        """Offset liên tục cao nhất đã nhận (dùng cho ack lũy tiến)"""
+        if self.mode == UPLOAD_MODE_RANGES:
+            if self.received_ranges and self.received_ranges[0][0] == 0:
+                return self.received_ranges[0][1]
+            return 0
+        return self.bytes_received
+
+    def missing_ranges(self) -> List[List[int]]:
+        if self.mode == UPLOAD_MODE_RANGES:
+            return missing_ranges(self.received_ranges, self.file_size)
+        return [[self.bytes_received, self.file_size]] if self.bytes_received < self.file_size else []
+
+    async def restore_hash(self) -> None:
+        """Đưa hash lũy tiến về khớp bytes_received (gọi khi handle .part đã đóng).
+        Pause/resume giữ nguyên hasher trong bộ nhớ; chỉ sau khi restart mới phải đọc lại
+        phần .part đã có một lần."""
+        if self.mode != UPLOAD_MODE_SEQUENTIAL or UPLOAD_HASH_ALGORITHM == HASH_NONE:
+            self.hasher = None
+            return
+        if self.hasher is not None and self.hashed_bytes == self.bytes_received:
+            return
+
+        hasher = new_hasher(UPLOAD_HASH_ALGORITHM)
+        if hasher is None:
+            logger.warning("Unsupported UPLOAD_HASH_ALGORITHM: %s", UPLOAD_HASH_ALGORITHM)
+            self.hasher = None
+            return
+        if self.bytes_received:
+            await asyncio.to_thread(self._hash_file_prefix, hasher, self.bytes_received)
+            logger.info("Content hash restored from partial file: %s, %d bytes", self.file_id, self.bytes_received)
+        self.hasher = hasher
+        self.hashed_bytes = self.bytes_received
+
+    def _hash_file_prefix(self, hasher, length: int) -> None:
+        with open(self.temp_path(), 'rb') as f:
+            remaining = length
+            while remaining > 0:
+                block = f.read(min(1024 * 1024, remaining))
+                if not block:
+                    raise IOError(f"Partial file shorter than expected: {self.temp_path()}")
+                hasher.update(block)
+                remaining -= len(block)
+
+    def content_hash(self) -> Optional[str]:
+        """Digest "<thuật toán>:<hex>" khi đã hash đủ file, None nếu không có"""
+        if self.hasher is None or self.hashed_bytes != self.file_size:
+            return None
+        return format_hash(UPLOAD_HASH_ALGORITHM, self.hasher.hexdigest())
+
+    async def open_writer(self) -> None:
+        temp_path = self.temp_path()
+        temp_path.parent.mkdir(parents=True, exist_ok=True)
+        if self.mode != UPLOAD_MODE_RANGES:
+            self.part_file = await aiofiles.open(temp_path, 'ab')
+            return
+
+        # Chế độ ranges: cấp phát trước file_size rồi ghi theo vị trí
+        if not temp_path.exists():
+            temp_path.touch()
+        self.part_file = await aiofiles.open(temp_path, 'r+b')
+        if temp_path.stat().st_size != self.file_size:
+            await self.part_file.truncate(self.file_size)
+        if not self.ranges_path().exists():
+            # Ghi .ranges ngay khi cấp phát để lần resume sau không hiểu nhầm .part là đã đủ
+            await self.save_ranges()
+
+    async def save_ranges(self) -> None:
+        """Lưu các khoảng đã ghi xuống đĩa (chỉ gọi sau khi flush)"""
+        async with aiofiles.open(self.ranges_path(), 'w', encoding='utf-8') as f:
+            await f.write(json.dumps(self.received_ranges))
+        self.ranges_saved_at = time.time()
+
+    async def write(self, offset: int, data) -> None:
+        """Ghi chunk vào bộ đệm, chỉ ghi xuống .part khi đệm đủ WRITE_BUFFER_SIZE
+        hoặc chunk mới không nối tiếp phần đang đệm. Gọi trong file_lock."""
+        if self.part_file is None:
+            await self.open_writer()
+        if self.write_buffer and offset != self.buffer_offset + len(self.write_buffer):
+            await self.flush()
+        if not self.write_buffer:
+            self.buffer_offset = offset
+        self.write_buffer += data
+        if self.hasher is not None and offset == self.hashed_bytes:
+            self.hasher.update(data)
+            self.hashed_bytes += len(data)
+        self.last_activity = time.time()
+        if len(self.write_buffer) >= WRITE_BUFFER_SIZE:
+            await self.flush()
+
+    async def flush(self, save_ranges: bool = False) -> None:
+        """Ghi phần còn trong bộ đệm xuống file .part"""
+        if self.part_file is None:
+            return
+        if self.write_buffer:
+            buffer, self.write_buffer = self.write_buffer, bytearray()
+            if self.mode == UPLOAD_MODE_RANGES:
+                await self.part_file.seek(self.buffer_offset)
+            await self.part_file.write(buffer)
+        # received_ranges chỉ được lưu khi mọi byte trong đó đã nằm trên đĩa
+        if self.mode == UPLOAD_MODE_RANGES and (
+                save_ranges or time.time() - self.ranges_saved_at >= RANGES_PERSIST_INTERVAL):
+            await self.part_file.flush()
+            await self.save_ranges()
+
+    async def close_writer(self) -> None:
+        """Flush và đóng handle .part (pause, stop, disconnect, idle, complete)"""
+        if self.part_file is None:
+            return
+        try:
+            await self.flush(save_ranges=True)
+        finally:
+            part_file, self.part_file = self.part_file, None
+            await part_file.close()
+
 @dataclass
 class DownloadSession:
     session_id: str
@@ -66,6 +314,8 @@ class DownloadSession:
     status: str = "pending"  # pending | active | paused | completed | error | stopped
     temp_file_path: Optional[str] = None
     last_update: float = field(default_factory=time.time)
+    max_segments: int = DOWNLOAD_SEGMENTS
+    segments: List[List[int]] = field(default_factory=list)  # [start, pos, end): pos = byte tiếp theo cần tải
     
     def temp_path(self) -> str:
         if not self.temp_file_path:
@@ -73,6 +323,9 @@ class DownloadSession:
             self.temp_file_path = str(TEMP_DIR / f"{self.session_id}_{safe_filename}.download")
         return self.temp_file_path
 
+    def segmented_bytes(self) -> int:
+        return sum(pos - start for start, pos, end in self.segments)
+
 
 class DownloadManager:
     def __init__(self):
@@ -164,86 +417,70 @@ class DownloadManager:
             
             timeout = aiohttp.ClientTimeout(total=300, connect=30)
             headers = {}
+
+            # Server hỗ trợ Range -> tải song song nhiều segment (lần đầu hoặc resume chế độ segment)
+            if not session.segments and session.downloaded_bytes == 0 and session.max_segments > 1:
+                await self._plan_segments(session, timeout)
+            if session.segments:
+                await self.send(websocket, {
+                    'event': 'download-info',
+                    'fileId': session.session_id,
+                    'totalSize': session.total_size,
+                    'supportsResume': True,
+                    'segments': sum(1 for start, pos, end in session.segments if pos < end)
+                })
+                await self._download_segmented(session, websocket, timeout)
+                await self._finish_download(session, websocket)
+                return
             
             # Resume support
             if session.downloaded_bytes > 0:
                 headers['Range'] = f'bytes={session.downloaded_bytes}-'
             
-            async with aiohttp.ClientSession(timeout=timeout) as client_session:
-                async with client_session.get(session.url, headers=headers) as response:
-                    
-                    # Get total size
-                    if session.total_size == 0:
-                        content_length = response.headers.get('Content-Length')
-                        if content_length:
-                            if 'Range' in headers:
-                                session.total_size = session.downloaded_bytes + int(content_length)
-                            else:
-                                session.total_size = int(content_length)
+            client_session = await get_http_session()
+            async with client_session.get(session.url, headers=headers, timeout=timeout) as response:
+                
+                # Get total size
+                if session.total_size == 0:
+                    content_length = response.headers.get('Content-Length')
+                    if content_length:
+                        if 'Range' in headers:
+                            session.total_size = session.downloaded_bytes + int(content_length)
+                        else:
+                            session.total_size = int(content_length)
+                
+                # Send size info
+                await self.send(websocket, {
+                    'event': 'download-info',
+                    'fileId': session.session_id,
+                    'totalSize': session.total_size,
+                    'supportsResume': response.status == 206
+                })
+                
+                # Open file for writing
+                mode = 'ab' if session.downloaded_bytes > 0 else 'wb'
+                async with aiofiles.open(session.temp_path(), mode) as f:
                     
-                    # Send size info
-                    await self.send(websocket, {
-                        'event': 'download-info',
-                        'fileId': session.session_id,
-                        'totalSize': session.total_size,
-                        'supportsResume': response.status == 206
-                    })
+                    chunk_size = 64 * 1024  # 64KB chunks
+                    last_progress_time = time.time()
                     
-                    # Open file for writing
-                    mode = 'ab' if session.downloaded_bytes > 0 else 'wb'
-                    async with aiofiles.open(session.temp_path(), mode) as f:
-                        
-                        chunk_size = 64 * 1024  # 64KB chunks
-                        last_progress_time = time.time()
-                        
-                        async for chunk in response.content.iter_chunked(chunk_size):
-                            if session.status != "active":
-                                break
-                                
-                            await f.write(chunk)
-                            session.downloaded_bytes += len(chunk)
+                    async for chunk in response.content.iter_chunked(chunk_size):
+                        if session.status != "active":
+                            break
                             
-                            # Send progress every 250ms
-                            now = time.time()
-                            if now - last_progress_time > 0.25:
-                                progress = 0
-                                if session.total_size > 0:
-                                    progress = (session.downloaded_bytes / session.total_size) * 100
-                                
-                                await self.send(websocket, {
-                                    'event': 'download-progress',
-                                    'fileId': session.session_id,
-                                    'downloadedBytes': session.downloaded_bytes,
-                                    'totalSize': session.total_size,
-                                    'progress': progress
-                                })
-                                
-                                last_progress_time = now
-                    
-                    # Download completed
-                    if session.downloaded_bytes >= session.total_size or session.total_size == 0:
-                        session.status = "completed"
-                        
-                        # Move to final location (uploads directory)
-                        final_path = DOWNLOADS_DIR / session.filename
-                        counter = 1
-                        base_name = final_path.stem
-                        ext = final_path.suffix
-                        
-                        while final_path.exists():
-                            final_path = DOWNLOADS_DIR / f"{base_name}_{counter}{ext}"
-                            counter += 1
-                        
-                        os.rename(session.temp_path(), str(final_path))
-                        
-                        await self.send(websocket, {
-                            'event': 'download-complete',
-                            'fileId': session.session_id,
-                            'filename': final_path.name,
-                            'filePath': str(final_path),
-                            'totalSize': session.downloaded_bytes
-                        })
+                        await f.write(chunk)
+                        session.downloaded_bytes += len(chunk)
                         
+                        # Send progress every 250ms
+                        now = time.time()
+                        if now - last_progress_time > 0.25:
+                            await self._send_progress(session, websocket)
+                            last_progress_time = now
+                
+                # Download completed
+                if session.downloaded_bytes >= session.total_size or session.total_size == 0:
+                    await self._finish_download(session, websocket)
+                    
         except asyncio.CancelledError:
             session.status = "paused"
             logger.info(f"Download paused: {session.session_id}")
@@ -263,6 +500,143 @@ class DownloadManager:
             if session.session_id in self.active_downloads:
                 del self.active_downloads[session.session_id]
     
+    async def _send_progress(self, session: DownloadSession, websocket: WebSocketServerProtocol) -> None:
+        progress = 0
+        if session.total_size > 0:
+            progress = (session.downloaded_bytes / session.total_size) * 100
+        message = {
+            'event': 'download-progress',
+            'fileId': session.session_id,
+            'downloadedBytes': session.downloaded_bytes,
+            'totalSize': session.total_size,
+            'progress': progress
+        }
+        if session.segments:
+            message['segments'] = sum(1 for start, pos, end in session.segments if pos < end)
+        await self.send(websocket, message)
+
+    async def _finish_download(self, session: DownloadSession, websocket: WebSocketServerProtocol) -> None:
+        session.status = "completed"
+        
+        # Move to final location (uploads directory)
+        final_path = DOWNLOADS_DIR / session.filename
+        counter = 1
+        base_name = final_path.stem
+        ext = final_path.suffix
+        
+        while final_path.exists():
+            final_path = DOWNLOADS_DIR / f"{base_name}_{counter}{ext}"
+            counter += 1
+        
+        os.rename(session.temp_path(), str(final_path))
+        
+        await self.send(websocket, {
+            'event': 'download-complete',
+            'fileId': session.session_id,
+            'filename': final_path.name,
+            'filePath': str(final_path),
+            'totalSize': session.downloaded_bytes
+        })
+
+    async def _plan_segments(self, session: DownloadSession, timeout: aiohttp.ClientTimeout) -> None:
+        """Hỏi thử 1 byte bằng Range; nếu server trả 206 kèm tổng kích thước đủ lớn thì chia segment"""
+        client_session = await get_http_session()
+        try:
+            async with client_session.get(session.url, headers={'Range': 'bytes=0-0'}, timeout=timeout) as response:
+                content_range = response.headers.get('Content-Range', '')
+                if response.status != 206 or '/' not in content_range:
+                    # Server bỏ qua Range (200 kèm cả file): đóng kết nối, không đọc body
+                    response.release()
+                    return
+                await response.read()
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            logger.debug("Range probe failed for %s: %s", session.session_id, e)
+            return
+        total = content_range.rsplit('/', 1)[1]
+        if not total.isdigit():
+            return
+
+        session.total_size = int(total)
+        count = min(session.max_segments, session.total_size // DOWNLOAD_MIN_SEGMENT_SIZE)
+        if count < 2:
+            return
+        step = -(-session.total_size // count)
+        session.segments = [[start, start, min(start + step, session.total_size)]
+                             for start in range(0, session.total_size, step)]
+
+        # Cấp phát trước file để các segment ghi đúng vị trí
+        async with aiofiles.open(session.temp_path(), 'wb') as f:
+            await f.truncate(session.total_size)
+        logger.info("Segmented download: %s, size=%d, segments=%d",
+                    session.session_id, session.total_size, len(session.segments))
+
+    def _steal_segment(self, session: DownloadSession) -> Optional[List[int]]:
+        """Chia đôi phần còn lại của segment chậm nhất, trả về nửa sau cho worker đang rảnh"""
+        victim = max(session.segments, key=lambda seg: seg[2] - seg[1])
+        remaining = victim[2] - victim[1]
+        if remaining < 2 * DOWNLOAD_MIN_SEGMENT_SIZE:
+            return None
+        middle = victim[1] + remaining // 2
+        stolen = [middle, middle, victim[2]]
+        victim[2] = middle
+        session.segments.append(stolen)
+        logger.debug("Segment stolen: %s, [%d, %d)", session.session_id, stolen[0], stolen[2])
+        return stolen
+
+    async def _fetch_segment(self, session: DownloadSession, segment: List[int],
+                             timeout: aiohttp.ClientTimeout) -> None:
+        """Tải [pos, end) của một segment và ghi theo vị trí; end có thể bị thu nhỏ khi bị chia việc"""
+        client_session = await get_http_session()
+        headers = {'Range': f'bytes={segment[1]}-{segment[2] - 1}'}
+        async with client_session.get(session.url, headers=headers, timeout=timeout) as response:
+            if response.status != 206:
+                raise RuntimeError(f"Server ignored Range request (HTTP {response.status})")
+            async with aiofiles.open(session.temp_path(), 'r+b') as f:
+                await f.seek(segment[1])
+                async for chunk in response.content.iter_chunked(64 * 1024):
+                    # Segment đã bị worker khác lấy bớt phần cuối
+                    chunk = chunk[:segment[2] - segment[1]]
+                    await f.write(chunk)
+                    segment[1] += len(chunk)
+                    session.downloaded_bytes = session.segmented_bytes()
+                    if segment[1] >= segment[2]:
+                        break
+
+    async def _segment_worker(self, session: DownloadSession, segment: List[int],
+                              timeout: aiohttp.ClientTimeout) -> None:
+        while segment is not None:
+            retries = 0
+            while segment[1] < segment[2]:
+                try:
+                    await self._fetch_segment(session, segment, timeout)
+                except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                    retries += 1
+                    if retries > DOWNLOAD_SEGMENT_RETRIES:
+                        raise
+                    logger.warning("Segment retry %d for %s at %d: %s", retries, session.session_id, segment[1], e)
+                    await asyncio.sleep(retries)
+            # Xong phần của mình: lấy bớt việc của segment chậm nhất
+            segment = self._steal_segment(session)
+
+    async def _download_segmented(self, session: DownloadSession, websocket: WebSocketServerProtocol,
+                                  timeout: aiohttp.ClientTimeout) -> None:
+        session.downloaded_bytes = session.segmented_bytes()
+        pending = [seg for seg in session.segments if seg[1] < seg[2]]
+        workers = [asyncio.create_task(self._segment_worker(session, seg, timeout)) for seg in pending]
+        try:
+            # Progress gộp của mọi segment, gửi mỗi 250ms
+            while workers:
+                done, _ = await asyncio.wait(workers, timeout=0.25)
+                for task in done:
+                    workers.remove(task)
+                    task.result()  # lỗi của một segment -> dừng cả download
+                await self._send_progress(session, websocket)
+        finally:
+            for task in workers:
+                task.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+        session.downloaded_bytes = session.segmented_bytes()
+
     async def send(self, websocket: WebSocketServerProtocol, message: dict):
         try:
             await websocket.send(json.dumps(message))
@@ -275,6 +649,8 @@ class UploadManager:
         self.file_id_to_session: Dict[str, UploadSession] = {}
         self.connection_to_sessions: Dict[WebSocketServerProtocol, Dict[str, UploadSession]] = {}
         self.connection_auth: Dict[WebSocketServerProtocol, dict] = {}  # Store auth info per connection
+        self.aggregators: Dict[WebSocketServerProtocol, EventAggregator] = {}  # connection đã thương lượng eventTick
+        self.session_subscribers: Dict[str, Set[WebSocketServerProtocol]] = {}  # fileId -> các connection nhận broadcast
         logger.info("UploadManager initialized with remote upload capability")
 
     def register_connection(self, ws: WebSocketServerProtocol) -> None:
@@ -284,13 +660,28 @@ class UploadManager:
             self.connection_auth[ws] = {'authenticated': False, 'user': None, 'token': None}
         logger.debug("Connection registered: %s", ws.remote_address)
 
-    def authenticate_connection(self, ws: WebSocketServerProtocol, token: str, user: dict) -> bool:
+    def attach_session(self, ws: WebSocketServerProtocol, session: UploadSession) -> None:
+        """Gắn session vào connection và đăng ký connection nhận broadcast của session"""
+        self.register_connection(ws)
+        self.connection_to_sessions[ws][session.file_id] = session
+        self.session_subscribers.setdefault(session.file_id, set()).add(ws)
+
+    def detach_session(self, ws: WebSocketServerProtocol, file_id: str) -> None:
+        if ws in self.connection_to_sessions:
+            self.connection_to_sessions[ws].pop(file_id, None)
+        subscribers = self.session_subscribers.get(file_id)
+        if subscribers is not None:
+            subscribers.discard(ws)
+            if not subscribers:
+                del self.session_subscribers[file_id]
+
+    async def authenticate_connection(self, ws: WebSocketServerProtocol, token: str, user: dict) -> bool:
         """Authenticate a WebSocket connection"""
         if not auth_db or not token:
             return False
             
         # Verify token với auth database
-        verified_user = auth_db.get_user_by_token(token)
+        verified_user = await metadata.get_user_by_token(token)
         if verified_user:
             self.connection_auth[ws] = {
                 'authenticated': True,
@@ -306,17 +697,27 @@ class UploadManager:
         """Lấy thông tin authentication của connection"""
         return self.connection_auth.get(ws, {'authenticated': False, 'user': None, 'token': None})
 
-    def unregister_connection(self, ws: WebSocketServerProtocol) -> None:
+    async def unregister_connection(self, ws: WebSocketServerProtocol) -> None:
         sessions = self.connection_to_sessions.pop(ws, {})
         self.connection_auth.pop(ws, None)  # Clean up auth info
-        for session in sessions.values():
+        aggregator = self.aggregators.pop(ws, None)
+        if aggregator is not None:
+            aggregator.stop()
+        for file_id, session in sessions.items():
+            self.detach_session(ws, file_id)
+            # Chế độ ranges: các lane khác vẫn đang gửi thì không pause session
+            if file_id in self.session_subscribers:
+                continue
             if session.status == "active":
                 session.status = "paused"
                 logger.info("Session paused due to disconnect: %s (%s)", 
                            session.file_id, session.file_name)
+            if session.status == "paused":
+                async with session.file_lock:
+                    await session.close_writer()
         logger.debug("Connection unregistered: %s", ws.remote_address)
 
-    def get_or_create_session(self, ws: WebSocketServerProtocol, file_id: str, file_name: str, file_size: int) -> UploadSession:
+    async def get_or_create_session(self, ws: WebSocketServerProtocol, file_id: str, file_name: str, file_size: int) -> UploadSession:
         safe_name = os.path.basename(file_name)
         temp_path = TEMP_DIR / f"{file_id}_{safe_name}"
 
@@ -337,9 +738,10 @@ class UploadManager:
                 existing.user_id = auth_info['user']['id']
                 existing.user_token = auth_info['token']
             existing.temp_file_path = temp_path
-            if existing.temp_path().exists():
-                existing.bytes_received = existing.temp_path().stat().st_size
-                logger.debug("Resuming existing session: %s, offset=%d", file_id, existing.bytes_received)
+            # Khi handle còn mở, bytes_received (gồm cả phần trong bộ đệm) là chuẩn
+            if existing.part_file is None:
+                existing.load_progress()
+                logger.debug("Resuming existing session: %s, received=%d", file_id, existing.bytes_received)
             return existing
 
         session = UploadSession(
@@ -354,14 +756,17 @@ class UploadManager:
         )
         
         if session.temp_path().exists():
-            session.bytes_received = session.temp_path().stat().st_size
-            logger.info("Found existing partial file: %s, size=%d bytes", 
-                       session.temp_path(), session.bytes_received)
+            session.load_progress()
+            logger.info("Found existing partial file: %s, received=%d bytes (%s)", 
+                       session.temp_path(), session.bytes_received, session.mode)
+        
+        # Đăng ký session trước khi chờ DB để lane song song cùng fileId dùng chung session
+        self.file_id_to_session[file_id] = session
         
         # Thêm file vào database với status "uploading"
         try:
             temp_filename = f"{file_id}_{safe_name}"
-            session.db_id = db.add_file(
+            session.db_id = await metadata.add_file(
                 filename=safe_name,
                 original_filename=file_name,
                 size=file_size,
@@ -373,7 +778,6 @@ class UploadManager:
             logger.error(f"Failed to add file to database: {e}")
             session.db_id = None
         
-        self.file_id_to_session[file_id] = session
         logger.info("Created new upload session: %s (%s), size=%d bytes", 
                    file_id, safe_name, file_size)
         return session
@@ -383,15 +787,93 @@ class UploadManager:
             session = self.file_id_to_session[file_id]
             logger.debug("Removing session: %s (%s)", file_id, session.file_name)
             del self.file_id_to_session[file_id]
+        for ws in self.session_subscribers.pop(file_id, set()):
+            if ws in self.connection_to_sessions:
+                self.connection_to_sessions[ws].pop(file_id, None)
 
     async def broadcast_to_session(self, session: UploadSession, message: dict) -> None:
-        """Gửi message đến tất cả client đang kết nối với session này"""
-        for ws, sessions in self.connection_to_sessions.items():
-            if session.file_id in sessions:
-                try:
-                    await self.send(ws, message)
-                except Exception as e:
-                    logger.warning("Failed to send message to client: %s", e)
+        """Gửi message đến tất cả client đang kết nối với session này (song song, có timeout)"""
+        subscribers = list(self.session_subscribers.get(session.file_id, ()))
+        if subscribers:
+            await asyncio.gather(*(self.send_with_timeout(ws, message) for ws in subscribers))
+
+    async def send_with_timeout(self, ws: WebSocketServerProtocol, message: dict) -> None:
+        try:
+            await asyncio.wait_for(self.send(ws, message), timeout=BROADCAST_SEND_TIMEOUT)
+        except Exception as e:
+            logger.warning("Failed to send message to client %s: %s", ws.remote_address, e)
+
+    def remote_headers(self, session: UploadSession) -> dict:
+        """Headers cho POST lên file manager (REMOTE_UPLOAD_URL)"""
+        # Chuẩn bị headers với user authentication
+        headers = {
+            'Content-Type': 'application/octet-stream',
+            'X-File-Name': session.file_name,
+            'X-File-Size': str(session.file_size),
+            'X-File-ID': session.file_id
+        }
+        
+        # Sử dụng user token thay vì REMOTE_SERVER_TOKEN
+        if session.user_token:
+            headers['Authorization'] = f'Bearer {session.user_token}'
+        else:
+            # Fallback to old token for backward compatibility
+            headers['Authorization'] = f'Bearer {REMOTE_SERVER_TOKEN}'
+
+        # File manager kiểm tra digest trong lúc nhận; relay streaming chỉ biết thuật toán
+        content_hash = session.content_hash()
+        if content_hash:
+            headers[HASH_HEADER] = content_hash
+        elif session.hasher is not None:
+            headers[HASH_ALGORITHM_HEADER] = UPLOAD_HASH_ALGORITHM
+        return headers
+
+    async def start_streaming_relay(self, session: UploadSession) -> None:
+        """Mở relay streaming cho session sequential; phần .part đã có được gửi trước"""
+        async with session.file_lock:
+            # Đóng handle để phần đã nhận nằm hết trên đĩa, relay đọc lại phần này
+            await session.close_writer()
+            session.relay = StreamingRelay(
+                REMOTE_UPLOAD_URL, self.remote_headers(session), session.temp_path(),
+                session.bytes_received, session.file_size, RELAY_QUEUE_CHUNKS, RELAY_IDLE_TIMEOUT,
+            )
+            session.relay.start()
+        logger.info("Streaming relay started: %s, from offset=%d", session.file_id, session.bytes_received)
+
+    def cancel_relay(self, session: UploadSession) -> None:
+        if session.relay is not None:
+            session.relay.cancel()
+            session.relay = None
+            logger.debug("Streaming relay cancelled: %s", session.file_id)
+
+    async def remote_upload_succeeded(self, session: UploadSession, result: dict) -> None:
+        session.remote_file_id = result.get('file_id')
+        session.status = "completed"
+        
+        # Cập nhật database status thành completed
+        if session.db_id:
+            # Lưu thông tin file path trong remote_uploads
+            remote_file_path = f"{session.file_name}"  # Hoặc path từ result nếu có
+            metadata.update_file_status(session.db_id, "completed", remote_file_path)
+        
+        logger.info("File uploaded to remote server successfully: %s, remote_id=%s", 
+                session.file_id, session.remote_file_id)
+        
+        # Thông báo cho client rằng file đã hoàn thành - gửi cả 2 events để đảm bảo
+        await self.broadcast_to_session(session, {
+            "event": "completed",
+            "fileId": session.file_id,
+            "remoteFileId": session.remote_file_id,
+            "status": "completed"
+        })
+        
+        # Gửi thêm complete-ack để đảm bảo frontend nhận được
+        await self.broadcast_to_session(session, {
+            "event": "complete-ack",
+            "fileId": session.file_id,
+            "remoteFileId": session.remote_file_id,
+            "status": "completed"
+        })
 
     async def upload_to_remote_server(self, session: UploadSession) -> bool:
         """Upload completed file to remote server"""
@@ -427,7 +909,7 @@ class UploadManager:
             
             # Cập nhật database status
             if session.db_id:
-                db.update_file_status(session.db_id, "uploading")
+                metadata.update_file_status(session.db_id, "uploading")
             
             await self.broadcast_to_session(session, {
                 "event": "uploading",
@@ -435,82 +917,87 @@ class UploadManager:
                 "message": "Uploading to remote server..."
             })
             
-            # Chuẩn bị headers với user authentication
-            headers = {
-                'Content-Type': 'application/octet-stream',
-                'X-File-Name': session.file_name,
-                'X-File-Size': str(session.file_size),
-                'X-File-ID': session.file_id
-            }
+            # Relay streaming đã gửi dữ liệu trong lúc nhận chunk: chỉ chờ file manager trả lời
+            if session.relay is not None:
+                relay, session.relay = session.relay, None
+                result = await relay.finish()
+                expected_hash = session.content_hash()
+                if result is not None and expected_hash and result.get('content_hash') != expected_hash:
+                    logger.error("Content hash mismatch after relay: %s, expected=%s, remote=%s",
+                                 session.file_id, expected_hash, result.get('content_hash'))
+                    session.status = "error"
+                    await self.broadcast_to_session(session, {
+                        "event": "error",
+                        "fileId": session.file_id,
+                        "error": "Content hash mismatch"
+                    })
+                    return False
+                if result is not None:
+                    await self.remote_upload_succeeded(session, result)
+                    file_path.unlink(missing_ok=True)
+                    logger.debug("Temporary file deleted: %s", file_path)
+                    return True
+                logger.warning("Streaming relay failed, uploading from temp file: %s", session.file_id)
+
+            headers = self.remote_headers(session)
             
-            # Sử dụng user token thay vì REMOTE_SERVER_TOKEN
-            if session.user_token:
-                headers['Authorization'] = f'Bearer {session.user_token}'
-            else:
-                # Fallback to old token for backward compatibility
-                headers['Authorization'] = f'Bearer {REMOTE_SERVER_TOKEN}'
+            if REMOTE_RESUMABLE_URL:
+                # Lỗi tạm thời được thử lại từ offset file manager đã ghi nhận, không gửi lại từ đầu
+                upload = ResumableUpload(REMOTE_RESUMABLE_URL, headers, file_path, session.file_size,
+                                         session.remote_upload_id)
+                try:
+                    result = await upload.run()
+                except (RemoteUploadError, aiohttp.ClientError, asyncio.TimeoutError) as e:
+                    session.remote_upload_id = upload.upload_id
+                    logger.error("Failed to upload to remote server: %s, offset=%d, error=%s",
+                                 session.file_id, upload.offset, e)
+                    session.status = "error"
+                    await self.broadcast_to_session(session, {
+                        "event": "error",
+                        "fileId": session.file_id,
+                        "error": f"Remote upload failed: {e}"
+                    })
+                    return False
+                await self.remote_upload_succeeded(session, result)
+                file_path.unlink(missing_ok=True)
+                logger.debug("Temporary file deleted: %s", file_path)
+                return True
             
             # Gửi file đến remote server
-            async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=None)) as http_session:
-                async with aiofiles.open(file_path, 'rb') as f:
-                    async with http_session.post(
-                        REMOTE_UPLOAD_URL,
-                        data=f,              # <— truyền file-like object, aiohttp sẽ stream
-                        headers=headers
-                    ) as response:
-                        if response.status == 200:
-                            result = await response.json()
-                            session.remote_file_id = result.get('file_id')
-                            session.status = "completed"
-                            
-                            # Cập nhật database status thành completed
-                            if session.db_id:
-                                # Lưu thông tin file path trong remote_uploads
-                                remote_file_path = f"{session.file_name}"  # Hoặc path từ result nếu có
-                                db.update_file_status(session.db_id, "completed", remote_file_path)
-                            
-                            logger.info("File uploaded to remote server successfully: %s, remote_id=%s", 
-                                    session.file_id, session.remote_file_id)
-                            
-                            # Thông báo cho client rằng file đã hoàn thành - gửi cả 2 events để đảm bảo
-                            await self.broadcast_to_session(session, {
-                                "event": "completed",
-                                "fileId": session.file_id,
-                                "remoteFileId": session.remote_file_id,
-                                "status": "completed"
-                            })
-                            
-                            # Gửi thêm complete-ack để đảm bảo frontend nhận được
-                            await self.broadcast_to_session(session, {
-                                "event": "complete-ack",
-                                "fileId": session.file_id,
-                                "remoteFileId": session.remote_file_id,
-                                "status": "completed"
-                            })
-                            
-                            return True
-                        else:
-                            error_text = await response.text()
-                            logger.error("Failed to upload to remote server: %s, status=%d, error=%s", 
-                                    session.file_id, response.status, error_text)
-                            session.status = "error"
-                            await self.broadcast_to_session(session, {
-                                "event": "error",
-                                "fileId": session.file_id,
-                                "error": f"Remote upload failed: HTTP {response.status}"
-                            })
-                            return False
-                
-                # Xóa file tạm sau khi đã đóng file handle
-                if session.status == "completed":
-                    try:
-                        # Thêm delay nhỏ để đảm bảo file handle đã được giải phóng
-                        await asyncio.sleep(0.1)
-                        file_path.unlink(missing_ok=True)  # Xóa file .part
-                        logger.debug("Temporary file deleted: %s", file_path)
-                    except Exception as e:
-                        logger.warning("Failed to delete temp file %s: %s", file_path, e)
-                        
+            http_session = await get_http_session()
+            async with aiofiles.open(file_path, 'rb') as f:
+                async with http_session.post(
+                    REMOTE_UPLOAD_URL,
+                    data=f,              # <— truyền file-like object, aiohttp sẽ stream
+                    headers=headers,
+                    timeout=aiohttp.ClientTimeout(total=None)
+                ) as response:
+                    if response.status == 200:
+                        result = await response.json()
+                        await self.remote_upload_succeeded(session, result)
+                        return True
+                    else:
+                        error_text = await response.text()
+                        logger.error("Failed to upload to remote server: %s, status=%d, error=%s", 
+                                session.file_id, response.status, error_text)
+                        session.status = "error"
+                        await self.broadcast_to_session(session, {
+                            "event": "error",
+                            "fileId": session.file_id,
+                            "error": f"Remote upload failed: HTTP {response.status}"
+                        })
+                        return False
+            
+            # Xóa file tạm sau khi đã đóng file handle
+            if session.status == "completed":
+                try:
+                    # Thêm delay nhỏ để đảm bảo file handle đã được giải phóng
+                    await asyncio.sleep(0.1)
+                    file_path.unlink(missing_ok=True)  # Xóa file .part
+                    logger.debug("Temporary file deleted: %s", file_path)
+                except Exception as e:
+                    logger.warning("Failed to delete temp file %s: %s", file_path, e)
+                    
         except Exception as e:
             logger.exception("Error uploading to remote server: %s", e)
             session.status = "error"
@@ -531,23 +1018,70 @@ class UploadManager:
             await self.send_error(ws, file_id, "Invalid start payload")
             return
 
-        session = self.get_or_create_session(ws, file_id, file_name, file_size)
+        session = await self.get_or_create_session(ws, file_id, file_name, file_size)
+        if session.status not in UPLOAD_STARTABLE_STATUSES:
+            # File đang được hoàn tất/relay: start gửi lại chỉ nhận trạng thái, không mở lại lane nào
+            self.attach_session(ws, session)
+            logger.info("Start ignored - upload already %s: %s", session.status, file_id)
+            await self.send(ws, self.build_start_ack(session, self.negotiate_event_tick(ws, payload.get("eventTick"))))
+            return
         session.status = "active"
+        # Thương lượng chế độ gửi chunk: client đề nghị, server xác nhận trong start-ack
+        if payload.get("chunkMode") == CHUNK_MODE_BINARY:
+            session.chunk_mode = CHUNK_MODE_BINARY
+        else:
+            session.chunk_mode = CHUNK_MODE_BASE64
+        # Thương lượng window: client đề nghị, server giới hạn theo cấu hình
+        try:
+            requested_window = int(payload.get("window", 1))
+        except (TypeError, ValueError):
+            requested_window = 1
+        session.window_chunks = max(1, min(requested_window, MAX_WINDOW_CHUNKS))
+        session.window_bytes = MAX_WINDOW_BYTES
+        session.mismatch_reported = None
+        event_tick = self.negotiate_event_tick(ws, payload.get("eventTick"))
+        # Chế độ ranges: nhiều connection/lane cùng ghi một file theo vị trí.
+        # Một khi đã ở chế độ ranges thì giữ nguyên (client tuần tự vẫn dùng được qua "offset").
+        if payload.get("mode") == UPLOAD_MODE_RANGES and session.mode != UPLOAD_MODE_RANGES:
+            # Relay streaming cần dữ liệu liên tục, không dùng được khi ghi theo vị trí
+            self.cancel_relay(session)
+            async with session.file_lock:
+                await session.close_writer()
+                session.enable_range_mode()
+        async with session.file_lock:
+            if session.part_file is None:
+                await session.restore_hash()
+        if (RELAY_MODE == RELAY_MODE_STREAMING and session.mode == UPLOAD_MODE_SEQUENTIAL
+                and (session.relay is None or session.relay.failed)
+                and session.bytes_received < session.file_size):
+            # Relay cũ lỗi (file manager đã bỏ request dở) -> mở lại từ đầu file
+            self.cancel_relay(session)
+            await self.start_streaming_relay(session)
 
-        self.register_connection(ws)
-        self.connection_to_sessions[ws][file_id] = session
+        self.attach_session(ws, session)
 
-        logger.info("Upload started: %s (%s), size=%d bytes, offset=%d", 
-                   file_id, file_name, file_size, session.bytes_received)
+        logger.info("Upload started: %s (%s), size=%d bytes, received=%d, mode=%s", 
+                   file_id, file_name, file_size, session.bytes_received, session.mode)
 
-        await self.send(ws, {
+        await self.send(ws, self.build_start_ack(session, event_tick))
+
+    def build_start_ack(self, session: UploadSession, event_tick) -> dict:
+        start_ack = {
             "event": "start-ack",
             "fileId": session.file_id,
-            "offset": session.bytes_received,
+            "offset": session.ack_offset(),
             "status": session.status,
-        })
+            "chunkMode": session.chunk_mode,
+            "window": {"chunks": session.window_chunks, "bytes": session.window_bytes},
+            "mode": session.mode,
+            "eventTick": event_tick,
+        }
+        if session.mode == UPLOAD_MODE_RANGES:
+            start_ack["missingRanges"] = session.missing_ranges()
+        return start_ack
 
     async def handle_chunk(self, ws: WebSocketServerProtocol, payload: dict) -> None:
+        """Chunk dạng JSON text frame với data base64"""
         file_id = payload.get("fileId")
         data_b64 = payload.get("data")
         offset = int(payload.get("offset", -1))
@@ -557,6 +1091,35 @@ class UploadManager:
             await self.send_error(ws, file_id, "Invalid chunk payload")
             return
 
+        try:
+            data = base64.b64decode(data_b64)
+        except Exception as e:
+            logger.error("Failed to decode base64 data for %s: %s", file_id, e)
+            await self.send_error(ws, file_id, "Invalid base64 data")
+            return
+
+        await self.write_chunk(ws, file_id, offset, data)
+
+    async def handle_binary_chunk(self, ws: WebSocketServerProtocol, frame: bytes) -> None:
+        """Chunk dạng binary frame: header (fileId, offset, length) + dữ liệu thô"""
+        try:
+            file_id, offset, data = decode_chunk_frame(frame)
+        except ValueError as e:
+            logger.warning("Invalid binary chunk frame from %s: %s", ws.remote_address, e)
+            await self.send_error(ws, None, "Invalid binary chunk frame")
+            return
+
+        session = self.file_id_to_session.get(file_id)
+        if session and session.chunk_mode != CHUNK_MODE_BINARY:
+            # Session đã thương lượng base64 trong start-ack: client phải gửi chunk dạng JSON
+            logger.warning("Binary chunk rejected - session negotiated %s: %s", session.chunk_mode, file_id)
+            await self.send_error(ws, file_id, f"Binary chunks not negotiated (chunkMode: {session.chunk_mode})")
+            return
+
+        await self.write_chunk(ws, file_id, offset, data)
+
+    async def write_chunk(self, ws: WebSocketServerProtocol, file_id: str, offset: int, data) -> None:
+        """Ghi chunk đã giải mã vào file .part (dùng chung cho cả 2 chế độ)"""
         session = self.file_id_to_session.get(file_id)
         if not session:
             logger.warning("Chunk received for unknown session: %s", file_id)
@@ -565,15 +1128,39 @@ class UploadManager:
 
         if session.status == "paused":
             logger.debug("Chunk ignored - session paused: %s", file_id)
-            await self.send(ws, {"event": "paused", "fileId": file_id, "offset": session.bytes_received})
+            await self.send(ws, {"event": "paused", "fileId": file_id, "offset": session.ack_offset()})
             return
         if session.status in ("stopped", "completed", "error", "uploading"):
             logger.warning("Chunk rejected - invalid status: %s (%s)", file_id, session.status)
             await self.send_error(ws, file_id, f"Cannot accept chunk in status: {session.status}")
             return
 
+        if session.mode == UPLOAD_MODE_RANGES:
+            await self.write_range_chunk(ws, session, offset, data)
+            return
+
         expected = session.bytes_received
+        if offset < expected < offset + len(data):
+            # Chunk chồng lấn phần đã nhận (client gửi lại sau khi rewind): chỉ ghi phần mới
+            data = data[expected - offset:]
+            offset = expected
+        elif offset + len(data) <= expected:
+            # Chunk trùng hoàn toàn: không ghi, chỉ ack lũy tiến
+            logger.debug("Duplicate chunk ignored: %s, offset=%d", file_id, offset)
+            await self.send_ack(ws, session, {
+                "event": "chunk-ack",
+                "fileId": file_id,
+                "offset": session.bytes_received,
+                "receivedBytes": 0,
+                "percent": round(min(100.0 * session.bytes_received / max(session.file_size, 1), 100.0), 2),
+            })
+            return
         if offset != expected:
+            # Với window, các chunk đang bay sau chỗ hổng đều sai offset: chỉ báo một lần
+            if session.mismatch_reported == expected:
+                logger.debug("Offset mismatch already reported: %s, offset=%d", file_id, offset)
+                return
+            session.mismatch_reported = expected
             logger.warning("Offset mismatch: expected=%d, received=%d for %s", 
                           expected, offset, file_id)
             await self.send(ws, {
@@ -583,31 +1170,22 @@ class UploadManager:
                 "received": offset,
             })
             return
+        session.mismatch_reported = None
 
-        try:
-            data = base64.b64decode(data_b64)
-        except Exception as e:
-            logger.error("Failed to decode base64 data for %s: %s", file_id, e)
-            await self.send_error(ws, file_id, "Invalid base64 data")
-            return
-
-        # Write chunk to temp .part file
+        # Write chunk to temp .part file (qua handle + bộ đệm của session)
         async with session.file_lock:
-            temp_path = session.temp_path()
-            temp_path.parent.mkdir(parents=True, exist_ok=True)
-            
-            async with aiofiles.open(temp_path, 'ab') as f:
-                await f.write(data)
-                await f.flush()
-            
+            await session.write(offset, data)
             session.bytes_received += len(data)
+            if session.relay is not None:
+                # Chunk liên tục -> gửi tiếp lên file manager; hàng đợi đầy thì ack bị chậm lại
+                await session.relay.feed(data)
 
         percent = min(100.0 * session.bytes_received / max(session.file_size, 1), 100.0)
         logger.debug("Chunk processed: %s, offset=%d, chunk_size=%d, progress=%.1f%%", 
                     file_id, session.bytes_received, len(data), percent)
         
-        # Gửi phản hồi xác nhận chunk đã được xử lý
-        await self.send(ws, {
+        # Ack lũy tiến: offset = byte liên tục cao nhất đã nhận
+        await self.send_ack(ws, session, {
             "event": "chunk-ack",
             "fileId": file_id,
             "offset": session.bytes_received,
@@ -617,19 +1195,61 @@ class UploadManager:
         
         # Kiểm tra nếu upload hoàn tất
         if session.bytes_received >= session.file_size:
-            logger.info("Local upload completed: %s, finalizing file", file_id)
-            
-            # Đợi một chút để đảm bảo file được flush hoàn toàn
-            await asyncio.sleep(0.1)
-            
-            # Đổi status nhưng KHÔNG upload to remote ở đây
-            # Để handle_complete xử lý việc rename và upload
-            session.status = "completing"
-            await self.send(ws, {
-                "event": "local-complete", 
-                "fileId": file_id,
-                "message": "Local upload completed, finalizing..."
-            })
+            await self.finish_local_upload(ws, session)
+
+    async def write_range_chunk(self, ws: WebSocketServerProtocol, session: UploadSession, offset: int, data) -> None:
+        """Chế độ ranges: ghi chunk vào đúng vị trí, chấp nhận mọi thứ tự giữa các lane"""
+        file_id = session.file_id
+        end = offset + len(data)
+        if offset < 0 or end > session.file_size:
+            logger.warning("Range out of bounds: %s, [%d, %d) size=%d", file_id, offset, end, session.file_size)
+            await self.send_error(ws, file_id, "Chunk range out of bounds")
+            return
+
+        if session.status == "completing":
+            # Lane gửi lại chunk sau khi file đã đủ: không mở lại handle, chỉ ack
+            await self.send(ws, {"event": "chunk-ack", "fileId": file_id, "offset": session.ack_offset(),
+                                 "range": [offset, end], "receivedBytes": 0, "percent": 100.0})
+            return
+
+        async with session.file_lock:
+            await session.write(offset, data)
+            added = add_range(session.received_ranges, offset, end)
+            session.bytes_received += added
+
+        percent = min(100.0 * session.bytes_received / max(session.file_size, 1), 100.0)
+        logger.debug("Range chunk processed: %s, [%d, %d), new=%d, progress=%.1f%%",
+                    file_id, offset, end, added, percent)
+
+        # "range" để lane biết chunk nào đã được nhận; "offset" vẫn là ack lũy tiến
+        await self.send_ack(ws, session, {
+            "event": "chunk-ack",
+            "fileId": file_id,
+            "offset": session.ack_offset(),
+            "range": [offset, end],
+            "receivedBytes": added,
+            "percent": round(percent, 2),
+        })
+
+        if session.bytes_received >= session.file_size and session.status == "active":
+            await self.finish_local_upload(ws, session)
+
+    async def finish_local_upload(self, ws: WebSocketServerProtocol, session: UploadSession) -> None:
+        file_id = session.file_id
+        logger.info("Local upload completed: %s, finalizing file", file_id)
+        
+        # Flush bộ đệm và đóng handle để file .part đầy đủ trên đĩa
+        async with session.file_lock:
+            await session.close_writer()
+        
+        # Đổi status nhưng KHÔNG upload to remote ở đây
+        # Để handle_complete xử lý việc rename và upload
+        session.status = "completing"
+        await self.send(ws, {
+            "event": "local-complete", 
+            "fileId": file_id,
+            "message": "Local upload completed, finalizing..."
+        })
 
     async def handle_pause(self, ws: WebSocketServerProtocol, payload: dict) -> None:
         file_id = payload.get("fileId")
@@ -639,13 +1259,15 @@ class UploadManager:
             await self.send_error(ws, file_id, "Session not found")
             return
         session.status = "paused"
+        async with session.file_lock:
+            await session.close_writer()
         
         # Cập nhật database status
         if session.db_id:
-            db.update_file_status(session.db_id, "paused")
+            metadata.update_file_status(session.db_id, "paused")
         
         logger.info("Upload paused: %s (%s)", file_id, session.file_name)
-        await self.send(ws, {"event": "paused", "fileId": file_id, "offset": session.bytes_received})
+        await self.send(ws, {"event": "paused", "fileId": file_id, "offset": session.ack_offset()})
 
     async def handle_resume(self, ws: WebSocketServerProtocol, payload: dict) -> None:
         file_id = payload.get("fileId")
@@ -655,13 +1277,17 @@ class UploadManager:
             await self.send_error(ws, file_id, "Session not found")
             return
         session.status = "active"
+        session.mismatch_reported = None
         
         # Cập nhật database status
         if session.db_id:
-            db.update_file_status(session.db_id, "uploading")
+            metadata.update_file_status(session.db_id, "uploading")
         
         logger.info("Upload resumed: %s (%s)", file_id, session.file_name)
-        await self.send(ws, {"event": "resume-ack", "fileId": file_id, "offset": session.bytes_received})
+        resume_ack = {"event": "resume-ack", "fileId": file_id, "offset": session.ack_offset()}
+        if session.mode == UPLOAD_MODE_RANGES:
+            resume_ack["missingRanges"] = session.missing_ranges()
+        await self.send(ws, resume_ack)
 
     async def handle_stop(self, ws: WebSocketServerProtocol, payload: dict) -> None:
         file_id = payload.get("fileId")
@@ -672,25 +1298,27 @@ class UploadManager:
             await self.send_error(ws, file_id, "Session not found")
             return
         session.status = "stopped"
+        self.cancel_relay(session)
+        async with session.file_lock:
+            await session.close_writer()
         logger.info("Upload stopped: %s (%s), delete=%s", file_id, session.file_name, delete)
         
         # Xóa file khỏi database nếu yêu cầu
         if delete and session.db_id:
-            db.delete_file(session.db_id)
+            metadata.delete_file(session.db_id)
             logger.info(f"File deleted from database: {file_id}")
         
         # Remove temp file if requested
-        temp_path = session.temp_path()
-        if delete and temp_path.exists():
-            try:
-                temp_path.unlink()
-                logger.debug("Temporary file deleted: %s", temp_path)
-            except Exception as exc:
-                logger.warning("Failed to delete temp file %s: %s", temp_path, exc)
+        for temp_path in (session.temp_path(), session.ranges_path()):
+            if delete and temp_path.exists():
+                try:
+                    temp_path.unlink()
+                    logger.debug("Temporary file deleted: %s", temp_path)
+                except Exception as exc:
+                    logger.warning("Failed to delete temp file %s: %s", temp_path, exc)
         
         self.remove_session(file_id)
-        if ws in self.connection_to_sessions:
-            self.connection_to_sessions[ws].pop(file_id, None)
+        self.detach_session(ws, file_id)
         await self.send(ws, {"event": "stop-ack", "fileId": file_id})
 
     async def handle_complete(self, ws: WebSocketServerProtocol, payload: dict) -> None:
@@ -710,31 +1338,37 @@ class UploadManager:
 
         # Rename .part to final temp file
         async with session.file_lock:
+            await session.close_writer()
             temp_path = session.temp_path()
-            if not temp_path.exists():
+            # complete gửi lại sau khi upload lên file manager lỗi: file đã đổi tên ở lần trước
+            already_local = not temp_path.exists() and session.temp_file_path.exists()
+            if not temp_path.exists() and not already_local:
                 logger.error("Temporary file missing for %s: %s", file_id, temp_path)
                 await self.send_error(ws, file_id, "Temporary file missing")
                 return
             
             try:
                 final_temp_path = session.temp_file_path
-                temp_path.rename(final_temp_path)
-                logger.info("File completed locally: %s (%s) -> %s", 
-                           file_id, session.file_name, final_temp_path.name)
+                if not already_local:
+                    temp_path.rename(final_temp_path)
+                    session.ranges_path().unlink(missing_ok=True)
+                    logger.info("File completed locally: %s (%s) -> %s", 
+                               file_id, session.file_name, final_temp_path.name)
                 
                 # Bắt đầu upload lên remote server
                 success = await self.upload_to_remote_server(session)
                 
-                if success:
+                if not success:
+                    await self.send_error(ws, file_id, "Failed to upload to remote server")
+                    return
+                # Connection đã đăng ký session thì đã nhận complete-ack qua broadcast
+                if ws not in self.session_subscribers.get(file_id, ()):
                     await self.send(ws, {
                         "event": "complete-ack",
                         "fileId": file_id,
                         "remoteFileId": session.remote_file_id,
                         "status": "uploaded_to_remote"
                     })
-                else:
-                    await self.send_error(ws, file_id, "Failed to upload to remote server")
-                    return
                     
             except Exception as exc:
                 session.status = "error"
@@ -745,7 +1379,50 @@ class UploadManager:
         # Cleanup session
         self.remove_session(file_id)
 
+    async def close_idle_writers(self) -> None:
+        """Định kỳ đóng handle .part của các session không nhận chunk quá IDLE_HANDLE_TIMEOUT"""
+        while True:
+            await asyncio.sleep(max(IDLE_HANDLE_TIMEOUT / 2, 1))
+            cutoff = time.time() - IDLE_HANDLE_TIMEOUT
+            for session in list(self.file_id_to_session.values()):
+                if session.part_file is not None and session.last_activity < cutoff:
+                    async with session.file_lock:
+                        await session.close_writer()
+                    logger.debug("Closed idle .part handle: %s (%s)", session.file_id, session.file_name)
+
+    def negotiate_event_tick(self, ws: WebSocketServerProtocol, requested) -> int:
+        """Bật gộp ack cho connection nếu client đề nghị eventTick (ms); trả về tick đã chọn, 0 = tắt"""
+        aggregator = self.aggregators.get(ws)
+        try:
+            tick_ms = int(requested or 0)
+        except (TypeError, ValueError):
+            tick_ms = 0
+        if tick_ms <= 0:
+            return round(aggregator.tick * 1000) if aggregator else 0
+
+        tick_ms = max(EVENT_TICK_MIN_MS, min(tick_ms, EVENT_TICK_MAX_MS))
+        if aggregator is None:
+            aggregator = self.aggregators[ws] = EventAggregator(ws, tick_ms / 1000)
+            aggregator.start()
+        aggregator.tick = tick_ms / 1000
+        return tick_ms
+
+    async def send_ack(self, ws: WebSocketServerProtocol, session: UploadSession, message: dict) -> None:
+        """Gửi chunk-ack: gộp theo tick nếu connection đã thương lượng eventTick,
+        nhưng gửi ngay khi số chunk/byte chưa ack đã chiếm nửa window của client"""
+        aggregator = self.aggregators.get(ws)
+        if aggregator is None:
+            await ws.send(json.dumps(message))
+            return
+        chunks, size = aggregator.add(message)
+        if chunks >= max(1, session.window_chunks // 2) or size >= session.window_bytes // 2:
+            await aggregator.flush()
+
     async def send(self, ws: WebSocketServerProtocol, message: dict) -> None:
+        # Ack đang chờ phải đi trước event này để client nhận đúng thứ tự
+        aggregator = self.aggregators.get(ws)
+        if aggregator is not None:
+            await aggregator.flush()
         await ws.send(json.dumps(message))
 
     async def send_error(self, ws: WebSocketServerProtocol, file_id: Optional[str], error: str) -> None:
@@ -753,7 +1430,7 @@ class UploadManager:
         if file_id:
             payload["fileId"] = file_id
         logger.error("Sending error to client: %s", error)
-        await ws.send(json.dumps(payload))
+        await self.send(ws, payload)
 
 
 manager = UploadManager()
@@ -772,6 +1449,11 @@ async def handler(ws: WebSocketServerProtocol, path: str) -> None:
                 logger.warning("Message too large from %s: %d bytes", ws.remote_address, len(message))
                 await manager.send_error(ws, None, "Message too large")
                 continue
+
+            # Binary frame = upload chunk (chế độ binary), JSON chỉ dùng cho control messages
+            if isinstance(message, bytes):
+                await manager.handle_binary_chunk(ws, message)
+                continue
                 
             try:
                 data = json.loads(message)
@@ -795,7 +1477,7 @@ async def handler(ws: WebSocketServerProtocol, path: str) -> None:
                 token = data.get("token")
                 user = data.get("user")
                 
-                if manager.authenticate_connection(ws, token, user):
+                if await manager.authenticate_connection(ws, token, user):
                     await ws.send(json.dumps({
                         'event': 'auth-success',
                         'message': f'Authenticated as {user.get("username", "unknown")}'
@@ -846,6 +1528,11 @@ async def handler(ws: WebSocketServerProtocol, path: str) -> None:
                 
                 # Create download session
                 session = download_manager.create_session(url, filename)
+                # Số segment song song (1 = tải một luồng như cũ)
+                try:
+                    session.max_segments = max(1, int(data.get("segments", DOWNLOAD_SEGMENTS)))
+                except (TypeError, ValueError):
+                    pass
                 # Use client's fileId for consistency
                 if file_id:
                     old_id = session.session_id
@@ -902,16 +1589,25 @@ async def handler(ws: WebSocketServerProtocol, path: str) -> None:
         logger.exception("Unhandled error from %s: %s", ws.remote_address, exc)
     finally:
         # Pause all active sessions tied to this connection to enable resume later
-        manager.unregister_connection(ws)
+        await manager.unregister_connection(ws)
         logger.info("Connection closed: %s", ws.remote_address)
 
 
 async def main() -> None:
     host = os.environ.get("WS_HOST", "localhost")
     port = int(os.environ.get("WS_PORT", "8765"))
-    async with websockets.serve(handler, host, port, origins=None, max_size=8 * 1024 * 1024):  # 8 MB frame
-        logger.info("WebSocket server listening on ws://%s:%d", host, port)
-        await asyncio.Future()  # run forever
+    # Một ClientSession (connection pool + DNS cache) cho mọi request HTTP của server
+    await open_http_session()
+    metadata.start()
+    idle_task = asyncio.create_task(manager.close_idle_writers())
+    try:
+        async with websockets.serve(handler, host, port, origins=None, max_size=8 * 1024 * 1024):  # 8 MB frame
+            logger.info("WebSocket server listening on ws://%s:%d", host, port)
+            await asyncio.Future()  # run forever
+    finally:
+        idle_task.cancel()
+        await close_http_session()
+        await metadata.stop()
 
 
 if __name__ == "__main__":
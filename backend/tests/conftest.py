@@ -0,0 +1,49 @@
+import os
+import shutil
+import sys
+import tempfile
+import uuid
+from pathlib import Path
+
+import pytest
+
+# Các module backend import lẫn nhau theo tên phẳng (from database import db, ...)
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+if str(BACKEND_DIR) not in sys.path:
+    sys.path.insert(0, str(BACKEND_DIR))
+
+# Dữ liệu của test nằm trong thư mục tạm, không đụng tới DB/upload thật
+TEST_DIR = Path(tempfile.mkdtemp(prefix="flextransfer-tests-"))
+os.environ["UPLOAD_FOLDER"] = str(TEST_DIR / "remote_uploads")
+os.environ["TEMP_FOLDER"] = str(TEST_DIR / "temp_uploads")
+
+
+def pytest_sessionstart(session):
+    # files.db/auth.db được mở theo cwd ngay khi import database: chuyển cwd trước khi collect test
+    os.chdir(TEST_DIR)
+
+
+def pytest_unconfigure(config):
+    shutil.rmtree(TEST_DIR, ignore_errors=True)
+
+
+@pytest.fixture(scope="session")
+def file_manager():
+    import file_manager as module
+    module.app.config["TESTING"] = True
+    return module
+
+
+@pytest.fixture
+def client(file_manager):
+    return file_manager.app.test_client()
+
+
+@pytest.fixture
+def make_user(file_manager):
+    """Tạo user mới (tên ngẫu nhiên); trả về (user_id, header Authorization)"""
+    def make():
+        user_id = file_manager.auth_db.create_user(f"user_{uuid.uuid4().hex[:10]}", "secret123")
+        token = file_manager.auth_db.create_session(user_id)
+        return user_id, {"Authorization": f"Bearer {token}"}
+    return make
@@ -0,0 +1,129 @@
+import io
+import os
+import uuid
+import zipfile
+
+import pytest
+
+from archive import unique_arcname
+
+
+def upload(client, headers, name, data, folder_id=None):
+    extra = {"X-Folder-ID": folder_id} if folder_id else {}
+    response = client.post("/api/upload", data=data, headers={
+        **headers, "X-File-Name": name, "X-File-Size": str(len(data)), "X-File-ID": uuid.uuid4().hex, **extra,
+    })
+    assert response.status_code == 200, response.get_json()
+    return response.get_json()["file_id"]
+
+
+def create_folder(client, headers, name, parent_id=None):
+    response = client.post("/api/folders", headers=headers, json={"name": name, "parent_id": parent_id})
+    assert response.status_code == 200, response.get_json()
+    return response.get_json()["folder_id"]
+
+
+def read_zip(response):
+    assert response.status_code == 200
+    assert response.mimetype == "application/zip"
+    return zipfile.ZipFile(io.BytesIO(response.data))
+
+
+def test_unique_arcname_is_case_insensitive():
+    used = set()
+    names = [unique_arcname(name, used) for name in ("a.txt", "A.txt", "a.txt", "b")]
+    assert names == ["a.txt", "A (1).txt", "a (2).txt", "b"]
+
+
+def test_files_archive_renames_duplicates_and_picks_compression(client, make_user):
+    _, headers = make_user()
+    text = b"hello archive " * 500
+    photo = os.urandom(2000)
+    ids = [
+        upload(client, headers, "notes.txt", text),
+        upload(client, headers, "notes.txt", b"second"),
+        upload(client, headers, "photo.jpg", photo),
+    ]
+
+    response = client.get(f"/api/files/archive?ids={','.join(map(str, ids))}", headers=headers)
+
+    with read_zip(response) as zf:
+        assert zf.testzip() is None
+        assert zf.namelist() == ["notes.txt", "notes (1).txt", "photo.jpg"]
+        assert zf.read("notes.txt") == text
+        assert zf.read("notes (1).txt") == b"second"
+        assert zf.read("photo.jpg") == photo
+        # Ảnh đã nén sẵn được lưu nguyên, text được deflate
+        assert zf.getinfo("photo.jpg").compress_type == zipfile.ZIP_STORED
+        assert zf.getinfo("notes.txt").compress_type == zipfile.ZIP_DEFLATED
+        assert zf.getinfo("notes.txt").compress_size < len(text)
+    assert "attachment" in response.headers["Content-Disposition"]
+
+
+def test_files_archive_post_body(client, make_user):
+    _, headers = make_user()
+    file_id = upload(client, headers, "a.txt", b"a")
+    with read_zip(client.post("/api/files/archive", headers=headers, json={"ids": [file_id]})) as zf:
+        assert zf.namelist() == ["a.txt"]
+
+
+def test_files_archive_checks_ownership_and_existence(client, make_user):
+    _, owner = make_user()
+    _, other = make_user()
+    mine = upload(client, other, "mine.txt", b"mine")
+    theirs = upload(client, owner, "theirs.txt", b"theirs")
+
+    denied = client.get(f"/api/files/archive?ids={mine},{theirs}", headers=other)
+    assert denied.status_code == 403
+    assert denied.get_json()["ids"] == [theirs]
+
+    missing = client.get(f"/api/files/archive?ids={mine},999999999", headers=other)
+    assert missing.status_code == 404
+    assert missing.get_json()["ids"] == [999999999]
+
+
+@pytest.mark.parametrize("ids", ["", "1,x"])
+def test_files_archive_rejects_bad_ids(client, make_user, ids):
+    _, headers = make_user()
+    assert client.get(f"/api/files/archive?ids={ids}", headers=headers).status_code == 400
+
+
+def test_folder_archive_contains_subfolder_tree(client, make_user):
+    _, headers = make_user()
+    root = create_folder(client, headers, "Docs")
+    child = create_folder(client, headers, "Reports", root)
+    grandchild = create_folder(client, headers, "2024", child)
+    outside = create_folder(client, headers, "Other")
+    upload(client, headers, "readme.txt", b"root", root)
+    upload(client, headers, "q1.txt", b"q1", child)
+    upload(client, headers, "Q1.txt", b"q1 again", child)
+    upload(client, headers, "jan.txt", b"jan", grandchild)
+    upload(client, headers, "skip.txt", b"skip", outside)
+    upload(client, headers, "loose.txt", b"loose")
+
+    response = client.get(f"/api/folders/{root}/archive", headers=headers)
+
+    with read_zip(response) as zf:
+        contents = {name: zf.read(name) for name in zf.namelist()}
+    assert contents["Docs/readme.txt"] == b"root"
+    assert contents["Docs/Reports/2024/jan.txt"] == b"jan"
+    # q1.txt/Q1.txt trùng tên (không phân biệt hoa thường): file sau được đổi tên
+    reports = {name: data for name, data in contents.items() if name.count("/") == 2 and "/Reports/" in name}
+    assert sorted(reports.values()) == [b"q1", b"q1 again"]
+    assert sorted(name.lower() for name in reports) == ["docs/reports/q1 (1).txt", "docs/reports/q1.txt"]
+    assert len(contents) == 4
+    assert "Docs.zip" in response.headers["Content-Disposition"]
+
+    # Subfolder tải riêng cũng được, gốc của archive là subfolder đó
+    with read_zip(client.get(f"/api/folders/{child}/archive", headers=headers)) as zf:
+        assert "Reports/2024/jan.txt" in zf.namelist()
+
+
+def test_folder_archive_checks_ownership_and_existence(client, make_user):
+    _, owner = make_user()
+    _, other = make_user()
+    folder = create_folder(client, owner, "Private")
+    upload(client, owner, "secret.txt", b"secret", folder)
+
+    assert client.get(f"/api/folders/{folder}/archive", headers=other).status_code == 403
+    assert client.get(f"/api/folders/{uuid.uuid4()}/archive", headers=other).status_code == 404
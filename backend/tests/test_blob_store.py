@@ -0,0 +1,112 @@
+import pytest
+
+from blob_store import BlobStore, blob_relative_path, is_blob_path
+from database import FileDatabase
+
+
+@pytest.fixture
+def files_db(tmp_path):
+    return FileDatabase(str(tmp_path / "files.db"))
+
+
+@pytest.fixture
+def blobs(tmp_path, files_db):
+    return BlobStore(tmp_path / "remote_uploads", files_db)
+
+
+def store_file(files_db, blobs, content, name="a.bin", user_id=1):
+    """Ghi content vào kho và thêm dòng files trỏ tới blob như upload_file; trả về (file_id, blob_path)"""
+    writer = blobs.open_writer()
+    writer.write(content)
+    with blobs.store(writer) as blob_path:
+        file_id = files_db.add_file(name, name, len(content), user_id=user_id)
+        files_db.update_file_status(file_id, "completed", blob_path)
+    return file_id, blob_path
+
+
+def refcount(files_db, blob_path):
+    with files_db.pool.connect() as conn:
+        row = conn.execute("SELECT refcount FROM blobs WHERE path = ?", (blob_path,)).fetchone()
+    return row[0] if row else None
+
+
+def test_identical_content_is_stored_once(files_db, blobs):
+    first_id, first_path = store_file(files_db, blobs, b"same content", "a.bin")
+    second_id, second_path = store_file(files_db, blobs, b"same content", "b.bin", user_id=2)
+
+    assert first_id != second_id
+    assert first_path == second_path
+    assert is_blob_path(first_path)
+    assert refcount(files_db, first_path) == 2
+    # File tạm của lần ghi trùng đã bị bỏ
+    assert list(blobs.temp_dir.iterdir()) == []
+
+
+def test_blob_survives_until_last_reference_is_gone(files_db, blobs):
+    first_id, blob_path = store_file(files_db, blobs, b"shared")
+    second_id, _ = store_file(files_db, blobs, b"shared")
+    physical = blobs.upload_folder / blob_path
+
+    files_db.delete_file(first_id)
+    assert refcount(files_db, blob_path) == 1
+    assert blobs.collect() == 0
+    assert physical.exists()
+
+    # Trong thùng rác vẫn giữ tham chiếu; xóa vĩnh viễn mới về 0
+    files_db.move_to_recycle_bin(second_id, deleted_by_user_id=1)
+    assert refcount(files_db, blob_path) == 1
+    assert blobs.collect() == 0
+    with files_db.pool.connect() as conn:
+        recycle_id = conn.execute("SELECT id FROM recycle_bin WHERE original_file_id = ?", (second_id,)).fetchone()[0]
+    assert files_db.permanently_delete_from_recycle(recycle_id) == (True, blob_path)
+    assert refcount(files_db, blob_path) == 0
+
+    assert blobs.collect() == 1
+    assert not physical.exists()
+    assert refcount(files_db, blob_path) is None
+
+
+def test_restore_from_recycle_bin_keeps_blob(files_db, blobs):
+    file_id, blob_path = store_file(files_db, blobs, b"restore me")
+    files_db.move_to_recycle_bin(file_id, deleted_by_user_id=1)
+    with files_db.pool.connect() as conn:
+        recycle_id = conn.execute("SELECT id FROM recycle_bin WHERE original_file_id = ?", (file_id,)).fetchone()[0]
+    assert files_db.restore_from_recycle_bin(recycle_id)
+    assert refcount(files_db, blob_path) == 1
+    assert blobs.collect() == 0
+    assert (blobs.upload_folder / blob_path).read_bytes() == b"restore me"
+
+
+def test_failed_metadata_write_returns_content_to_temp_file(files_db, blobs):
+    writer = blobs.open_writer()
+    writer.write(b"rolled back")
+    expected_path = blob_relative_path(writer.hexdigest())
+    with pytest.raises(RuntimeError):
+        with blobs.store(writer):
+            raise RuntimeError("insert failed")
+
+    assert not (blobs.upload_folder / expected_path).exists()
+    assert writer.temp_path.read_bytes() == b"rolled back"
+    assert refcount(files_db, expected_path) is None
+
+
+def test_remove_files_deletes_legacy_paths_and_collects_blobs(files_db, blobs):
+    legacy = blobs.upload_folder / "alice" / "old.txt"
+    legacy.parent.mkdir(parents=True)
+    legacy.write_bytes(b"legacy")
+    file_id, blob_path = store_file(files_db, blobs, b"blob")
+    files_db.delete_file(file_id)
+
+    blobs.remove_files(["alice/old.txt", blob_path, None])
+
+    assert not legacy.exists()
+    assert not (blobs.upload_folder / blob_path).exists()
+
+
+def test_rebuild_refcounts_matches_triggers(files_db, blobs):
+    _, blob_path = store_file(files_db, blobs, b"counted")
+    store_file(files_db, blobs, b"counted")
+    with files_db.pool.connect() as conn:
+        conn.execute("UPDATE blobs SET refcount = 0")
+    files_db.rebuild_blob_refcounts()
+    assert refcount(files_db, blob_path) == 2
@@ -0,0 +1,61 @@
+import pytest
+
+from database import FileDatabase
+
+
+@pytest.fixture
+def files_db(tmp_path):
+    return FileDatabase(str(tmp_path / "files.db"))
+
+
+def add_completed(files_db, name, user_id=1):
+    file_id = files_db.add_file(name, name, 10, user_id=user_id)
+    files_db.update_file_status(file_id, "completed", f"user/{name}")
+    return file_id
+
+
+def fail_on(files_db, sql):
+    with files_db.pool.connect() as conn:
+        conn.execute(sql)
+
+
+def count(files_db, sql, *params):
+    with files_db.pool.connect() as conn:
+        return conn.execute(sql, params).fetchone()[0]
+
+
+def test_move_to_recycle_bin_rolls_back_only_the_failed_item(files_db):
+    ids = [add_completed(files_db, name) for name in ("a.txt", "b.txt", "c.txt")]
+    failing = ids[1]
+    # INSERT vào recycle_bin thành công rồi DELETE khỏi files lỗi: phần đã ghi của file này phải bị hoàn tác
+    fail_on(files_db, f"""
+        CREATE TRIGGER fail_delete BEFORE DELETE ON files WHEN old.id = {failing}
+        BEGIN SELECT RAISE(ABORT, 'delete failed'); END
+    """)
+
+    results = files_db.move_files_to_recycle_bin(ids, deleted_by_user_id=1)
+
+    assert results == {ids[0]: True, failing: False, ids[2]: True}
+    assert count(files_db, "SELECT COUNT(*) FROM files WHERE id = ?", failing) == 1
+    assert count(files_db, "SELECT COUNT(*) FROM recycle_bin WHERE original_file_id = ?", failing) == 0
+    assert count(files_db, "SELECT COUNT(*) FROM recycle_bin") == 2
+    assert count(files_db, "SELECT COUNT(*) FROM files") == 1
+
+
+def test_restore_many_rolls_back_only_the_failed_item(files_db):
+    ids = [add_completed(files_db, name) for name in ("a.txt", "b.txt")]
+    files_db.move_files_to_recycle_bin(ids, deleted_by_user_id=1)
+    with files_db.pool.connect() as conn:
+        recycle_ids = [row[0] for row in conn.execute("SELECT id FROM recycle_bin ORDER BY id")]
+    failing = recycle_ids[0]
+    # INSERT lại vào files thành công rồi UPDATE recycle_bin lỗi
+    fail_on(files_db, f"""
+        CREATE TRIGGER fail_restore BEFORE UPDATE OF status ON recycle_bin WHEN old.id = {failing}
+        BEGIN SELECT RAISE(ABORT, 'update failed'); END
+    """)
+
+    results = files_db.restore_many_from_recycle_bin(recycle_ids)
+
+    assert results == {failing: False, recycle_ids[1]: True}
+    assert count(files_db, "SELECT COUNT(*) FROM files") == 1
+    assert count(files_db, "SELECT COUNT(*) FROM recycle_bin WHERE status = 'in_recycle'") == 1
@@ -0,0 +1,66 @@
+import sqlite3
+
+import pytest
+
+from db_pool import ConnectionPool
+
+
+@pytest.fixture
+def pool(tmp_path):
+    pool = ConnectionPool(str(tmp_path / "pool.db"))
+    with pool.connect() as conn:
+        conn.execute("CREATE TABLE items (name TEXT UNIQUE)")
+    yield pool
+    pool.close()
+
+
+def names(pool):
+    with pool.connect() as conn:
+        return sorted(row[0] for row in conn.execute("SELECT name FROM items"))
+
+
+def inner_insert(pool, *values):
+    """Giống các method của FileDatabase: bắt lỗi bên ngoài khối with và trả False"""
+    try:
+        with pool.connect() as conn:
+            for value in values:
+                conn.execute("INSERT INTO items VALUES (?)", (value,))
+        return True
+    except sqlite3.Error:
+        return False
+
+
+def test_failed_nested_call_undoes_only_its_own_writes(pool):
+    with pool.connect() as conn:
+        conn.execute("INSERT INTO items VALUES ('outer')")
+        assert inner_insert(pool, "a") is True
+        # "b" được ghi rồi "a" trùng UNIQUE: cả "b" phải bị hoàn tác
+        assert inner_insert(pool, "b", "a") is False
+        assert inner_insert(pool, "c") is True
+    assert names(pool) == ["a", "c", "outer"]
+
+
+def test_outer_failure_rolls_back_nested_writes(pool):
+    with pytest.raises(RuntimeError):
+        with pool.connect():
+            assert inner_insert(pool, "a") is True
+            raise RuntimeError("boom")
+    assert names(pool) == []
+
+
+def test_nested_first_write_does_not_commit_early(pool):
+    # Lời gọi trong ghi trước khi lời gọi ngoài ghi gì: RELEASE không được commit riêng phần này
+    with pytest.raises(RuntimeError):
+        with pool.connect() as conn:
+            assert not conn.in_transaction
+            assert inner_insert(pool, "a") is True
+            raise RuntimeError("boom")
+    assert names(pool) == []
+
+
+def test_nested_calls_share_connection_and_restore_row_factory(pool):
+    with pool.connect() as outer:
+        with pool.connect() as inner:
+            assert inner is outer
+            inner.row_factory = sqlite3.Row
+        assert outer.row_factory is None
@@ -0,0 +1,119 @@
+import os
+
+import pytest
+from flask import Flask
+
+from file_serving import RANGE_MAX_PARTS, content_disposition, serve_file
+
+DATA = os.urandom(10_000)
+
+
+@pytest.fixture
+def client(tmp_path):
+    path = tmp_path / "data.bin"
+    path.write_bytes(DATA)
+    app = Flask(__name__)
+
+    @app.route("/file")
+    def download():
+        return serve_file(path, "data.bin")
+
+    @app.route("/hashed")
+    def hashed():
+        return serve_file(path, "data.bin", content_hash="sha256:abc")
+
+    return app.test_client()
+
+
+def test_full_file(client):
+    response = client.get("/file")
+    assert response.status_code == 200
+    assert response.data == DATA
+    assert response.headers["Content-Length"] == str(len(DATA))
+    assert response.headers["Accept-Ranges"] == "bytes"
+    assert response.headers["ETag"]
+
+
+def test_single_range(client):
+    response = client.get("/file", headers={"Range": "bytes=100-199"})
+    assert response.status_code == 206
+    assert response.data == DATA[100:200]
+    assert response.headers["Content-Range"] == f"bytes 100-199/{len(DATA)}"
+    assert response.headers["Content-Length"] == "100"
+
+
+@pytest.mark.parametrize("header, expected", [
+    ("bytes=-500", DATA[-500:]),
+    ("bytes=9500-", DATA[9500:]),
+    ("bytes=9000-99999", DATA[9000:]),
+])
+def test_suffix_and_open_ended_ranges(client, header, expected):
+    response = client.get("/file", headers={"Range": header})
+    assert response.status_code == 206
+    assert response.data == expected
+
+
+def test_multiple_ranges_are_multipart(client):
+    response = client.get("/file", headers={"Range": "bytes=0-9,100-109"})
+    assert response.status_code == 206
+    assert response.mimetype == "multipart/byteranges"
+    body = response.data
+    assert int(response.headers["Content-Length"]) == len(body)
+    assert f"Content-Range: bytes 0-9/{len(DATA)}".encode() in body
+    assert f"Content-Range: bytes 100-109/{len(DATA)}".encode() in body
+    assert DATA[0:10] in body and DATA[100:110] in body
+
+
+def test_adjacent_ranges_are_merged(client):
+    response = client.get("/file", headers={"Range": "bytes=0-99,100-149"})
+    assert response.status_code == 206
+    assert response.data == DATA[0:150]
+
+
+def test_too_many_ranges_returns_whole_file(client):
+    ranges = ",".join(f"{i * 100}-{i * 100 + 9}" for i in range(RANGE_MAX_PARTS + 1))
+    response = client.get("/file", headers={"Range": f"bytes={ranges}"})
+    assert response.status_code == 200
+    assert response.data == DATA
+
+
+def test_unsatisfiable_range(client):
+    response = client.get("/file", headers={"Range": f"bytes={len(DATA)}-"})
+    assert response.status_code == 416
+    assert response.headers["Content-Range"] == f"bytes */{len(DATA)}"
+
+
+def test_if_none_match_returns_304(client):
+    etag = client.get("/file").headers["ETag"]
+    response = client.get("/file", headers={"If-None-Match": etag})
+    assert response.status_code == 304
+    assert response.data == b""
+    assert response.headers["ETag"] == etag
+
+
+def test_if_modified_since_returns_304(client):
+    last_modified = client.get("/file").headers["Last-Modified"]
+    assert client.get("/file", headers={"If-Modified-Since": last_modified}).status_code == 304
+
+
+def test_if_range_with_stale_etag_returns_whole_file(client):
+    response = client.get("/file", headers={"Range": "bytes=0-9", "If-Range": '"stale"'})
+    assert response.status_code == 200
+    assert response.data == DATA
+
+
+def test_if_range_with_current_etag_honours_range(client):
+    etag = client.get("/file").headers["ETag"]
+    response = client.get("/file", headers={"Range": "bytes=0-9", "If-Range": etag})
+    assert response.status_code == 206
+    assert response.data == DATA[:10]
+
+
+def test_etag_uses_content_hash(client):
+    assert client.get("/hashed").headers["ETag"].startswith('"sha256-abc-')
+
+
+def test_content_disposition_unicode_name():
+    header = content_disposition("attachment", "Báo cáo.pdf")
+    assert 'filename="Bao cao.pdf"' in header
+    assert "filename*=UTF-8''B%C3%A1o%20c%C3%A1o.pdf" in header
@@ -0,0 +1,37 @@
+import uuid
+
+from maintenance import MaintenanceScheduler
+
+
+def test_import_does_not_start_the_scheduler(file_manager):
+    assert not file_manager.maintenance.running
+
+
+def test_cli_command_runs_jobs_in_foreground(file_manager, monkeypatch):
+    scheduler = MaintenanceScheduler()
+    runs = []
+
+    def job():
+        runs.append(scheduler.running)
+        scheduler.stop()
+
+    scheduler.add_job("once", 0.01, job)
+    monkeypatch.setattr(file_manager, "maintenance", scheduler)
+
+    result = file_manager.app.test_cli_runner().invoke(args=["maintenance"])
+
+    assert result.exit_code == 0, result.output
+    assert runs == [True]
+    assert not scheduler.running
+    assert scheduler.status()[0]["last_error"] is None
+
+
+def test_status_endpoint_reports_whether_jobs_run_here(client, file_manager):
+    admin_id = file_manager.auth_db.create_user(f"admin_{uuid.uuid4().hex[:10]}", "secret123", role="admin")
+    headers = {"Authorization": f"Bearer {file_manager.auth_db.create_session(admin_id)}"}
+
+    response = client.get("/api/admin/maintenance", headers=headers)
+
+    assert response.status_code == 200
+    assert response.get_json()["running"] is False
+    assert {job["name"] for job in response.get_json()["jobs"]}
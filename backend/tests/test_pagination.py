@@ -0,0 +1,53 @@
+import pytest
+
+from database import FileDatabase
+
+
+@pytest.fixture
+def files_db(tmp_path):
+    files_db = FileDatabase(str(tmp_path / "files.db"))
+    # Trùng size để kiểm tra id làm khóa phụ khi giá trị sort bằng nhau
+    for i, size in enumerate([30, 10, 20, 10, 30, 10, 50]):
+        name = f"file{i}.txt"
+        file_id = files_db.add_file(name, name, size, user_id=1)
+        files_db.update_file_status(file_id, "completed", f"user/{name}")
+    other = files_db.add_file("other.txt", "other.txt", 10, user_id=2)
+    files_db.update_file_status(other, "completed", "other/other.txt")
+    return files_db
+
+
+def all_pages(files_db, **kwargs):
+    pages, cursor = [], None
+    while True:
+        files, cursor = files_db.get_user_files_page(1, limit=3, cursor=cursor, **kwargs)
+        pages.append(files)
+        if cursor is None:
+            return pages
+
+
+@pytest.mark.parametrize("sort, column", [("size", "size"), ("name", "original_filename"), ("date", "created_at")])
+@pytest.mark.parametrize("order", ["asc", "desc"])
+def test_pages_cover_every_file_once_in_order(files_db, sort, column, order):
+    pages = all_pages(files_db, sort=sort, order=order)
+    rows = [f for page in pages for f in page]
+
+    assert [len(page) for page in pages] == [3, 3, 1]
+    keys = [(f[column], f["id"]) for f in rows]
+    assert keys == sorted(keys, reverse=order == "desc")
+    assert len({f["id"] for f in rows}) == 7
+    assert {f["user_id"] for f in rows} == {1}
+
+
+def test_cursor_skips_rows_deleted_between_pages(files_db):
+    first, cursor = files_db.get_user_files_page(1, sort="size", order="asc", limit=3)
+    files_db.delete_file(first[0]["id"])
+
+    second, _ = files_db.get_user_files_page(1, sort="size", order="asc", limit=3, cursor=cursor)
+
+    assert not {f["id"] for f in first} & {f["id"] for f in second}
+
+
+@pytest.mark.parametrize("kwargs", [{"sort": "owner"}, {"order": "sideways"}, {"cursor": "%%%"}])
+def test_invalid_arguments(files_db, kwargs):
+    with pytest.raises(ValueError):
+        files_db.get_user_files_page(1, **kwargs)
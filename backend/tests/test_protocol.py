@@ -0,0 +1,47 @@
+import pytest
+
+from protocol import CHUNK_HEADER, decode_chunk_frame, encode_chunk_frame
+
+
+def test_round_trip():
+    data = bytes(range(256)) * 4
+    frame = encode_chunk_frame("file-1", 123456789012, data)
+    file_id, offset, payload = decode_chunk_frame(frame)
+    assert file_id == "file-1"
+    assert offset == 123456789012
+    assert bytes(payload) == data
+
+
+def test_header_layout_matches_frontend():
+    # frontend/script.js encodeChunkFrame: uint16 id length | uint64 offset | uint32 data length (big-endian)
+    frame = encode_chunk_frame("ab", 5, b"xyz")
+    assert CHUNK_HEADER.size == 14
+    assert frame == b"\x00\x02" + (5).to_bytes(8, "big") + (3).to_bytes(4, "big") + b"ab" + b"xyz"
+
+
+def test_unicode_file_id_and_empty_data():
+    frame = encode_chunk_frame("tệp-ü", 0, b"")
+    file_id, offset, payload = decode_chunk_frame(frame)
+    assert (file_id, offset, bytes(payload)) == ("tệp-ü", 0, b"")
+
+
+def test_payload_is_view_without_copy():
+    frame = encode_chunk_frame("f", 0, b"abc")
+    _, _, payload = decode_chunk_frame(frame)
+    assert isinstance(payload, memoryview)
+    assert payload.obj is frame
+
+
+@pytest.mark.parametrize("frame", [
+    b"",
+    b"\x00" * (CHUNK_HEADER.size - 1),
+    # id rỗng
+    CHUNK_HEADER.pack(0, 0, 0),
+    # data length khai báo dài hơn thực tế
+    CHUNK_HEADER.pack(1, 0, 10) + b"f" + b"abc",
+    # thừa byte sau data
+    CHUNK_HEADER.pack(1, 0, 3) + b"f" + b"abcd",
+])
+def test_malformed_frames_rejected(frame):
+    with pytest.raises(ValueError):
+        decode_chunk_frame(frame)
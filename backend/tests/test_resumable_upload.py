@@ -0,0 +1,247 @@
+import hashlib
+import os
+import threading
+import time
+
+import pytest
+
+DATA = os.urandom(300_000)
+
+
+def create(client, headers, size=len(DATA), **extra):
+    response = client.post("/api/uploads", headers={
+        **headers, "X-File-Name": "report.bin", "X-File-Size": str(size), **extra,
+    })
+    assert response.status_code in (200, 201), response.get_json()
+    return response
+
+
+def patch(client, headers, upload_id, offset, body):
+    return client.patch(f"/api/uploads/{upload_id}", data=body,
+                        headers={**headers, "Upload-Offset": str(offset)})
+
+
+def finalize_with_timeout(client, headers, upload_id, timeout=5.0):
+    """finalize chạy trên thread riêng: nếu request bị treo (deadlock) test fail thay vì treo cả suite"""
+    result = {}
+    thread = threading.Thread(
+        target=lambda: result.setdefault("response", client.post(f"/api/uploads/{upload_id}/finalize",
+                                                                 headers=headers)),
+        daemon=True)
+    thread.start()
+    thread.join(timeout)
+    assert not thread.is_alive(), "finalize did not return (deadlock?)"
+    return result["response"]
+
+
+def test_upload_lifecycle(client, make_user):
+    _, headers = make_user()
+    response = create(client, headers, **{"X-File-ID": "client-1"})
+    assert response.status_code == 201
+    upload_id = response.get_json()["upload_id"]
+    assert response.headers["Upload-Offset"] == "0"
+
+    # Cùng X-File-ID: dùng lại phiên đang dở
+    again = create(client, headers, **{"X-File-ID": "client-1"})
+    assert again.status_code == 200
+    assert again.get_json()["upload_id"] == upload_id
+
+    assert patch(client, headers, upload_id, 0, DATA[:100_000]).get_json()["offset"] == 100_000
+
+    # Sai offset -> 409 kèm offset đúng
+    mismatch = patch(client, headers, upload_id, 50_000, DATA[50_000:150_000])
+    assert mismatch.status_code == 409
+    assert mismatch.get_json()["offset"] == 100_000
+
+    head = client.head(f"/api/uploads/{upload_id}", headers=headers)
+    assert head.headers["Upload-Offset"] == "100000"
+
+    incomplete = finalize_with_timeout(client, headers, upload_id)
+    assert incomplete.status_code == 400
+    assert incomplete.get_json()["offset"] == 100_000
+
+    too_big = patch(client, headers, upload_id, 100_000, DATA[100_000:] + b"extra")
+    assert too_big.status_code == 413
+
+    assert patch(client, headers, upload_id, 100_000, DATA[100_000:]).get_json()["offset"] == len(DATA)
+
+    done = finalize_with_timeout(client, headers, upload_id)
+    assert done.status_code == 200
+    body = done.get_json()
+    assert body["success"] is True
+    file_id = body["file_id"]
+    assert file_id
+
+    # finalize gọi lại trả cùng kết quả
+    assert finalize_with_timeout(client, headers, upload_id).get_json()["file_id"] == file_id
+
+    download = client.get(f"/api/files/{file_id}/download", headers=headers)
+    assert download.status_code == 200
+    assert download.data == DATA
+
+
+def test_other_user_cannot_touch_upload(client, make_user):
+    _, owner = make_user()
+    _, other = make_user()
+    upload_id = create(client, owner).get_json()["upload_id"]
+    assert client.get(f"/api/uploads/{upload_id}", headers=other).status_code == 403
+    assert patch(client, other, upload_id, 0, DATA).status_code == 403
+    assert client.delete(f"/api/uploads/{upload_id}", headers=other).status_code == 403
+
+
+def test_expected_hash_verified(client, make_user):
+    _, headers = make_user()
+    digest = hashlib.sha256(DATA).hexdigest()
+    upload_id = create(client, headers, **{"X-Content-Hash": f"sha256:{digest}"}).get_json()["upload_id"]
+    patch(client, headers, upload_id, 0, DATA)
+    response = finalize_with_timeout(client, headers, upload_id)
+    assert response.status_code == 200
+    assert response.get_json()["content_hash"] == f"sha256:{digest}"
+
+
+def test_hash_mismatch_aborts_without_deadlock(client, make_user):
+    _, headers = make_user()
+    upload_id = create(client, headers, **{"X-Content-Hash": "sha256:" + "0" * 64}).get_json()["upload_id"]
+    assert patch(client, headers, upload_id, 0, DATA).get_json()["offset"] == len(DATA)
+
+    response = finalize_with_timeout(client, headers, upload_id)
+    assert response.status_code == 400
+    assert response.get_json()["error"] == "Content hash mismatch"
+
+    # Phiên đã bị bỏ, các request sau không bị chặn bởi lease của phiên
+    assert client.get(f"/api/uploads/{upload_id}", headers=headers).status_code == 404
+    assert patch(client, headers, upload_id, 0, DATA).status_code == 404
+    assert finalize_with_timeout(client, headers, upload_id).status_code == 404
+
+
+def test_finalize_after_abort_is_not_found(client, make_user, file_manager):
+    _, headers = make_user()
+    upload_id = create(client, headers).get_json()["upload_id"]
+    patch(client, headers, upload_id, 0, DATA)
+    assert client.delete(f"/api/uploads/{upload_id}", headers=headers).status_code == 200
+    assert not file_manager.resumable.data_path(upload_id).exists()
+    assert finalize_with_timeout(client, headers, upload_id).status_code == 404
+
+
+def test_finalize_rejects_inactive_session(client, make_user, file_manager):
+    _, headers = make_user()
+    upload_id = create(client, headers).get_json()["upload_id"]
+    patch(client, headers, upload_id, 0, DATA)
+    with file_manager.db.pool.connect() as conn:
+        conn.execute("UPDATE uploads SET status = 'expired' WHERE id = ?", (upload_id,))
+    response = finalize_with_timeout(client, headers, upload_id)
+    assert response.status_code == 409
+    assert "file_id" not in response.get_json()
+
+
+def count_files(file_manager, user_id):
+    with file_manager.db.pool.connect() as conn:
+        return conn.execute("SELECT COUNT(*) FROM files WHERE user_id = ?", (user_id,)).fetchone()[0]
+
+
+def test_patch_and_finalize_wait_for_a_lease_held_elsewhere(client, make_user, file_manager):
+    user_id, headers = make_user()
+    upload_id = create(client, headers).get_json()["upload_id"]
+    assert patch(client, headers, upload_id, 0, DATA[:100_000]).status_code == 200
+
+    # Request ở worker khác đang giữ phiên
+    lease = file_manager.resumable.claim(upload_id)
+    assert lease
+    busy = patch(client, headers, upload_id, 100_000, DATA[100_000:])
+    assert busy.status_code == 409
+    assert busy.get_json() == {"error": "Upload is busy", "offset": 100_000}
+    assert file_manager.resumable.data_path(upload_id).stat().st_size == 100_000
+    file_manager.resumable.release(upload_id, lease)
+
+    assert patch(client, headers, upload_id, 100_000, DATA[100_000:]).get_json()["offset"] == len(DATA)
+    lease = file_manager.resumable.claim(upload_id)
+    assert finalize_with_timeout(client, headers, upload_id).status_code == 409
+    file_manager.resumable.release(upload_id, lease)
+
+    done = finalize_with_timeout(client, headers, upload_id)
+    assert done.status_code == 200
+    assert count_files(file_manager, user_id) == 1
+    assert finalize_with_timeout(client, headers, upload_id).get_json()["file_id"] == done.get_json()["file_id"]
+    assert count_files(file_manager, user_id) == 1
+
+
+def test_expired_lease_can_be_taken_over(client, make_user, file_manager):
+    _, headers = make_user()
+    upload_id = create(client, headers).get_json()["upload_id"]
+    assert file_manager.resumable.claim(upload_id)
+    # Worker giữ lease đã chết: lease hết hạn
+    with file_manager.db.pool.connect() as conn:
+        conn.execute("UPDATE uploads SET lease_until = 0 WHERE id = ?", (upload_id,))
+
+    assert patch(client, headers, upload_id, 0, DATA).get_json()["offset"] == len(DATA)
+    assert finalize_with_timeout(client, headers, upload_id).status_code == 200
+
+
+def test_finalize_that_lost_its_lease_rolls_back(client, make_user, file_manager, monkeypatch):
+    user_id, headers = make_user()
+    data = os.urandom(50_000)
+    upload_id = create(client, headers, size=len(data)).get_json()["upload_id"]
+    patch(client, headers, upload_id, 0, data)
+    finalize = file_manager.resumable.finalize
+
+    def finalize_then_lose_lease(upload):
+        result = finalize(upload)
+        # Lease hết hạn và bị worker khác lấy trước khi complete_upload chạy
+        with file_manager.db.pool.connect() as conn:
+            conn.execute("UPDATE uploads SET lease_token = 'other' WHERE id = ?", (upload_id,))
+        return result
+
+    monkeypatch.setattr(file_manager.resumable, "finalize", finalize_then_lose_lease)
+    response = finalize_with_timeout(client, headers, upload_id)
+
+    assert response.status_code == 409
+    assert count_files(file_manager, user_id) == 0
+    assert file_manager.db.get_upload(upload_id)["status"] == "active"
+    # Blob vừa đặt được trả về file dữ liệu của phiên
+    assert file_manager.resumable.data_path(upload_id).read_bytes() == data
+    digest = hashlib.sha256(data).hexdigest()
+    with file_manager.db.pool.connect() as conn:
+        assert conn.execute("SELECT COUNT(*) FROM blobs WHERE path LIKE ?", (f"%{digest}",)).fetchone()[0] == 0
+
+
+def test_patch_stops_writing_when_its_lease_is_taken(client, make_user, file_manager, monkeypatch):
+    import resumable_upload
+
+    _, headers = make_user()
+    upload_id = create(client, headers).get_json()["upload_id"]
+    monkeypatch.setattr(resumable_upload, "UPLOAD_LEASE_SECONDS", 0.03)
+
+    class SlowStream:
+        """Client chậm: sau khối đầu, lease hết hạn và bị worker khác lấy"""
+        def __init__(self):
+            self.blocks = [DATA[:1000], DATA[1000:2000]]
+
+        def read(self, size):
+            if len(self.blocks) == 1:
+                time.sleep(0.05)
+                with file_manager.db.pool.connect() as conn:
+                    conn.execute("UPDATE uploads SET lease_token = 'other' WHERE id = ?", (upload_id,))
+            return self.blocks.pop(0) if self.blocks else b""
+
+    with pytest.raises(resumable_upload.UploadBusy):
+        file_manager.resumable.append({"id": upload_id}, 0, SlowStream())
+
+    assert file_manager.resumable.data_path(upload_id).stat().st_size == 1000
+    assert file_manager.db.get_upload(upload_id)["upload_offset"] == 0
+
+
+def test_json_body_create_accepts_unicode_name(client, make_user, file_manager):
+    _, headers = make_user()
+    response = client.post("/api/uploads", headers=headers,
+                           json={"file_name": "Báo cáo.bin", "file_size": 10, "file_id": "abc"})
+    assert response.status_code == 201
+    upload = file_manager.db.get_upload(response.get_json()["upload_id"])
+    assert upload["file_name"] == "Báo cáo.bin"
+    assert upload["client_file_id"] == "abc"
+
+
+@pytest.mark.parametrize("size", ["0", "abc"])
+def test_create_rejects_bad_size(client, make_user, size):
+    _, headers = make_user()
+    response = client.post("/api/uploads", headers={**headers, "X-File-Name": "a", "X-File-Size": size})
+    assert response.status_code == 400
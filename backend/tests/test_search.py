@@ -0,0 +1,95 @@
+import sqlite3
+
+import pytest
+
+from database import FileDatabase, build_search_query
+
+
+@pytest.fixture
+def files_db(tmp_path):
+    return FileDatabase(str(tmp_path / "files.db"))
+
+
+def add_completed(files_db, name, user_id=1, folder_id=None):
+    file_id = files_db.add_file(name, name, 10, user_id=user_id, folder_id=folder_id)
+    files_db.update_file_status(file_id, "completed", f"user/{name}")
+    return file_id
+
+
+def names(files):
+    return [f["original_filename"] for f in files]
+
+
+def test_query_is_scoped_to_owner():
+    assert build_search_query("Báo  đề-án", 7) == 'owner : "u7" AND {name folder_path} : ("Báo"* "dề"* "án"*)'
+    assert build_search_query(" _-! ", 7) is None
+
+
+def test_prefix_and_diacritic_insensitive_match(files_db):
+    add_completed(files_db, "Báo_cáo_tháng_5.pdf")
+    add_completed(files_db, "Đề án.docx")
+    add_completed(files_db, "notes.txt")
+
+    assert names(files_db.search_user_files(1, "bao cao")[0]) == ["Báo_cáo_tháng_5.pdf"]
+    assert names(files_db.search_user_files(1, "de AN")[0]) == ["Đề án.docx"]
+    assert files_db.search_user_files(1, "missing")[0] == []
+
+
+def test_other_users_files_are_not_matched(files_db):
+    add_completed(files_db, "report.pdf", user_id=1)
+    add_completed(files_db, "report.pdf", user_id=2)
+    # Tên chứa đúng token owner của user 1 vẫn không lọt vào kết quả của user 1
+    add_completed(files_db, "u1 report.pdf", user_id=2)
+
+    files, _ = files_db.search_user_files(1, "report")
+    assert [f["user_id"] for f in files] == [1]
+
+
+def test_name_match_ranks_above_folder_match(files_db):
+    files_db.add_folder("f1", "invoice", "invoice", None, 1, "user")
+    add_completed(files_db, "scan.pdf", folder_id="f1")
+    add_completed(files_db, "invoice.pdf")
+
+    assert names(files_db.search_user_files(1, "invoice")[0]) == ["invoice.pdf", "scan.pdf"]
+
+
+def test_pagination_is_stable_while_index_changes(files_db):
+    for i in range(5):
+        add_completed(files_db, f"report {i}.txt")
+    for i in range(20):
+        add_completed(files_db, f"photo {i}.jpg")
+
+    first, cursor = files_db.search_user_files(1, "report", limit=2)
+    assert len(first) == 2 and cursor
+    # Upload mới (của user này và user khác) làm thay đổi bm25 nhưng không được làm lệch trang
+    add_completed(files_db, "report report report.txt")
+    for i in range(10):
+        add_completed(files_db, f"report {i}.txt", user_id=2)
+
+    seen = list(first)
+    while cursor:
+        page, cursor = files_db.search_user_files(1, "report", limit=2, cursor=cursor)
+        seen.extend(page)
+    assert sorted(names(seen)) == [f"report {i}.txt" for i in range(5)]
+
+
+@pytest.mark.parametrize("cursor", ["not-a-cursor", "WzEuNSwyXQ", "WzFd"])
+def test_invalid_cursor(files_db, cursor):
+    add_completed(files_db, "report.txt")
+    with pytest.raises(ValueError):
+        files_db.search_user_files(1, "report", cursor=cursor)
+
+
+def test_legacy_index_without_owner_is_rebuilt(tmp_path):
+    path = str(tmp_path / "files.db")
+    files_db = FileDatabase(path)
+    add_completed(files_db, "report.txt")
+    with sqlite3.connect(path) as conn:
+        conn.execute("DROP TABLE files_fts")
+        conn.execute("CREATE VIRTUAL TABLE files_fts USING fts5(name, folder_path)")
+
+    files_db = FileDatabase(path)
+
+    assert names(files_db.search_user_files(1, "report")[0]) == ["report.txt"]
+    add_completed(files_db, "report 2.txt")
+    assert len(files_db.search_user_files(1, "report")[0]) == 2
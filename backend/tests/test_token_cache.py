@@ -0,0 +1,79 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+import token_cache
+from token_cache import TokenCache
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1_000_000.0]
+    monkeypatch.setattr(token_cache.time, "time", lambda: now[0])
+    return now
+
+
+def user(user_id, **extra):
+    return {"id": user_id, "username": f"user{user_id}", **extra}
+
+
+def test_hit_returns_a_copy(clock):
+    cache = TokenCache(maxsize=4, ttl=60)
+    cache.put("t1", user(1))
+
+    cached = cache.get("t1")
+    cached["username"] = "changed"
+
+    assert cache.get("t1")["username"] == "user1"
+    assert cache.get("missing") is None
+    assert cache.stats()["hits"] == 2 and cache.stats()["misses"] == 1
+
+
+def test_entry_expires_after_ttl(clock):
+    cache = TokenCache(maxsize=4, ttl=60)
+    cache.put("t1", user(1))
+
+    clock[0] += 59
+    assert cache.get("t1") is not None
+    clock[0] += 2
+    assert cache.get("t1") is None
+    assert cache.stats()["size"] == 0
+
+
+def test_entry_never_outlives_the_session(clock):
+    cache = TokenCache(maxsize=4, ttl=60)
+    expires_at = datetime.fromtimestamp(clock[0]) + timedelta(seconds=10)
+    cache.put("t1", user(1, expires_at=expires_at.isoformat()))
+
+    clock[0] += 11
+    assert cache.get("t1") is None
+
+
+def test_least_recently_used_is_evicted(clock):
+    cache = TokenCache(maxsize=2, ttl=60)
+    cache.put("t1", user(1))
+    cache.put("t2", user(2))
+    cache.get("t1")
+    cache.put("t3", user(3))
+
+    assert cache.get("t2") is None
+    assert cache.get("t1") is not None and cache.get("t3") is not None
+
+
+def test_invalidate_user_drops_all_their_tokens(clock):
+    cache = TokenCache(maxsize=4, ttl=60)
+    cache.put("a", user(1))
+    cache.put("b", user(1))
+    cache.put("c", user(2))
+
+    cache.invalidate_user(1)
+
+    assert cache.get("a") is None and cache.get("b") is None
+    assert cache.get("c") is not None
+    assert cache.user_tokens == {2: {"c"}}
+
+
+def test_disabled_cache_stores_nothing(clock):
+    cache = TokenCache(maxsize=4, ttl=0)
+    cache.put("t1", user(1))
+    assert cache.get("t1") is None
@@ -0,0 +1,106 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import Dict, Optional, Set
+
+# Cache token đã xác thực trong process (file manager và WebSocket server mỗi bên một cache)
+TOKEN_CACHE_SIZE = int(os.environ.get("TOKEN_CACHE_SIZE", "4096"))  # số token tối đa (LRU)
+TOKEN_CACHE_TTL = float(os.environ.get("TOKEN_CACHE_TTL", "60"))  # giây; 0 = tắt cache
+
+
+def _expiry_timestamp(expires_at) -> Optional[float]:
+    """expires_at của session (datetime hoặc chuỗi ISO, giờ local) -> epoch; None nếu không đọc được"""
+    if isinstance(expires_at, datetime):
+        return expires_at.timestamp()
+    try:
+        return datetime.fromisoformat(str(expires_at)).timestamp()
+    except (TypeError, ValueError):
+        return None
+
+
+class TokenCache:
+    """LRU + TTL cho kết quả get_user_by_token
+
+    Entry hết hạn ở thời điểm sớm hơn giữa now + ttl và expires_at của session.
+    Thao tác ghi trên process khác (vd. logout qua file manager) chỉ được thấy sau tối đa ttl giây.
+    """
+
+    def __init__(self, maxsize: int = TOKEN_CACHE_SIZE, ttl: float = TOKEN_CACHE_TTL) -> None:
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.entries: "OrderedDict[str, tuple]" = OrderedDict()  # token -> (user, hết hạn lúc)
+        self.user_tokens: Dict[int, Set[str]] = {}  # user_id -> các token đang cache
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.ttl > 0 and self.maxsize > 0
+
+    def get(self, token: str) -> Optional[dict]:
+        with self.lock:
+            entry = self.entries.get(token)
+            if entry is not None:
+                user, expires = entry
+                if expires > time.time():
+                    self.entries.move_to_end(token)
+                    self.hits += 1
+                    return dict(user)
+                self._remove(token)
+            self.misses += 1
+            return None
+
+    def put(self, token: str, user: dict) -> None:
+        if not self.enabled:
+            return
+        expires = time.time() + self.ttl
+        session_expiry = _expiry_timestamp(user.get('expires_at'))
+        if session_expiry is not None:
+            expires = min(expires, session_expiry)
+        with self.lock:
+            self._remove(token)
+            self.entries[token] = (dict(user), expires)
+            self.user_tokens.setdefault(user['id'], set()).add(token)
+            while len(self.entries) > self.maxsize:
+                oldest = next(iter(self.entries))
+                self._remove(oldest)
+
+    def invalidate_token(self, token: str) -> None:
+        with self.lock:
+            self._remove(token)
+
+    def invalidate_user(self, user_id: int) -> None:
+        with self.lock:
+            for token in list(self.user_tokens.get(user_id, ())):
+                self._remove(token)
+
+    def clear(self) -> None:
+        with self.lock:
+            self.entries.clear()
+            self.user_tokens.clear()
+
+    def stats(self) -> dict:
+        with self.lock:
+            total = self.hits + self.misses
+            return {
+                'size': len(self.entries),
+                'maxsize': self.maxsize,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / total, 4) if total else 0.0,
+            }
+
+    def _remove(self, token: str) -> None:
+        entry = self.entries.pop(token, None)
+        if entry is None:
+            return
+        user_id = entry[0]['id']
+        tokens = self.user_tokens.get(user_id)
+        if tokens is not None:
+            tokens.discard(token)
+            if not tokens:
+                del self.user_tokens[user_id]
@@ -6,7 +6,18 @@ class FlexTransferHub {
     this.viewMode = "list"; // "list" hoặc "grid"
     this.ws = null;
     this.wsUrl = window.FLEX_WS_URL || "ws://localhost:8765/ws";
+    // Đường upload: "ws" = qua WS server rồi relay sang file manager, "http" = upload thẳng vào file manager
+    this.uploadTransport =
+      localStorage.getItem("upload_transport") ||
+      window.FLEX_UPLOAD_TRANSPORT ||
+      "ws";
+    this.uploadApiUrl =
+      window.FLEX_UPLOAD_API_URL || "http://localhost:5000/api/uploads";
+    this.httpPatchSize = 8 * 1024 * 1024; // Byte mỗi request PATCH khi upload qua HTTP (tiến độ lấy từ xhr.upload)
+    this.httpRetryLimit = 5; // Số lần thử lại liên tiếp khi mất kết nối trước khi chuyển sang paused
     this.chunkSize = 512 * 1024; // Tăng chunk size lên 512KB để upload nhanh hơn
+    this.uploadWindow = 8; // Số chunk gửi trước khi phải chờ ack (server có thể giảm)
+    this.eventTick = 100; // ms: đề nghị server gộp chunk-ack của mọi file theo tick
     this.lastRenderTime = 0;
     this.renderThrottle = 500; // Giảm throttle xuống 0.5 giây để cập nhật nhanh hơn
     this.maxConcurrentUploads = 5; // Tăng số upload đồng thời từ 2 lên 5
@@ -208,28 +219,41 @@ class FlexTransferHub {
 
     try {
       console.log("Loading previous uploads from backend...");
-      const response = await fetch("http://localhost:5000/api/files", {
-        method: "GET",
-        credentials: "include",
-        headers: {
-          "Content-Type": "application/json",
-          Authorization: `Bearer ${this.authToken}`,
-        },
-      });
-
-      if (response.ok) {
-        const files = await response.json();
-
-        // Only show files from last 2 hours
-        const twoHoursAgo = Date.now() - 2 * 60 * 60 * 1000;
-        const recentFiles = files.filter((file) => {
-          const fileTime = new Date(
-            file.upload_time || file.created_at
-          ).getTime();
-          return fileTime > twoHoursAgo;
+      // Only show files from last 2 hours
+      const twoHoursAgo = Date.now() - 2 * 60 * 60 * 1000;
+      const fileTime = (file) =>
+        new Date(file.upload_time || file.created_at).getTime();
+
+      // Newest first, page by page: stop once a page reaches files older than 2 hours
+      const files = [];
+      let cursor = null;
+      let response;
+      do {
+        let url =
+          "http://localhost:5000/api/files?sort=date&order=desc&limit=100";
+        if (cursor) url += `&cursor=${encodeURIComponent(cursor)}`;
+        response = await fetch(url, {
+          method: "GET",
+          credentials: "include",
+          headers: {
+            "Content-Type": "application/json",
+            Authorization: `Bearer ${this.authToken}`,
+          },
         });
+        if (!response.ok) break;
+        const page = await response.json();
+        files.push(...page.files);
+        const last = page.files[page.files.length - 1];
+        cursor = last && fileTime(last) > twoHoursAgo ? page.next_cursor : null;
+      } while (cursor);
+
+      // A failed later page still shows what was already loaded
+      if (response.ok || files.length) {
+        const recentFiles = files.filter(
+          (file) => fileTime(file) > twoHoursAgo
+        );
 
-        console.log(`[DEBUG] Total files from backend: ${files.length}`);
+        console.log(`[DEBUG] Files fetched from backend: ${files.length}`);
         console.log(`[DEBUG] Files in last 2 hours: ${recentFiles.length}`);
 
         // Convert recent backend files to frontend transfer format
@@ -370,7 +394,7 @@ class FlexTransferHub {
 
     try {
       console.log("Loading recent files from backend...");
-      const response = await fetch("http://localhost:5000/api/files", {
+      const response = await fetch("http://localhost:5000/api/files?sort=date&order=desc&limit=100", {
         method: "GET",
         credentials: "include",
         headers: {
@@ -380,7 +404,7 @@ class FlexTransferHub {
       });
 
       if (response.ok) {
-        const files = await response.json();
+        const files = (await response.json()).files;
         
         // Only show files from last 2 hours or current session
         const twoHoursAgo = Date.now() - (2 * 60 * 60 * 1000);
@@ -596,7 +620,13 @@ class FlexTransferHub {
       this.ws.onclose = () => {
         this.showNotification("Disconnected from upload server", "error");
         this.transfers.forEach((t) => {
-          if (t.type === "upload" && t.status === "active") t.status = "queued";
+          // Upload qua HTTP không phụ thuộc WebSocket
+          if (
+            t.type === "upload" &&
+            t.transport !== "http" &&
+            t.status === "active"
+          )
+            t.status = "queued";
         });
         this.renderTransfers();
 
@@ -728,9 +758,50 @@ class FlexTransferHub {
     }
   }
 
+  // Đợi chunk-ack; resolve(true) khi có ack, resolve(false) khi hết thời gian
+  waitForAck(transfer, timeoutMs) {
+    return new Promise((resolve) => {
+      const timer = setTimeout(() => {
+        transfer._ackWaiter = null;
+        resolve(false);
+      }, timeoutMs);
+      transfer._ackWaiter = () => {
+        clearTimeout(timer);
+        transfer._ackWaiter = null;
+        resolve(true);
+      };
+    });
+  }
+
+  wakeUploadLoop(transfer) {
+    if (transfer && transfer._ackWaiter) transfer._ackWaiter();
+  }
+
+  sendBinary(buffer) {
+    try {
+      if (this.ws && this.ws.readyState === WebSocket.OPEN) {
+        this.ws.send(buffer);
+      }
+    } catch {
+      /* ignore */
+    }
+  }
+
   handleWSMessage(ev) {
+    let msg;
+    try {
+      msg = JSON.parse(ev.data);
+    } catch (error) {
+      console.error("Error parsing WebSocket message:", error, ev.data);
+      return;
+    }
+    // Server gộp các chunk-ack trong một tick (eventTick) thành một message "batch"
+    const events = msg.event === "batch" ? msg.events || [] : [msg];
+    events.forEach((event) => this.handleServerEvent(event));
+  }
+
+  handleServerEvent(msg) {
     try {
-      const msg = JSON.parse(ev.data);
       // Chỉ log các events quan trọng, không log chunk-ack/progress để tránh spam
       if (!["chunk-ack", "progress"].includes(msg.event)) {
         console.log("WebSocket message received:", msg);
@@ -748,6 +819,14 @@ class FlexTransferHub {
           transfer.status = "active";
         }
         transfer.bytesSent = msg.offset || 0;
+        // Server cũ không trả chunkMode/window -> base64, stop-and-wait
+        transfer.chunkMode = msg.chunkMode || "base64";
+        transfer.window = msg.window
+          ? {
+              chunks: Math.max(1, msg.window.chunks || 1),
+              bytes: Math.max(this.chunkSize, msg.window.bytes || 0),
+            }
+          : { chunks: 1, bytes: this.chunkSize };
 
         // Smooth render và start upload
         this.throttledRender();
@@ -770,9 +849,9 @@ class FlexTransferHub {
           transfer.progress = 100;
         }
 
-        // Nếu là chunk-ack, báo hiệu cho uploadLoop tiếp tục
+        // Nếu là chunk-ack, báo hiệu cho uploadLoop tiếp tục (window đã trượt)
         if (msg.event === "chunk-ack") {
-          transfer._waitingForAck = false;
+          this.wakeUploadLoop(transfer);
         }
 
         // Chỉ dùng throttled render cho progress để tránh lag
@@ -788,9 +867,12 @@ class FlexTransferHub {
         }
 
         const expectedOffset = msg.expected || 0;
-        const currentOffset = transfer.bytesSent;
+        const currentOffset =
+          transfer._sendOffset !== undefined
+            ? transfer._sendOffset
+            : transfer.bytesSent;
 
-        // Chỉ xử lý khi có mismatch thực sự
+        // Chỉ xử lý khi có mismatch thực sự (server chỉ báo một lần cho cả window)
         if (expectedOffset !== currentOffset) {
           console.warn(
             `Fixing offset mismatch for ${fileId}: ${currentOffset} → ${expectedOffset}`
@@ -798,9 +880,11 @@ class FlexTransferHub {
 
           // Dừng loop hiện tại ngay lập tức
           transfer._stopCurrentLoop = true;
+          this.wakeUploadLoop(transfer);
 
-          // Cập nhật offset
+          // Cập nhật offset, bỏ các chunk đang bay
           transfer.bytesSent = expectedOffset;
+          transfer._sendOffset = expectedOffset;
           transfer.progress = Math.min(
             100,
             (transfer.bytesSent / Math.max(transfer.size, 1)) * 100
@@ -1079,7 +1163,7 @@ class FlexTransferHub {
         this.renderTransfers();
       }
     } catch (error) {
-      console.error("Error parsing WebSocket message:", error, ev.data);
+      console.error("Error handling WebSocket message:", error, msg);
     }
   }
 
@@ -1099,9 +1183,18 @@ class FlexTransferHub {
     );
     console.log(`Using token: ${this.authToken?.substring(0, 20)}...`);
 
+    // Phiên HTTP đã tạo (retry sau lỗi) giữ nguyên đường upload, các upload mới theo setting
+    if (!transfer.uploadUrl) transfer.transport = this.uploadTransport;
+
     // Update UI immediately to show correct buttons
     this.renderTransfers();
 
+    if (transfer.transport === "http") {
+      transfer._offsetUnknown = true; // Hỏi lại offset của phiên cũ (nếu có) trước khi gửi
+      this.httpUploadLoop(transfer);
+      return;
+    }
+
     await this.ensureSocketOpen();
     this.send({
       action: "start",
@@ -1110,6 +1203,9 @@ class FlexTransferHub {
       fileSize: transfer.size,
       authToken: this.authToken, // Gửi auth token
       user_id: this.currentUser?.id, // Gửi user ID
+      chunkMode: "binary", // Đề nghị gửi chunk bằng binary frame
+      window: this.uploadWindow, // Đề nghị kích thước sliding window
+      eventTick: this.eventTick, // Đề nghị gộp ack/progress theo tick
     });
   }
 
@@ -1164,61 +1260,47 @@ class FlexTransferHub {
         return;
       }
 
+      // Sliding window: gửi tối đa window.chunks chunk / window.bytes byte
+      // chưa được ack, server ack lũy tiến (offset liên tục cao nhất)
+      const win = transfer.window || { chunks: 1, bytes: this.chunkSize };
+      const maxWaitMs = Math.max(5000, Math.ceil(this.chunkSize / 10240) * 100); // Tối thiểu 5s, thêm 100ms cho mỗi 10KB
+      transfer._sendOffset = transfer.bytesSent;
+      transfer._inFlight = [];
+
       while (
         transfer.status === "active" &&
         transfer.bytesSent < transfer.size &&
         !transfer._stopCurrentLoop && // Kiểm tra flag để dừng loop
         transfer._loopId === currentLoopId // CRITICAL FIX: Verify loop ownership
       ) {
-        const start = transfer.bytesSent; // luôn lấy offset mới nhất
-        const end = Math.min(start + this.chunkSize, transfer.size);
-        const slice = transfer.file.slice(start, end);
-        const buffer = await slice.arrayBuffer();
-        const base64 = this.arrayBufferToBase64(buffer);
-
-        // CRITICAL FIX: Double-check loop ownership before sending
-        if (
-          transfer._loopId !== currentLoopId ||
-          transfer.status !== "active" ||
-          transfer._stopCurrentLoop
-        ) {
-          console.log("Upload stopped or ownership changed, breaking loop");
-          break;
-        }
-
-        // Đánh dấu đang đợi phản hồi
-        transfer._waitingForAck = true;
-
-        // gửi chunk
-        this.send({
-          action: "chunk",
-          fileId: transfer.id,
-          offset: start,
-          data: base64,
-        });
-
-        // Đợi server phản hồi chunk-ack với timeout động dựa vào chunk size
-        let waitCount = 0;
-        const maxWaitTime = Math.max(50, Math.ceil(this.chunkSize / 10240)); // Tối thiểu 5s, thêm 1s cho mỗi 10KB
+        // Bỏ các chunk đã được ack khỏi danh sách đang bay
         while (
-          transfer._waitingForAck &&
-          transfer.status === "active" &&
-          !transfer._stopCurrentLoop &&
-          transfer._loopId === currentLoopId && // CRITICAL FIX: Check ownership
-          waitCount < maxWaitTime
+          transfer._inFlight.length &&
+          transfer._inFlight[0] <= transfer.bytesSent
         ) {
-          await new Promise((r) => setTimeout(r, 100)); // Wait 100ms
-          waitCount++;
+          transfer._inFlight.shift();
         }
 
-        // CRITICAL FIX: Better timeout handling
-        if (waitCount >= maxWaitTime) {
+        const windowFull =
+          transfer._inFlight.length >= win.chunks ||
+          transfer._sendOffset - transfer.bytesSent >= win.bytes;
+
+        if (transfer._sendOffset >= transfer.size || windowFull) {
+          // Đợi ack tiếp theo (hoặc pause/stop/mismatch đánh thức loop)
+          const acked = await this.waitForAck(transfer, maxWaitMs);
+          if (
+            transfer.status !== "active" ||
+            transfer._stopCurrentLoop ||
+            transfer._loopId !== currentLoopId
+          ) {
+            break;
+          }
+          if (acked) continue;
+
+          // CRITICAL FIX: Better timeout handling
           console.warn(
-            `Timeout waiting for chunk-ack after ${
-              maxWaitTime * 100
-            }ms, will retry connection`
+            `Timeout waiting for chunk-ack after ${maxWaitMs}ms, will retry connection`
           );
-          transfer._waitingForAck = false;
 
           // Instead of setting error, try to reconnect WebSocket
           if (this.ws.readyState !== WebSocket.OPEN) {
@@ -1237,14 +1319,36 @@ class FlexTransferHub {
           this.renderTransfers();
           break;
         }
+
+        const start = transfer._sendOffset;
+        const end = Math.min(start + this.chunkSize, transfer.size);
+        const slice = transfer.file.slice(start, end);
+        const buffer = await slice.arrayBuffer();
+
+        // CRITICAL FIX: Double-check loop ownership before sending
         if (
+          transfer._loopId !== currentLoopId ||
           transfer.status !== "active" ||
           transfer._stopCurrentLoop ||
-          transfer._loopId !== currentLoopId
+          transfer._sendOffset !== start // offset-mismatch đã rewind
         ) {
-          transfer._waitingForAck = false;
+          console.log("Upload stopped or ownership changed, breaking loop");
           break;
         }
+
+        // gửi chunk
+        if (transfer.chunkMode === "binary") {
+          this.sendBinary(this.encodeChunkFrame(transfer.id, start, buffer));
+        } else {
+          this.send({
+            action: "chunk",
+            fileId: transfer.id,
+            offset: start,
+            data: this.arrayBufferToBase64(buffer),
+          });
+        }
+        transfer._sendOffset = end;
+        transfer._inFlight.push(end);
       }
 
       if (transfer.status === "active" && transfer.bytesSent >= transfer.size) {
@@ -1278,6 +1382,243 @@ class FlexTransferHub {
     }
   }
 
+  // ===== Upload thẳng vào file manager qua HTTP (/api/uploads) =====
+  // POST tạo phiên, PATCH gửi tiếp từ offset server đã ghi nhận, POST finalize đưa file vào kho.
+  // Pause hủy request đang chạy (server giữ phần đã nhận), resume hỏi lại offset rồi gửi tiếp.
+  httpUploadRequest(transfer, method, url, options = {}) {
+    const { body = null, headers = {}, onProgress = null } = options;
+    return new Promise((resolve, reject) => {
+      const xhr = new XMLHttpRequest();
+      xhr.open(method, url);
+      xhr.withCredentials = true;
+      if (this.authToken) {
+        xhr.setRequestHeader("Authorization", `Bearer ${this.authToken}`);
+      }
+      Object.entries(headers).forEach(([name, value]) =>
+        xhr.setRequestHeader(name, value)
+      );
+      if (onProgress) {
+        xhr.upload.onprogress = (e) => onProgress(e.loaded);
+      }
+      xhr.onload = () => {
+        transfer._xhr = null;
+        let data = {};
+        try {
+          data = JSON.parse(xhr.responseText || "{}");
+        } catch {
+          /* body không phải JSON */
+        }
+        resolve({ status: xhr.status, data });
+      };
+      xhr.onerror = () => {
+        transfer._xhr = null;
+        reject(new Error("Network error"));
+      };
+      xhr.onabort = () => {
+        transfer._xhr = null;
+        const error = new Error("Request aborted");
+        error.aborted = true;
+        reject(error);
+      };
+      transfer._xhr = xhr;
+      xhr.send(body);
+    });
+  }
+
+  // Lỗi từ response; 4xx (trừ 404/409 đã xử lý riêng) không thử lại
+  httpUploadError(res) {
+    const error = new Error(
+      (res.data && res.data.error) || `Server responded with ${res.status}`
+    );
+    error.fatal = res.status >= 400 && res.status < 500;
+    return error;
+  }
+
+  setHttpUploadOffset(transfer, offset) {
+    transfer.bytesSent = Math.min(offset || 0, transfer.size);
+    transfer.progress = Math.min(
+      100,
+      (transfer.bytesSent / Math.max(transfer.size, 1)) * 100
+    );
+    transfer.speed = this.formatSpeed(this.computeInstantSpeed(transfer));
+    this.throttledRender();
+  }
+
+  async httpUploadLoop(transfer) {
+    if (transfer._loopRunning) {
+      console.log("httpUploadLoop exiting - already running");
+      return;
+    }
+    transfer._loopRunning = true;
+    transfer._stopCurrentLoop = false;
+    let failures = 0;
+
+    try {
+      if (!transfer.file) {
+        transfer.status = "error";
+        transfer.error =
+          "File object missing. Please try uploading the file again.";
+        return;
+      }
+
+      while (
+        ["active", "completing"].includes(transfer.status) &&
+        !transfer._stopCurrentLoop
+      ) {
+        try {
+          if (!transfer.uploadUrl) {
+            const res = await this.httpUploadRequest(
+              transfer,
+              "POST",
+              this.uploadApiUrl,
+              {
+                headers: { "Content-Type": "application/json" },
+                body: JSON.stringify({
+                  file_name: transfer.name,
+                  file_size: transfer.size,
+                  file_id: transfer.id,
+                }),
+              }
+            );
+            if (res.status !== 200 && res.status !== 201) {
+              throw this.httpUploadError(res);
+            }
+            transfer.uploadUrl = `${this.uploadApiUrl}/${res.data.upload_id}`;
+            transfer._offsetUnknown = false;
+            this.setHttpUploadOffset(transfer, res.data.offset);
+          } else if (transfer._offsetUnknown) {
+            const res = await this.httpUploadRequest(
+              transfer,
+              "GET",
+              transfer.uploadUrl
+            );
+            if (res.status === 404) {
+              // Phiên đã hết hạn/bị dọn: tạo phiên mới từ đầu
+              transfer.uploadUrl = null;
+              this.setHttpUploadOffset(transfer, 0);
+              continue;
+            }
+            if (res.status !== 200) throw this.httpUploadError(res);
+            transfer._offsetUnknown = false;
+            this.setHttpUploadOffset(transfer, res.data.offset);
+          }
+
+          if (transfer.bytesSent >= transfer.size) {
+            transfer.status = "completing";
+            this.renderTransfers();
+            const res = await this.httpUploadRequest(
+              transfer,
+              "POST",
+              `${transfer.uploadUrl}/finalize`
+            );
+            if (res.status === 200 && res.data.success) {
+              this.completeHttpUpload(transfer, res.data.file_id);
+              break;
+            }
+            if (res.status === 400 && typeof res.data.offset === "number") {
+              // Server chưa nhận đủ: gửi tiếp từ offset server báo
+              transfer.status = "active";
+              this.setHttpUploadOffset(transfer, res.data.offset);
+              continue;
+            }
+            if (res.status === 400) {
+              // Hash không khớp: server đã bỏ phiên, lần thử sau upload lại từ đầu
+              transfer.uploadUrl = null;
+            }
+            throw this.httpUploadError(res);
+          }
+
+          const start = transfer.bytesSent;
+          const end = Math.min(start + this.httpPatchSize, transfer.size);
+          const res = await this.httpUploadRequest(
+            transfer,
+            "PATCH",
+            transfer.uploadUrl,
+            {
+              headers: {
+                "Content-Type": "application/octet-stream",
+                "Upload-Offset": String(start),
+              },
+              body: transfer.file.slice(start, end),
+              onProgress: (loaded) => {
+                if (transfer.status === "active") {
+                  this.setHttpUploadOffset(transfer, start + loaded);
+                }
+              },
+            }
+          );
+          if (res.status === 409) {
+            console.warn(
+              `Fixing offset mismatch for ${transfer.id}: ${start} → ${res.data.offset}`
+            );
+            this.setHttpUploadOffset(transfer, res.data.offset);
+            continue;
+          }
+          if (res.status === 404) {
+            transfer.uploadUrl = null;
+            this.setHttpUploadOffset(transfer, 0);
+            continue;
+          }
+          if (res.status !== 200) throw this.httpUploadError(res);
+          this.setHttpUploadOffset(transfer, res.data.offset);
+          failures = 0;
+        } catch (error) {
+          // Pause/stop hủy request đang chạy
+          if (error.aborted || transfer._stopCurrentLoop) break;
+          if (transfer.status === "completing") transfer.status = "active";
+
+          if (error.fatal) {
+            transfer.status = "error";
+            transfer.error = error.message;
+            this.showNotification(error.message, "error");
+            break;
+          }
+          failures += 1;
+          if (failures > this.httpRetryLimit) {
+            transfer.status = "paused";
+            transfer._offsetUnknown = true;
+            this.showNotification(
+              `Connection lost for ${transfer.name}. Click Resume to retry.`,
+              "warning"
+            );
+            break;
+          }
+          // Phần body đã gửi có thể đã được server ghi nhận: hỏi lại offset rồi gửi tiếp
+          console.warn(
+            `HTTP upload error for ${transfer.id} (attempt ${failures}):`,
+            error.message
+          );
+          transfer._offsetUnknown = true;
+          await new Promise((resolve) =>
+            setTimeout(resolve, Math.min(1000 * 2 ** (failures - 1), 15000))
+          );
+        }
+      }
+    } catch (error) {
+      console.error("HTTP upload loop error:", error);
+      transfer.status = "error";
+      transfer.error = error.message || "Upload failed";
+    } finally {
+      transfer._loopRunning = false;
+      this.renderTransfers();
+      this.updateStatusCards();
+      if (transfer.status !== "active") this.maybeStartNextUploads();
+    }
+  }
+
+  completeHttpUpload(transfer, remoteFileId) {
+    transfer.status = "completed";
+    transfer.progress = 100;
+    transfer.speed = "0 KB/s";
+    transfer.remoteFileId = remoteFileId;
+    transfer.endTime = new Date();
+    transfer.uploadTimeDisplay = this.formatUploadTime(transfer.endTime);
+    console.log(`🎯 Transfer completed via HTTP upload: ${transfer.name}`);
+
+    // Save completed file to sessionStorage
+    this.saveCompletedFileToSession(transfer);
+  }
+
   // Retry failed upload
   retryUpload(transfer) {
     if (!transfer || transfer.type !== "upload") return;
@@ -1306,6 +1647,23 @@ class FlexTransferHub {
     this.maybeStartNextUploads();
   }
 
+  // Binary chunk frame (khớp với backend/protocol.py):
+  // uint16 fileId length | uint64 offset | uint32 data length | fileId | data
+  encodeChunkFrame(fileId, offset, buffer) {
+    const idBytes = new TextEncoder().encode(fileId);
+    const headerSize = 14;
+    const frame = new Uint8Array(
+      headerSize + idBytes.length + buffer.byteLength
+    );
+    const view = new DataView(frame.buffer);
+    view.setUint16(0, idBytes.length);
+    view.setBigUint64(2, BigInt(offset));
+    view.setUint32(10, buffer.byteLength);
+    frame.set(idBytes, headerSize);
+    frame.set(new Uint8Array(buffer), headerSize + idBytes.length);
+    return frame.buffer;
+  }
+
   arrayBufferToBase64(buffer) {
     const bytes = new Uint8Array(buffer);
     let binary = "";
@@ -1447,6 +1805,9 @@ class FlexTransferHub {
     );
     const maxConcurrentValue = document.getElementById("max-concurrent-value");
     const chunkSizeSelect = document.getElementById("chunk-size-select");
+    const uploadTransportSelect = document.getElementById(
+      "upload-transport-select"
+    );
     const autoStartQueue = document.getElementById("auto-start-queue");
 
     // Update slider value display
@@ -1461,6 +1822,7 @@ class FlexTransferHub {
       maxConcurrentSlider.value = this.maxConcurrentUploads;
       maxConcurrentValue.textContent = this.maxConcurrentUploads;
       chunkSizeSelect.value = Math.floor(this.chunkSize / 1024);
+      uploadTransportSelect.value = this.uploadTransport;
     });
 
     // Close modal
@@ -1479,11 +1841,16 @@ class FlexTransferHub {
     applySettings.addEventListener("click", () => {
       this.maxConcurrentUploads = parseInt(maxConcurrentSlider.value);
       this.chunkSize = parseInt(chunkSizeSelect.value) * 1024;
+      // Chỉ áp dụng cho upload mới, upload đang chạy giữ đường cũ
+      this.uploadTransport = uploadTransportSelect.value;
+      localStorage.setItem("upload_transport", this.uploadTransport);
 
       this.showNotification(
         `Settings updated: ${
           this.maxConcurrentUploads
-        } concurrent uploads, ${Math.floor(this.chunkSize / 1024)}KB chunks`,
+        } concurrent uploads, ${Math.floor(this.chunkSize / 1024)}KB chunks, ${
+          this.uploadTransport === "http" ? "direct HTTP" : "WebSocket"
+        } uploads`,
         "success"
       );
       this.updateStatusCards();
@@ -2466,6 +2833,13 @@ class FlexTransferHub {
           this.renderTransfers();
           return;
         }
+        if (!transfer.uploadUrl && this.uploadTransport === "http") {
+          transfer.transport = "http";
+        }
+        if (transfer.transport === "http") {
+          this.startUpload(transfer);
+          return;
+        }
         // Chỉ gửi 'start', CHƯA upload cho đến khi có start-ack
         transfer.status = "starting";
         this.send({
@@ -2473,6 +2847,9 @@ class FlexTransferHub {
           fileId: transfer.id,
           fileName: transfer.name,
           fileSize: transfer.size,
+          chunkMode: "binary",
+          window: this.uploadWindow,
+          eventTick: this.eventTick,
         });
       }
     } else {
@@ -2498,9 +2875,16 @@ class FlexTransferHub {
 
         transfer.status = "paused";
         transfer._stopCurrentLoop = true; // Dừng upload loop
+        this.wakeUploadLoop(transfer);
         transfer._resuming = false; // Reset resuming flag
-        // console.log("Sending pause command to server for:", transfer.id);
-        this.send({ action: "pause", fileId: transfer.id });
+        if (transfer.transport === "http") {
+          // Server giữ phần body đã nhận, resume hỏi lại offset
+          transfer._offsetUnknown = true;
+          if (transfer._xhr) transfer._xhr.abort();
+        } else {
+          // console.log("Sending pause command to server for:", transfer.id);
+          this.send({ action: "pause", fileId: transfer.id });
+        }
       }
     } else if (transfer.type === "download") {
       // For real downloads
@@ -2560,6 +2944,14 @@ class FlexTransferHub {
 
     console.log("Starting resume process for:", transfer.id);
 
+    if (transfer.transport === "http") {
+      transfer.status = "active";
+      transfer._offsetUnknown = true;
+      this.renderTransfers();
+      this.httpUploadLoop(transfer);
+      return;
+    }
+
     // CRITICAL FIX: Set stronger locks to prevent race conditions
     transfer._resuming = true;
     transfer._stopCurrentLoop = false; // Reset stop flag
@@ -2607,6 +2999,7 @@ class FlexTransferHub {
       // Đặt trạng thái stopped và dừng loop ngay lập tức
       transfer.status = "stopped";
       transfer._stopCurrentLoop = true; // Dừng upload loop ngay lập tức
+      this.wakeUploadLoop(transfer);
       transfer._resuming = false; // Reset resuming flag
       transfer._waitingForAck = false; // Reset waiting flag
       transfer.progress = Math.min(
@@ -2614,6 +3007,15 @@ class FlexTransferHub {
         (transfer.bytesSent / Math.max(transfer.size, 1)) * 100
       );
 
+      if (transfer.transport === "http") {
+        if (transfer._xhr) transfer._xhr.abort();
+        this.abortHttpUpload(transfer);
+        this.renderTransfers();
+        this.updateStatusCards();
+        this.maybeStartNextUploads();
+        return;
+      }
+
       // Chờ một chút để đảm bảo upload loop đã dừng hoàn toàn
       setTimeout(() => {
         // Gửi lệnh stop đến server sau khi loop đã dừng
@@ -2643,6 +3045,27 @@ class FlexTransferHub {
     }
   }
 
+  // Hủy phiên upload HTTP (xóa dữ liệu đã nhận) rồi bỏ transfer khỏi danh sách như stop-ack
+  async abortHttpUpload(transfer) {
+    if (transfer.uploadUrl) {
+      try {
+        await fetch(transfer.uploadUrl, {
+          method: "DELETE",
+          credentials: "include",
+          headers: { Authorization: `Bearer ${this.authToken}` },
+        });
+      } catch (error) {
+        // Phiên còn sót được file manager dọn khi hết hạn
+        console.warn("Failed to abort HTTP upload:", error);
+      }
+      transfer.uploadUrl = null;
+    }
+    const idx = this.transfers.findIndex((t) => t.id === transfer.id);
+    if (idx > -1) this.transfers.splice(idx, 1);
+    this.updateStatusCards();
+    this.renderTransfers();
+  }
+
   // FIX: Add restart functionality for completed files
   restartTransfer(transfer) {
     if (!transfer) {